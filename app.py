@@ -4,19 +4,38 @@ Application Web FastAPI pour le Chatbot UM5
 Interface de démonstration avec API REST
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
-from pydantic import BaseModel
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
 import torch
 import numpy as np
-from transformers import XLMRobertaTokenizer, XLMRobertaForSequenceClassification
+from transformers import XLMRobertaTokenizer, XLMRobertaTokenizerFast, XLMRobertaForSequenceClassification
 from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
+import os
 import json
+import math
 import time
-from typing import Dict, List, Optional
+import sys
+import heapq
+import hmac
+import asyncio
+import base64
+import bisect
+import email.utils
+import gzip
+import hashlib
+import mimetypes
+import queue
+import re
+import shutil
+import threading
+import unicodedata
+from array import array
+from collections import Counter, OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
 import logging
 
 # Configuration du logging
@@ -32,28 +51,2379 @@ CONFIG = {
     'model_path': 'output/um5_hybrid_model',
     'vector_db_path': 'output/vector_database.npz',
     'knowledge_base_path': 'output/knowledge_base.json',
+    # Format compact mmap (convert_knowledge_base.py) ; prioritaire s'il existe
+    'kb_store_path': 'output/kb_store',
+    # Mises à jour à chaud de la base (API d'administration, surveillance de fichier)
+    'kb_journal_path': 'output/kb_journal.jsonl',  # Changements depuis la dernière compaction
+    'kb_watch_path': None,         # Fichier JSON (format knowledge_base.json) synchronisé à chaud
+    'kb_watch_interval_s': 2.0,
+    'kb_compact_ratio': 0.1,       # Compaction quand delta + suppressions > ratio × base
+    'kb_compact_min_rows': 1000,
+    'kb_writer': True,             # False : pas de journal, compaction en mémoire seulement (workers secondaires)
+    'kb_verify_checksum': False,   # Recalculer la somme de contrôle au chargement (lit toute la matrice) ; sinon modèle, dimension et taille
+    'embedding_model': 'sentence-transformers/paraphrase-multilingual-mpnet-base-v2',
+    'eager_embedding_model': False,  # False = chargé au premier passage RAG
+    # Backend d'inférence : 'torch' (fp32), 'torch_int8' (quantification dynamique)
+    # ou 'onnx' (onnxruntime, modèles exportés par export_inference_backends.py)
+    'inference_backend': 'torch',
+    'onnx_model_dir': 'output/um5_hybrid_model_onnx',
+    # 'hybrid' (XLM-R + MPNet) ou 'single_encoder' (MPNet + tête d'intention linéaire)
+    'pipeline_mode': 'hybrid',
+    'intent_head_path': 'output/intent_head.npz',  # Produit par fit_intent_head.py
     'intent_threshold': 0.6,
     'similarity_threshold': 0.7,
     'top_k': 3,
+    'embedding_dtype': 'float32',  # 'float16' divise par 2 la mémoire de la base vectorielle
+    # Index vectoriel : 'flat' (exact) ou 'ivf' (approximatif, construit par build_vector_index.py)
+    'vector_index': 'flat',
+    'vector_index_path': 'output/vector_index.npz',
+    'ivf_nprobe': 8,            # Listes inversées explorées par requête
+    # Recherche : 'dense' (embeddings seuls), 'hybrid' (BM25 + dense fusionnés)
+    # ou 'prefilter' (BM25 sélectionne les candidats, le dense les reclasse)
+    'retrieval_mode': 'dense',
+    'lexical_index_path': 'output/lexical_index.npz',
+    'lexical_candidates': 100,  # Candidats par liste (lexicale, dense) avant fusion / reclassement
+    'hybrid_fusion': 'rrf',     # 'rrf' (fusion par rangs) ou 'weighted' (scores normalisés)
+    'hybrid_alpha': 0.5,        # Mode weighted : poids du cosinus (1 - alpha pour BM25)
+    'rrf_k': 60,
+    # Recherche dense restreinte aux partitions des intentions probables
+    # (copie des embeddings triée par intention : mémoire vectorielle × 2)
+    'intent_partitions': False,
+    'intent_partition_top_n': 2,  # Intention prédite + centroïdes d'intention les plus proches
+    # Langue des requêtes (trigrammes de caractères) : fr, en, ar, ary (darija)
+    'language_detection': True,   # False : toutes les requêtes sans langue fournie → default_language
+    'default_language': 'fr',
+    'language_profiles_path': None,  # JSONL {"text", "language"} pour apprendre les profils (sinon amorce intégrée)
+    # Recherche dense limitée au segment de la langue de la requête, élargie
+    # à toute la base sous le seuil de similarité (prioritaire sur intent_partitions)
+    'language_shards': False,
+    # Seuils par langue (sinon intent_threshold / similarity_threshold), ex. :
+    # {'ary': {'intent_threshold': 0.5, 'similarity_threshold': 0.65}}
+    'language_thresholds': {},
+    # Micro-batching de la classification d'intention
+    'batch_window_ms': 10,      # Fenêtre de regroupement des requêtes
+    'max_batch_size': 16,       # 1 = désactivé ; en pratique ≤ inference_workers (un thread bloqué par requête)
+    'max_padding_ratio': 2.0,   # Lot coupé quand une séquence dépasse ratio × la plus courte (None = jamais)
+    # Tokenizer Rust (tokenizer.json écrit par verify_tokenizer.py après vérification)
+    'fast_tokenizer': True,
+    # Exécuteur d'inférence (hors boucle asyncio)
+    'inference_workers': 4,     # Threads dédiés à process_query
+    'max_queue_depth': 32,      # Requêtes en attente au-delà des workers → 503
+    'queue_slo_ms': 2000,       # Attente estimée max en file → 503 + Retry-After (None = pas de SLO)
+    'priority_cost_ms': 50,     # Retard de priorité par unité de coût (requêtes RAG derrière les intentions)
+    # Coûts attendus (unité = réponse d'intention), pour la file et la limitation de débit
+    'route_costs': {'intent_classification': 1.0, 'rag_retrieval': 4.0, 'fallback': 4.0},
+    'cached_cost': 0.2,         # Réponse servie par le cache
+    # Limitation de débit par client (seau à jetons en unités de coût)
+    'rate_limit_rps': None,     # Unités de coût par seconde et par client (None = désactivée)
+    'rate_limit_burst': 20,     # Taille du seau
+    'rate_limit_max_clients': 10000,  # Clients suivis (LRU)
+    'trust_forwarded_for': False,     # Derrière un proxy : client = premier X-Forwarded-For
+    # Clés d'API (en-tête X-API-Key) : un seau par clé au lieu d'un par adresse IP
+    'api_keys': [k for k in os.environ.get('UM5_API_KEYS', '').split(',') if k],
+    'torch_threads': None,      # Threads intra-op PyTorch (None = défaut torch)
+    # Recherche RAG spéculative, en parallèle de la classification
+    'speculative_retrieval': 'off',  # 'off', 'always' ou 'adaptive'
+    'speculative_min_rag_rate': 0.3, # Mode adaptive : part de requêtes RAG récentes requise
+    'speculative_window': 200,       # Mode adaptive : requêtes récentes considérées
+    # Cache des réponses (exact + sémantique)
+    'query_cache_size': 10000,       # Entrées du cache exact (0 = désactivé)
+    'query_cache_ttl_s': 3600,
+    'semantic_cache_size': 2048,     # Entrées du cache sémantique
+    'semantic_cache_distance': 0.05, # Distance cosinus max (None = tier sémantique désactivé)
+    # Sessions de conversation (questions de suivi, champ session_id)
+    'session_max': 10000,       # Sessions gardées (LRU, 0 = désactivées)
+    'session_memory_mb': 64,    # Mémoire max des sessions (mesurée par session)
+    'session_ttl_s': 1800,      # Éviction après inactivité
+    'session_max_turns': 4,     # Questions récentes gardées par session
+    'session_max_chars': 256,   # Longueur max d'une question gardée
+    'session_decay': 0.5,       # Poids du contexte précédent dans la moyenne mobile
+    'session_context_weight': 1.0,  # Poids du contexte mélangé à la requête de suivi
+    # Caches d'embeddings (float16) et de tokenisation
+    'embedding_cache_size': 4096,
+    'token_cache_size': 8192,
+    # Traitement par lots (/api/chat/batch, batch_query.py)
+    'bulk_batch_size': 64,      # Requêtes par forward pass (regroupées par longueur)
+    'max_bulk_queries': 1000,   # Taille max d'un lot HTTP
+    # Jeton des endpoints d'administration (profileur...) ; None = désactivés
+    'admin_token': os.environ.get('UM5_ADMIN_TOKEN'),
 }
 
+MAX_SEQ_LENGTH = 128
+
+# ============================================================================
+# MODÈLES PYDANTIC
+# ============================================================================
+
+class QueryRequest(BaseModel):
+    """Requête utilisateur"""
+    message: str
+    language: Optional[str] = Field(None, max_length=16)  # fr, en, ar ou ary (darija) ; détectée si absente ou inconnue
+    session_id: Optional[str] = Field(None, max_length=64)  # Conversation (questions de suivi)
+    include_timings: bool = False  # Détail des durées par étape dans la réponse
+
+class QueryResponse(BaseModel):
+    """Réponse du chatbot"""
+    answer: str
+    method: str  # "intent", "rag", "fallback"
+    confidence: float
+    intent: Optional[str] = None
+    sources: Optional[List[Dict]] = None
+    latency_ms: float
+    cache: Optional[str] = None  # "exact", "semantic" ou None
+    timings: Optional[Dict[str, float]] = None  # ms par étape (si demandé)
+    followup: bool = False  # Réponse trouvée grâce au contexte de la session
+    language: Optional[str] = None  # Langue fournie ou détectée (fr, en, ar, ary)
+
+class BatchQueryRequest(BaseModel):
+    """Lot de requêtes (évaluation, préchauffage des caches)"""
+    messages: List[str]
+    language: Optional[str] = Field(None, max_length=16)  # Langue de tout le lot ; détectée par message si absente ou inconnue
+
+class KBEntry(BaseModel):
+    """Paire Q-A de la base de connaissances"""
+    question: str
+    answer: str
+    intent: str
+
+class KBUpdateRequest(BaseModel):
+    """Mise à jour à chaud (entrées identifiées par leur question)"""
+    upserts: List[KBEntry] = []
+    deletes: List[str] = []  # Questions à supprimer
+
+class BatchQueryResponse(BaseModel):
+    """Réponses du lot, dans l'ordre des requêtes"""
+    results: List[QueryResponse]
+    latency_ms: float
+
+# ============================================================================
+# MÉTRIQUES
+# ============================================================================
+
+LATENCY_BUCKETS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+class Histogram:
+    """Histogramme à buckets fixes (thread-safe)"""
+    
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # Dernier bucket = +Inf
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+    
+    def observe(self, value: float):
+        """Enregistrer une observation"""
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[idx] += 1
+            self.count += 1
+            self.sum += value
+    
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimer un quantile (borne supérieure du bucket)
+        
+        Au-delà de la dernière borne, retourne cette borne (valeur finie :
+        /api/stats est sérialisé en JSON strict).
+        """
+        with self._lock:
+            counts, total = list(self.counts), self.count
+        if total == 0:
+            return None
+        rank = q * total
+        cumulative = 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            if cumulative >= rank:
+                return bound
+        return self.buckets[-1]
+    
+    def snapshot(self) -> Dict:
+        """Vue sérialisable de l'histogramme"""
+        with self._lock:
+            counts, total, acc = list(self.counts), self.count, self.sum
+        labels = [f"<={b:g}" for b in self.buckets] + ["+Inf"]
+        return {
+            'count': total,
+            'mean': acc / total if total else None,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+            'buckets': dict(zip(labels, counts)),
+        }
+
+def render_histogram(name: str, histogram: Histogram, labels: Dict[str, str]) -> List[str]:
+    """Lignes au format texte Prometheus (buckets cumulatifs)"""
+    with histogram._lock:
+        counts, total, acc = list(histogram.counts), histogram.count, histogram.sum
+    lines, cumulative = [], 0
+    for bound, n in zip(list(histogram.buckets) + ['+Inf'], counts):
+        cumulative += n
+        le = bound if bound == '+Inf' else f"{bound:g}"
+        lines.append(f"{name}_bucket{format_labels({**labels, 'le': le})} {cumulative}")
+    lines.append(f"{name}_sum{format_labels(labels)} {acc}")
+    lines.append(f"{name}_count{format_labels(labels)} {total}")
+    return lines
+
+def format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in sorted(labels.items())) + '}'
+
+class MetricsRegistry:
+    """Histogrammes et compteurs étiquetés, exposés au format Prometheus"""
+    
+    def __init__(self):
+        self._histograms = {}  # (nom, labels triés) -> Histogram
+        self._counters = defaultdict(float)
+        self._lock = threading.Lock()
+    
+    def histogram(self, name: str, buckets: Sequence[float] = LATENCY_BUCKETS_MS,
+                  **labels) -> Histogram:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(buckets)
+            return self._histograms[key]
+    
+    def inc(self, name: str, value: float = 1, **labels):
+        with self._lock:
+            self._counters[(name, tuple(sorted(labels.items())))] += value
+    
+    @contextmanager
+    def time(self, name: str, **labels):
+        """Chronométrer un bloc (ms) dans l'histogramme `name`"""
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.histogram(name, **labels).observe((time.perf_counter_ns() - start) / 1e6)
+    
+    def render(self) -> List[str]:
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+        lines, typed = [], set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{format_labels(dict(labels))} {value:g}")
+        for (name, labels), histogram in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            lines.extend(render_histogram(name, histogram, dict(labels)))
+        return lines
+
+class StageTimer:
+    """Durées des étapes d'une requête (perf_counter_ns, en ms)"""
+    
+    def __init__(self):
+        self.start_ns = time.perf_counter_ns()
+        self.stages = {}
+    
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            elapsed_ms = (time.perf_counter_ns() - start) / 1e6
+            self.stages[name] = self.stages.get(name, 0.0) + elapsed_ms
+    
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter_ns() - self.start_ns) / 1e6
+
+class SamplingProfiler:
+    """Profileur par échantillonnage des piles, activable à chaud
+    
+    Un thread relève périodiquement la pile des threads d'inférence
+    (sys._current_frames) ; le résultat est au format « collapsed stacks »
+    de flamegraph.pl / speedscope.
+    """
+    
+    THREAD_PREFIXES = ('inference', 'intent-batcher', 'speculative', 'loader')
+    MAX_DEPTH = 64
+    
+    def __init__(self):
+        self.stacks = Counter()
+        self.samples = 0
+        self.interval_ms = None
+        self._thread = None
+        self._stop = threading.Event()
+    
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+    
+    def start(self, interval_ms: float = 5):
+        """Démarrer (remet les échantillons à zéro)"""
+        self.stop()
+        self.stacks, self.samples, self.interval_ms = Counter(), 0, interval_ms
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        if self.running:
+            self._stop.set()
+            self._thread.join()
+    
+    def _run(self):
+        while not self._stop.wait(self.interval_ms / 1000):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if names.get(ident, '').startswith(self.THREAD_PREFIXES):
+                    self.stacks[self._collapse(frame)] += 1
+            self.samples += 1
+    
+    def _collapse(self, frame) -> str:
+        stack = []
+        while frame is not None and len(stack) < self.MAX_DEPTH:
+            code = frame.f_code
+            stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+    
+    def collapsed(self) -> str:
+        return '\n'.join(f"{stack} {n}" for stack, n in self.stacks.most_common())
+    
+    def stats(self) -> Dict:
+        return {'running': self.running, 'interval_ms': self.interval_ms,
+                'samples': self.samples, 'distinct_stacks': len(self.stacks)}
+
+# ============================================================================
+# RECHERCHE VECTORIELLE
+# ============================================================================
+
+SCORING_CHUNK_ROWS = 65536  # Lignes converties en float32 à la fois (stockage float16)
+
+def normalize_rows(matrix: np.ndarray, dtype=np.float32) -> np.ndarray:
+    """Normaliser (L2) chaque ligne, en matrice contiguë du type demandé"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(matrix / norms, dtype=dtype)
+
+def dot_scores(queries: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+    """Produits scalaires (n_queries, n_docs) en précision float32"""
+    queries = np.asarray(queries, dtype=np.float32)
+    if matrix.dtype == np.float32:
+        return queries @ matrix.T
+    # NumPy n'a pas de BLAS float16 : conversion par blocs
+    scores = np.empty((queries.shape[0], matrix.shape[0]), dtype=np.float32)
+    for start in range(0, matrix.shape[0], SCORING_CHUNK_ROWS):
+        block = matrix[start:start + SCORING_CHUNK_ROWS].astype(np.float32)
+        scores[:, start:start + len(block)] = queries @ block.T
+    return scores
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices des k meilleurs scores (ordre décroissant), par sélection partielle"""
+    k = min(k, scores.shape[-1])
+    if k <= 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.intp)
+    if k < scores.shape[-1]:
+        candidates = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    else:
+        candidates = np.broadcast_to(np.arange(k), scores.shape[:-1] + (k,))
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=-1), axis=-1)
+    return np.take_along_axis(candidates, order, axis=-1)
+
+def nearest_centroids(matrix: np.ndarray, centroids: np.ndarray,
+                      chunk_rows: int = 16384) -> np.ndarray:
+    """Indice du centroïde le plus proche pour chaque ligne (par blocs)"""
+    assignments = np.empty(matrix.shape[0], dtype=np.int64)
+    for start in range(0, matrix.shape[0], chunk_rows):
+        block = matrix[start:start + chunk_rows]
+        assignments[start:start + len(block)] = dot_scores(block, centroids).argmax(axis=1)
+    return assignments
+
+def spherical_kmeans(matrix: np.ndarray, n_clusters: int, n_iter: int = 20,
+                     sample_size: Optional[int] = None, seed: int = 0) -> np.ndarray:
+    """K-means sphérique (cosinus) sur des lignes normalisées"""
+    rng = np.random.default_rng(seed)
+    if sample_size and sample_size < matrix.shape[0]:
+        sample = matrix[np.sort(rng.choice(matrix.shape[0], sample_size, replace=False))]
+    else:
+        sample = matrix
+    sample = np.asarray(sample, dtype=np.float32)
+    n_clusters = min(n_clusters, sample.shape[0])
+    
+    centroids = sample[rng.choice(sample.shape[0], n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        assignments = nearest_centroids(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        empty = np.bincount(assignments, minlength=n_clusters) == 0
+        # Réinitialiser les clusters vides sur des points aléatoires
+        sums[empty] = sample[rng.choice(sample.shape[0], int(empty.sum()))]
+        centroids = normalize_rows(sums)
+    return centroids
+
+class FlatIndex:
+    """Index exact (force brute sur toute la matrice)"""
+    
+    kind = 'flat'
+    
+    def __init__(self, embeddings: np.ndarray):
+        self.embeddings = embeddings
+    
+    def __len__(self) -> int:
+        return self.embeddings.shape[0]
+    
+    def search(self, queries: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-K (indices, scores) pour chaque requête normalisée"""
+        scores = dot_scores(queries, self.embeddings)
+        indices = top_k_indices(scores, top_k)
+        return indices, np.take_along_axis(scores, indices, axis=-1)
+    
+    def stats(self) -> Dict:
+        return {'kind': self.kind, 'size': len(self)}
+
+class IVFIndex:
+    """Index approximatif IVF (quantificateur grossier k-means)
+    
+    Les vecteurs sont répartis en listes inversées stockées à plat
+    (`list_ids` trié par liste, bornes dans `list_offsets`). Une requête
+    ne score que les `nprobe` listes dont le centroïde est le plus proche.
+    `source` est la somme de contrôle du manifeste de la base indexée.
+    """
+    
+    kind = 'ivf'
+    
+    def __init__(self, embeddings: np.ndarray, centroids: np.ndarray,
+                 list_offsets: np.ndarray, list_ids: np.ndarray, nprobe: int = 8,
+                 source: Optional[str] = None):
+        self.embeddings = embeddings
+        self.source = source
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.list_offsets = list_offsets
+        self.list_ids = list_ids
+        self.nprobe = nprobe
+    
+    def __len__(self) -> int:
+        return self.list_ids.shape[0]
+    
+    @classmethod
+    def build(cls, embeddings: np.ndarray, n_lists: int, n_iter: int = 20,
+              sample_size: Optional[int] = None, seed: int = 0, nprobe: int = 8) -> 'IVFIndex':
+        """Construire l'index (k-means puis affectation de tous les vecteurs)"""
+        centroids = spherical_kmeans(embeddings, n_lists, n_iter, sample_size, seed)
+        return cls.assign(embeddings, centroids, nprobe=nprobe)
+    
+    @classmethod
+    def assign(cls, embeddings: np.ndarray, centroids: np.ndarray, nprobe: int = 8) -> 'IVFIndex':
+        """Répartir les vecteurs dans les listes de centroïdes existants"""
+        assignments = nearest_centroids(embeddings, centroids)
+        list_ids = np.argsort(assignments, kind='stable')
+        counts = np.bincount(assignments, minlength=centroids.shape[0])
+        list_offsets = np.concatenate([[0], np.cumsum(counts)])
+        return cls(embeddings, centroids, list_offsets, list_ids, nprobe=nprobe)
+    
+    def save(self, path: str):
+        """Sauvegarder l'index (sans les vecteurs, déjà dans la base vectorielle)"""
+        np.savez(
+            path,
+            kind=np.array(self.kind),
+            centroids=self.centroids,
+            list_offsets=self.list_offsets,
+            list_ids=self.list_ids,
+            source=np.array(self.source or '')
+        )
+    
+    @classmethod
+    def load(cls, path: str, embeddings: np.ndarray, nprobe: int = 8) -> 'IVFIndex':
+        """Charger un index sauvegardé par `save`"""
+        data = np.load(path)
+        if str(data['kind']) != cls.kind:
+            raise ValueError(f"{path} n'est pas un index {cls.kind}")
+        source = str(data['source']) if 'source' in data.files else ''
+        return cls(embeddings, data['centroids'], data['list_offsets'],
+                   data['list_ids'], nprobe=nprobe, source=source or None)
+    
+    def search(self, queries: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-K approximatif (indices, scores) pour chaque requête normalisée"""
+        queries = np.asarray(queries, dtype=np.float32)
+        top_k = min(top_k, len(self))
+        indices = np.empty((queries.shape[0], top_k), dtype=np.intp)
+        scores = np.empty((queries.shape[0], top_k), dtype=np.float32)
+        list_order = np.argsort(-(queries @ self.centroids.T), axis=1)
+        
+        for row, (query, lists) in enumerate(zip(queries, list_order)):
+            # Explorer au moins nprobe listes et assez de candidats pour le Top-K
+            chunks, n_candidates = [], 0
+            for probed, lst in enumerate(lists):
+                if probed >= self.nprobe and n_candidates >= top_k:
+                    break
+                chunk = self.list_ids[self.list_offsets[lst]:self.list_offsets[lst + 1]]
+                chunks.append(chunk)
+                n_candidates += len(chunk)
+            candidates = np.concatenate(chunks)
+            
+            candidate_scores = dot_scores(query[None], self.embeddings[candidates])[0]
+            best = top_k_indices(candidate_scores, top_k)
+            indices[row] = candidates[best]
+            scores[row] = candidate_scores[best]
+        
+        return indices, scores
+    
+    def stats(self) -> Dict:
+        sizes = np.diff(self.list_offsets)
+        return {
+            'kind': self.kind,
+            'size': len(self),
+            'n_lists': int(self.centroids.shape[0]),
+            'nprobe': self.nprobe,
+            'max_list_size': int(sizes.max()) if len(sizes) else 0,
+        }
+
+def load_vector_index(config: Dict, embeddings: np.ndarray, source: Optional[str] = None):
+    """Charger l'index configuré (repli sur l'index exact si indisponible)
+    
+    `source` : somme de contrôle du manifeste de la base chargée. Si l'index
+    et la base en ont une, elles doivent être égales ; sinon seule la
+    taille est comparée (artefacts antérieurs au manifeste).
+    """
+    kind = config.get('vector_index', 'flat')
+    if kind == 'ivf':
+        path = config['vector_index_path']
+        if not os.path.exists(path):
+            logger.warning(f"⚠️  Index IVF introuvable ({path}), recherche exacte utilisée")
+        else:
+            index = IVFIndex.load(path, embeddings, nprobe=config.get('ivf_nprobe', 8))
+            if index.source and source:
+                if index.source == source:
+                    return index
+                logger.warning("⚠️  Index IVF obsolète (construit sur une autre base), recherche exacte utilisée")
+            elif len(index) == embeddings.shape[0]:
+                return index
+            else:
+                logger.warning("⚠️  Index IVF obsolète (taille différente), recherche exacte utilisée")
+    elif kind != 'flat':
+        raise ValueError(f"Index vectoriel inconnu : {kind}")
+    return FlatIndex(embeddings)
+
+class IntentPartitions:
+    """Base vectorielle regroupée par intention (ou par langue), en tranches contiguës
+    
+    `embeddings` est une copie des lignes triées par intention : la
+    partition p occupe `embeddings[offsets[p]:offsets[p + 1]]` et `rows`
+    donne la ligne d'origine de chaque vecteur. Les centroïdes servent à
+    compléter l'intention prédite par les intentions voisines.
+    """
+    
+    def __init__(self, labels: List[str], offsets: np.ndarray, rows: np.ndarray,
+                 embeddings: np.ndarray, centroids: np.ndarray):
+        self.labels = labels
+        self.label_ids = {label: i for i, label in enumerate(labels)}
+        self.offsets = offsets
+        self.rows = rows
+        self.embeddings = embeddings
+        self.centroids = centroids
+    
+    @classmethod
+    def build(cls, embeddings: np.ndarray, intents: Sequence[str]) -> 'IntentPartitions':
+        labels, codes = np.unique(np.asarray(intents, dtype=str), return_inverse=True)
+        rows = np.argsort(codes, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(labels)))])
+        partitioned = np.ascontiguousarray(embeddings[rows])
+        sums = np.add.reduceat(partitioned.astype(np.float32), offsets[:-1], axis=0)
+        return cls(labels.tolist(), offsets, rows, partitioned, normalize_rows(sums))
+    
+    def select(self, query: np.ndarray, intent: str, top_n: int) -> List[int]:
+        """Partitions à explorer : intention prédite, puis centroïdes les plus proches"""
+        selected = [self.label_ids[intent]] if intent in self.label_ids else []
+        for partition in np.argsort(-(self.centroids @ np.asarray(query, dtype=np.float32))):
+            if len(selected) >= top_n:
+                break
+            if partition not in selected:
+                selected.append(int(partition))
+        return selected
+    
+    def search(self, query: np.ndarray, partitions: List[int], top_k: int,
+               deleted: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-K (lignes d'origine, scores) dans les partitions choisies"""
+        spans = [slice(self.offsets[p], self.offsets[p + 1]) for p in partitions]
+        scores = np.concatenate([dot_scores(query[None], self.embeddings[span])[0] for span in spans])
+        rows = self.rows[np.concatenate([np.arange(span.start, span.stop) for span in spans])]
+        if deleted is not None and len(deleted):
+            scores[np.isin(rows, deleted)] = -np.inf
+        best = top_k_indices(scores, top_k)
+        return rows[best], scores[best]
+    
+    def stats(self) -> Dict:
+        sizes = np.diff(self.offsets)
+        return {'partitions': len(self.labels), 'max_partition_size': int(sizes.max()) if len(sizes) else 0}
+
+def knowledge_base_intents(knowledge_base) -> List[str]:
+    """Intention de chaque ligne (sans décoder les textes d'une base mmap)"""
+    if isinstance(knowledge_base, MappedKnowledgeBase):
+        return [knowledge_base.intent_labels[code] for code in knowledge_base.intent_codes]
+    return [entry['intent'] for entry in knowledge_base]
+
+# ============================================================================
+# RECHERCHE LEXICALE (BM25)
+# ============================================================================
+
+RETRIEVAL_MODES = ('dense', 'hybrid', 'prefilter')
+TOKEN_PATTERN = re.compile(r'\w+')
+
+def lexical_tokens(text: str) -> List[str]:
+    """Termes d'un texte normalisé (casse, accents), sans les lettres isolées"""
+    return [token for token in TOKEN_PATTERN.findall(normalize_text(text)) if len(token) > 1]
+
+def lexical_text(entry: Dict) -> str:
+    """Texte indexé d'une paire Q-A"""
+    return f"{entry['question']} {entry['answer']}"
+
+class BM25Index:
+    """Index inversé BM25 à postings contigus (format CSR)
+    
+    Les postings du terme t sont `doc_ids[offsets[t]:offsets[t + 1]]`,
+    avec leur poids BM25 précalculé (idf × saturation du tf). Le score
+    d'une requête est la somme, par `np.bincount`, des postings de ses
+    termes : aucune boucle Python sur les documents.
+    """
+    
+    kind = 'bm25'
+    
+    def __init__(self, vocabulary: Dict[str, int], offsets: np.ndarray, doc_ids: np.ndarray,
+                 weights: np.ndarray, n_docs: int, avgdl: float, max_idf: float):
+        self.vocabulary = vocabulary
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.n_docs = n_docs
+        self.avgdl = avgdl
+        self.max_idf = max_idf
+        self._idf = None
+    
+    def __len__(self) -> int:
+        return self.n_docs
+    
+    @classmethod
+    def build(cls, texts: Sequence[str], k1: float = 1.2, b: float = 0.75,
+              reference: Optional['BM25Index'] = None) -> 'BM25Index':
+        """Construire l'index
+        
+        Avec `reference`, l'idf et la longueur moyenne viennent de cet
+        index : un petit delta indexé à part reste scoré à l'échelle de
+        la base.
+        """
+        vocabulary = {}
+        term_col, doc_col = [], []
+        lengths = np.zeros(len(texts), dtype=np.float32)
+        for doc, text in enumerate(texts):
+            tokens = lexical_tokens(text)
+            lengths[doc] = len(tokens)
+            term_col.extend(vocabulary.setdefault(token, len(vocabulary)) for token in tokens)
+            doc_col.extend([doc] * len(tokens))
+        
+        # tf de chaque paire (terme, document), triées par terme puis document
+        n_docs = max(len(texts), 1)
+        pairs, tf = np.unique(np.array(term_col, dtype=np.int64) * n_docs
+                              + np.array(doc_col, dtype=np.int64), return_counts=True)
+        terms, docs = pairs // n_docs, pairs % n_docs
+        df = np.bincount(terms, minlength=len(vocabulary))
+        offsets = np.concatenate([[0], np.cumsum(df)]).astype(np.int64)
+        
+        if reference is None:
+            avgdl = max(float(lengths.mean()) if len(texts) else 0.0, 1.0)
+            idf = np.log1p((len(texts) - df + 0.5) / (df + 0.5))
+            max_idf = float(np.log1p((len(texts) + 0.5) / 0.5))
+        else:
+            avgdl, max_idf = reference.avgdl, reference.max_idf
+            idf = np.array([reference.term_idf(term) for term in vocabulary], dtype=np.float64)
+        
+        tf = tf.astype(np.float32)
+        norm = k1 * (1 - b + b * lengths[docs] / avgdl)
+        weights = idf[terms] * tf * (k1 + 1) / (tf + norm)
+        return cls(vocabulary, offsets, docs.astype(np.int32), weights.astype(np.float32),
+                   len(texts), avgdl, max_idf)
+    
+    def term_idf(self, term: str) -> float:
+        """idf d'un terme (celui d'un terme absent pour un terme inconnu)"""
+        if self._idf is None:
+            df = np.diff(self.offsets)
+            self._idf = np.log1p((self.n_docs - df + 0.5) / (df + 0.5))
+        term_id = self.vocabulary.get(term)
+        return self.max_idf if term_id is None else float(self._idf[term_id])
+    
+    def score(self, texts: Sequence[str]) -> np.ndarray:
+        """Scores BM25 (n_requêtes, n_docs) ; 0 sans terme commun"""
+        scores = np.zeros((len(texts), self.n_docs), dtype=np.float32)
+        for row, text in enumerate(texts):
+            terms = {self.vocabulary[t] for t in lexical_tokens(text) if t in self.vocabulary}
+            if not terms:
+                continue
+            spans = [slice(self.offsets[t], self.offsets[t + 1]) for t in terms]
+            scores[row] = np.bincount(
+                np.concatenate([self.doc_ids[span] for span in spans]),
+                weights=np.concatenate([self.weights[span] for span in spans]),
+                minlength=self.n_docs
+            )
+        return scores
+    
+    def save(self, path: str):
+        np.savez(
+            path,
+            terms=np.array(list(self.vocabulary), dtype=str),
+            offsets=self.offsets,
+            doc_ids=self.doc_ids,
+            weights=self.weights,
+            params=np.array([self.n_docs, self.avgdl, self.max_idf]),
+        )
+    
+    @classmethod
+    def load(cls, path: str) -> 'BM25Index':
+        data = np.load(path)
+        n_docs, avgdl, max_idf = data['params'].tolist()
+        vocabulary = {term: i for i, term in enumerate(data['terms'].tolist())}
+        return cls(vocabulary, data['offsets'], data['doc_ids'], data['weights'],
+                   int(n_docs), avgdl, max_idf)
+    
+    def stats(self) -> Dict:
+        return {'kind': self.kind, 'size': self.n_docs, 'terms': len(self.vocabulary),
+                'postings': int(len(self.doc_ids))}
+
+def load_lexical_index(config: Dict, knowledge_base) -> Optional[BM25Index]:
+    """Index BM25 de la base (chargé s'il est à jour, sinon construit et sauvegardé)"""
+    mode = config.get('retrieval_mode', 'dense')
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Mode de recherche inconnu : {mode}")
+    if mode == 'dense':
+        return None
+    
+    path = config.get('lexical_index_path')
+    if path and os.path.exists(path):
+        index = BM25Index.load(path)
+        if len(index) == len(knowledge_base):
+            return index
+        logger.warning("⚠️  Index BM25 obsolète (taille différente), reconstruction")
+    
+    start = time.perf_counter()
+    index = BM25Index.build([lexical_text(knowledge_base[row]) for row in range(len(knowledge_base))])
+    logger.info(f"   Index BM25 construit en {time.perf_counter() - start:.1f}s")
+    if path:
+        index.save(path)
+    return index
+
+# ============================================================================
+# BASE DE CONNAISSANCES MMAP
+# ============================================================================
+
+KB_STORE_FORMAT = 'um5-kb-store'
+KB_STORE_VERSION = 1
+KB_TEXT_FIELDS = ('question', 'answer')
+
+class MappedKnowledgeBase:
+    """Base de connaissances en lecture seule, projetée en mémoire (np.memmap)
+    
+    Disposition du répertoire :
+    - manifest.json : taille, dimension, dtype, libellés d'intention
+    - embeddings.bin : matrice brute (lignes normalisées)
+    - {question,answer}.bin / .idx : blob UTF-8 + offsets int64 (N+1)
+    - intents.bin : code int16 de l'intention de chaque entrée
+    
+    Les pages sont partagées entre workers via le cache de l'OS ; les
+    chaînes ne sont décodées qu'à l'accès.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, 'manifest.json'), 'r', encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('format') != KB_STORE_FORMAT:
+            raise ValueError(f"{path} n'est pas une base {KB_STORE_FORMAT}")
+        
+        count, dim = self.manifest['count'], self.manifest['dim']
+        self.embeddings = np.memmap(os.path.join(path, 'embeddings.bin'), mode='r',
+                                    dtype=np.dtype(self.manifest['dtype']), shape=(count, dim))
+        self.intent_labels = self.manifest['intent_labels']
+        self.intent_codes = np.memmap(os.path.join(path, 'intents.bin'), mode='r',
+                                      dtype=np.int16, shape=(count,))
+        self._blobs, self._offsets = {}, {}
+        for field in KB_TEXT_FIELDS:
+            self._offsets[field] = np.memmap(os.path.join(path, f'{field}.idx'), mode='r',
+                                             dtype=np.int64, shape=(count + 1,))
+            self._blobs[field] = np.memmap(os.path.join(path, f'{field}.bin'), mode='r',
+                                           dtype=np.uint8)
+    
+    def __len__(self) -> int:
+        return self.manifest['count']
+    
+    def __getitem__(self, idx: int) -> Dict:
+        if idx < 0:
+            idx += len(self)
+        entry = {field: self._text(field, idx) for field in KB_TEXT_FIELDS}
+        entry['intent'] = self.intent_labels[self.intent_codes[idx]]
+        return entry
+    
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+    
+    def _text(self, field: str, idx: int) -> str:
+        start, end = self._offsets[field][idx], self._offsets[field][idx + 1]
+        return self._blobs[field][start:end].tobytes().decode('utf-8')
+    
+    @staticmethod
+    def write(path: str, embeddings: np.ndarray, knowledge_base: List[Dict],
+              dtype: str = 'float32', embedding_model: Optional[str] = None):
+        """Écrire une base (embeddings normalisés) de façon atomique"""
+        if len(knowledge_base) != embeddings.shape[0]:
+            raise ValueError(f"{len(knowledge_base)} entrées pour {embeddings.shape[0]} embeddings")
+        
+        writer = KnowledgeBaseWriter(path)
+        for entry in knowledge_base:
+            writer.append(entry)
+        writer.finish_texts()
+        target = writer.create_embeddings(embeddings.shape[1], dtype)
+        for start in range(0, len(knowledge_base), SCORING_CHUNK_ROWS):
+            target[start:start + SCORING_CHUNK_ROWS] = normalize_rows(
+                embeddings[start:start + SCORING_CHUNK_ROWS], dtype=target.dtype)
+        writer.commit(embedding_model)
+
+def embeddings_checksum(embeddings: np.ndarray) -> str:
+    """SHA-256 des octets de la matrice (telle que stockée), par blocs"""
+    digest = hashlib.sha256()
+    for start in range(0, embeddings.shape[0], SCORING_CHUNK_ROWS):
+        digest.update(np.ascontiguousarray(embeddings[start:start + SCORING_CHUNK_ROWS]).data)
+    return 'sha256:' + digest.hexdigest()
+
+def check_kb_manifest(manifest: Dict, embeddings: np.ndarray, n_entries: int,
+                      config: Dict, source: str):
+    """Vérifier qu'une base correspond au modèle d'embedding configuré
+    
+    Les champs absents (artefacts antérieurs au manifeste) ne sont pas
+    vérifiés. La somme de contrôle, qui lit toute la matrice, n'est
+    recalculée qu'avec `kb_verify_checksum` (build_knowledge_base.py
+    --verify). Lève ValueError si la base est inutilisable.
+    """
+    expected_model = manifest.get('embedding_model')
+    if expected_model and expected_model != config['embedding_model']:
+        raise ValueError(f"{source} encodée avec {expected_model}, "
+                         f"CONFIG['embedding_model'] = {config['embedding_model']}")
+    if manifest.get('dim') is not None and manifest['dim'] != embeddings.shape[1]:
+        raise ValueError(f"{source} : dimension {embeddings.shape[1]}, manifeste {manifest['dim']}")
+    if manifest.get('count') is not None and not manifest['count'] == embeddings.shape[0] == n_entries:
+        raise ValueError(f"{source} : {n_entries} entrées et {embeddings.shape[0]} embeddings, "
+                         f"manifeste {manifest['count']}")
+    if manifest.get('checksum') and config.get('kb_verify_checksum', False):
+        checksum = embeddings_checksum(embeddings)
+        if checksum != manifest['checksum']:
+            raise ValueError(f"{source} : somme de contrôle des embeddings invalide ({checksum})")
+
+def vector_db_manifest_path(config: Dict) -> str:
+    """Manifeste associé à vector_database.npz + knowledge_base.json"""
+    return os.path.splitext(config['vector_db_path'])[0] + '.manifest.json'
+
+class KnowledgeBaseWriter:
+    """Écriture en flux d'une base au format MappedKnowledgeBase
+    
+    Les entrées sont ajoutées une à une (textes écrits directement dans
+    les blobs), puis les embeddings sont remplis par blocs dans une
+    matrice projetée sur disque : rien n'est gardé en mémoire hormis les
+    offsets. `commit` écrit le manifeste (avec somme de contrôle) et
+    remplace l'ancienne base de façon atomique.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        os.makedirs(self.tmp_path)
+        self.count = 0
+        self._blobs = {field: open(os.path.join(self.tmp_path, f'{field}.bin'), 'wb')
+                       for field in KB_TEXT_FIELDS}
+        self._offsets = {field: array('q', [0]) for field in KB_TEXT_FIELDS}
+        self._label_ids = {}
+        self._codes = array('h')
+        self._texts = None
+        self.embeddings = None
+    
+    def append(self, entry: Dict) -> int:
+        """Ajouter une entrée ; retourne son numéro de ligne"""
+        for field in KB_TEXT_FIELDS:
+            data = entry[field].encode('utf-8')
+            self._blobs[field].write(data)
+            self._offsets[field].append(self._offsets[field][-1] + len(data))
+        self._codes.append(self._label_ids.setdefault(entry['intent'], len(self._label_ids)))
+        self.count += 1
+        return self.count - 1
+    
+    def finish_texts(self):
+        """Fermer les blobs et écrire offsets et intentions (libellés triés)"""
+        for field in KB_TEXT_FIELDS:
+            self._blobs[field].close()
+            np.frombuffer(self._offsets[field], dtype=np.int64).tofile(
+                os.path.join(self.tmp_path, f'{field}.idx'))
+        self.intent_labels = sorted(self._label_ids)
+        remap = np.array([self.intent_labels.index(label) for label in self._label_ids], dtype=np.int16)
+        codes = np.frombuffer(self._codes, dtype=np.int16)
+        (remap[codes] if len(codes) else codes).tofile(os.path.join(self.tmp_path, 'intents.bin'))
+        self._offsets = {field: np.frombuffer(offsets, dtype=np.int64)
+                         for field, offsets in self._offsets.items()}
+    
+    def lengths(self, field: str) -> np.ndarray:
+        """Longueur (octets UTF-8) de chaque texte (après `finish_texts`)"""
+        return np.diff(self._offsets[field])
+    
+    def text(self, field: str, row: int) -> str:
+        """Relire un texte écrit (après `finish_texts`)"""
+        if self._texts is None:
+            self._texts = {f: np.memmap(os.path.join(self.tmp_path, f'{f}.bin'), mode='r', dtype=np.uint8)
+                           if self._offsets[f][-1] else np.empty(0, dtype=np.uint8)
+                           for f in KB_TEXT_FIELDS}
+        start, end = self._offsets[field][row], self._offsets[field][row + 1]
+        return self._texts[field][start:end].tobytes().decode('utf-8')
+    
+    def create_embeddings(self, dim: int, dtype: str = 'float32') -> np.ndarray:
+        """Matrice (count, dim) projetée sur disque, à remplir par blocs"""
+        self.embeddings = np.memmap(os.path.join(self.tmp_path, 'embeddings.bin'), mode='w+',
+                                    dtype=np.dtype(dtype), shape=(self.count, dim))
+        return self.embeddings
+    
+    def commit(self, embedding_model: Optional[str] = None, **extra) -> Dict:
+        """Écrire le manifeste et remplacer l'ancienne base"""
+        self.embeddings.flush()
+        manifest = {
+            'format': KB_STORE_FORMAT,
+            'version': KB_STORE_VERSION,
+            'count': self.count,
+            'dim': int(self.embeddings.shape[1]),
+            'dtype': str(self.embeddings.dtype),
+            'normalized': True,
+            'intent_labels': self.intent_labels,
+            'embedding_model': embedding_model,
+            'checksum': embeddings_checksum(self.embeddings),
+            **extra,
+        }
+        self._texts = self.embeddings = None
+        with open(os.path.join(self.tmp_path, 'manifest.json'), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+        
+        # Remplacer l'ancienne base seulement une fois la nouvelle complète
+        old_path = f"{self.path}.old"
+        if os.path.exists(self.path):
+            shutil.rmtree(old_path, ignore_errors=True)
+            os.rename(self.path, old_path)
+        os.rename(self.tmp_path, self.path)
+        shutil.rmtree(old_path, ignore_errors=True)
+        return manifest
+
+# ============================================================================
+# IDENTIFICATION DE LA LANGUE
+# ============================================================================
+
+# ary : darija marocaine, en écriture arabe ou latine (« arabizi »)
+LANGUAGE_SCRIPTS = {'fr': ('latin',), 'en': ('latin',), 'ar': ('arabic',), 'ary': ('arabic', 'latin')}
+ARABIC_LETTER = re.compile(r'[؀-ۿݐ-ݿ]')
+LATIN_LETTER = re.compile(r'[a-zà-ÿ]')
+
+# Textes d'amorçage des profils de trigrammes (domaine universitaire)
+LANGUAGE_SEED_TEXTS = {
+    'fr': [
+        "Comment s'inscrire à l'université pour l'année prochaine ?",
+        "Quelles sont les conditions d'obtention d'une bourse d'excellence ?",
+        "Où puis-je consulter mon emploi du temps et les dates des examens ?",
+        "Quels sont les horaires de la bibliothèque pendant les vacances ?",
+        "Je voudrais des informations sur le master et le doctorat en informatique.",
+        "Est-ce que les étudiants étrangers peuvent déposer leur dossier en ligne ?",
+        "Le relevé de notes et l'attestation de réussite sont disponibles au service de scolarité.",
+        "Inscription administrative, réinscription, préinscription et orientation des bacheliers.",
+        "et pour le master ? merci beaucoup, bonjour, quand commencent les cours",
+    ],
+    'en': [
+        "How do I register at the university for next year?",
+        "What are the requirements to get an excellence scholarship?",
+        "Where can I check my timetable and the exam dates?",
+        "What are the library opening hours during the holidays?",
+        "I would like information about the master's degree and the PhD in computer science.",
+        "Can international students submit their application online?",
+        "The transcript and the certificate are available at the registrar's office.",
+        "and what about the master? thank you, hello, when do classes start",
+    ],
+    'ar': [
+        "كيف يمكنني التسجيل في الجامعة للسنة المقبلة؟",
+        "ما هي شروط الحصول على منحة التميز؟",
+        "أين يمكنني الاطلاع على استعمال الزمن ومواعيد الامتحانات؟",
+        "ما هي أوقات عمل المكتبة خلال العطلة؟",
+        "أريد معلومات حول الماستر والدكتوراه في المعلوميات.",
+        "هل يمكن للطلبة الأجانب إيداع ملفاتهم عبر الإنترنت؟",
+        "كشف النقاط وشهادة النجاح متوفران في مصلحة الشؤون الطلابية.",
+        "وماذا عن الماستر؟ شكرا جزيلا، متى تبدأ الدروس",
+        "أين توجد كلية العلوم وكلية الآداب؟ ما هو رقم هاتف الإدارة",
+    ],
+    'ary': [
+        "كيفاش نتسجل فالجامعة العام الجاي؟",
+        "شنو هوما الشروط باش ناخد المنحة ديال التميز؟",
+        "فين نقدر نشوف لامبلوا دو طان والوقت ديال الامتحانات؟",
+        "واش المكتبة محلولة فالعطلة؟ بغيت نعرف الساعات",
+        "بغيت معلومات على الماستر والدكتورا ديال الانفورماتيك",
+        "واش كاين شي منحة للطلبة؟ كاينة شي حاجة بحال هادي",
+        "فين كاينة الكلية ديال الحقوق؟ شكون لي خاصني نشوف",
+        "امتى غادي يبداو التسجيلات؟ عافاك قوليا شحال خاصني نخلص",
+        "kifach ntsejel f la fac l3am jay? wach kayn chi date",
+        "chno homa les conditions bach nakhod la bourse dyal excellence",
+        "fin n9der nchouf l emploi du temps? bghit n3ref wa9t l examen",
+        "wach la bibliothèque m7loula f l3otla? 3afak goulia",
+        "o l master? chokran bzaf, imta ghaybdaw les cours, daba",
+        "imta ghadi tbda l'inscription? chhal khasni nkhles, 3afak",
+    ],
+}
+
+class LanguageIdentifier:
+    """Identification de la langue par trigrammes de caractères (Bayes naïf)
+    
+    Les log-probabilités des trigrammes sont rangées dans une matrice
+    (trigramme × langue) : identifier une question revient à sommer
+    quelques dizaines de lignes, soit quelques microsecondes. L'écriture
+    majoritaire (arabe ou latine) restreint d'abord les langues candidates.
+    """
+    
+    def __init__(self, languages: List[str], features: Dict[str, int],
+                 log_probs: np.ndarray, default: str, prior: Optional[np.ndarray] = None):
+        self.languages = languages
+        self.features = features
+        self.log_probs = log_probs
+        self.default = default
+        self.prior = prior if prior is not None else np.zeros(len(languages), dtype=np.float32)
+        self._masks = {script: np.array([script in LANGUAGE_SCRIPTS.get(lang, ('latin', 'arabic'))
+                                         for lang in languages])
+                       for script in ('latin', 'arabic')}
+    
+    @staticmethod
+    def ngrams(text: str, n: int = 3) -> List[str]:
+        text = f" {' '.join(text.casefold().split())} "
+        return [text[i:i + n] for i in range(len(text) - n + 1)]
+    
+    @classmethod
+    def fit(cls, texts_by_language: Dict[str, Sequence[str]], default: str = 'fr',
+            alpha: float = 0.5, default_prior: float = 2.0) -> 'LanguageIdentifier':
+        """Profils lissés (Laplace) à partir de textes par langue
+        
+        `default_prior` (log) départage en faveur de `default` les textes
+        trop courts pour trancher (« master », « inscription »).
+        """
+        languages = sorted(texts_by_language)
+        counts = {lang: Counter(g for text in texts_by_language[lang] for g in cls.ngrams(text))
+                  for lang in languages}
+        features = sorted(set().union(*counts.values()))
+        log_probs = np.empty((len(features), len(languages)), dtype=np.float32)
+        for j, lang in enumerate(languages):
+            column = np.array([counts[lang][g] for g in features], dtype=np.float64)
+            log_probs[:, j] = np.log((column + alpha) / (column.sum() + alpha * len(features)))
+        prior = np.array([default_prior if lang == default else 0.0 for lang in languages], dtype=np.float32)
+        return cls(languages, {g: i for i, g in enumerate(features)}, log_probs, default, prior)
+    
+    def identify(self, text: str) -> str:
+        """Code de langue de `text` (`default` si rien n'est reconnaissable)"""
+        arabic = len(ARABIC_LETTER.findall(text))
+        latin = len(LATIN_LETTER.findall(text.casefold()))
+        if not arabic and not latin:
+            return self.default
+        mask = self._masks['arabic' if arabic > latin else 'latin']
+        rows = [self.features[g] for g in self.ngrams(text) if g in self.features]
+        if not rows:
+            candidates = [lang for lang, ok in zip(self.languages, mask) if ok]
+            return self.default if self.default in candidates else candidates[0]
+        scores = self.log_probs[rows].sum(axis=0) + self.prior
+        scores[~mask] = -np.inf
+        return self.languages[int(np.argmax(scores))]
+
+def knowledge_base_languages(knowledge_base, identifier: LanguageIdentifier) -> List[str]:
+    """Langue de la question de chaque ligne"""
+    if isinstance(knowledge_base, MappedKnowledgeBase):
+        return [identifier.identify(knowledge_base._text('question', row)) for row in range(len(knowledge_base))]
+    return [identifier.identify(entry['question']) for entry in knowledge_base]
+
+def load_language_identifier(config: Dict) -> LanguageIdentifier:
+    """Profils appris sur `language_profiles_path` (JSONL text/language), sinon amorce intégrée"""
+    texts = LANGUAGE_SEED_TEXTS
+    path = config.get('language_profiles_path')
+    if path and os.path.exists(path):
+        texts = defaultdict(list)
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    row = json.loads(line)
+                    texts[row['language']].append(row['text'])
+    return LanguageIdentifier.fit(texts, default=config.get('default_language', 'fr'))
+
+class LanguageStats:
+    """Routes et latences par langue (pour /api/stats)"""
+    
+    def __init__(self):
+        self.routes = defaultdict(Counter)
+        self.latency_ms = defaultdict(lambda: Histogram(LATENCY_BUCKETS_MS))
+        self._lock = threading.Lock()
+    
+    def record(self, language: str, route: str, latency_ms: float):
+        with self._lock:
+            self.routes[language][route] += 1
+            histogram = self.latency_ms[language]
+        histogram.observe(latency_ms)
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            languages = {lang: (dict(routes), self.latency_ms[lang]) for lang, routes in self.routes.items()}
+        return {
+            lang: {
+                'requests': sum(routes.values()),
+                'routes': routes,
+                'p50_ms': histogram.quantile(0.5),
+                'p99_ms': histogram.quantile(0.99),
+            }
+            for lang, (routes, histogram) in sorted(languages.items())
+        }
+
+# ============================================================================
+# BASE DE CONNAISSANCES VIVANTE (MISES À JOUR À CHAUD)
+# ============================================================================
+
+KB_ENTRY_FIELDS = ('question', 'answer', 'intent')
+
+class KnowledgeSnapshot:
+    """Vue figée de la base interrogeable : segment de base + delta
+    
+    Le segment de base (entrées, embeddings, index) n'est jamais modifié.
+    Les ajouts et modifications vont dans un petit delta recherché en
+    force brute, les suppressions masquent des lignes de base. Chaque
+    mise à jour produit un nouveau snapshot (copie du delta seulement) :
+    une recherche en cours garde une vue cohérente de l'index et des
+    entrées. La compaction refond le tout dans un nouveau segment de base.
+    """
+    
+    def __init__(self, entries, embeddings: np.ndarray, index,
+                 deleted: Optional[np.ndarray] = None,
+                 delta: Optional[Dict[str, Tuple[Dict, np.ndarray]]] = None,
+                 version: int = 0, base_keys: Optional[Dict[str, List[int]]] = None,
+                 lexical: Optional[BM25Index] = None,
+                 partitions: Optional[IntentPartitions] = None,
+                 shards: Optional[IntentPartitions] = None):
+        self.entries = entries
+        self.embeddings = embeddings
+        self.index = index
+        self.lexical = lexical
+        self.partitions = partitions
+        self.shards = shards  # Segments par langue (même structure que les partitions)
+        self.deleted = deleted if deleted is not None else np.empty(0, dtype=np.intp)
+        self.delta = delta or {}
+        self.delta_entries = [entry for entry, _ in self.delta.values()]
+        self.delta_embeddings = None
+        if self.delta:
+            self.delta_embeddings = np.stack([emb for _, emb in self.delta.values()])
+        self.delta_lexical = None
+        if lexical is not None and self.delta:
+            self.delta_lexical = BM25Index.build([lexical_text(e) for e in self.delta_entries],
+                                                 reference=lexical)
+        self.version = version
+        self._base_keys = base_keys
+    
+    @property
+    def n_base(self) -> int:
+        return len(self.entries)
+    
+    def __len__(self) -> int:
+        return self.n_base - len(self.deleted) + len(self.delta_entries)
+    
+    def __getitem__(self, row: int) -> Dict:
+        """Entrée par numéro de ligne (base puis delta, comme `search`)"""
+        if row < self.n_base:
+            return self.entries[row]
+        return self.delta_entries[row - self.n_base]
+    
+    def __iter__(self):
+        """Entrées vivantes"""
+        deleted = set(self.deleted.tolist())
+        for row in range(self.n_base):
+            if row not in deleted:
+                yield self.entries[row]
+        yield from self.delta_entries
+    
+    def base_keys(self) -> Dict[str, List[int]]:
+        """Question normalisée → lignes de base (construit au premier besoin)"""
+        if self._base_keys is None:
+            keys = defaultdict(list)
+            for row, entry in enumerate(self.entries):
+                keys[normalize_text(entry['question'])].append(row)
+            self._base_keys = dict(keys)
+        return self._base_keys
+    
+    def _live_row(self, key: str) -> Optional[int]:
+        for row in self.base_keys().get(key, ()):
+            if row not in self.deleted:
+                return row
+        return None
+    
+    def lookup(self, key: str) -> Optional[Dict]:
+        """Entrée vivante pour une question normalisée"""
+        if key in self.delta:
+            return self.delta[key][0]
+        row = self._live_row(key)
+        if row is None:
+            return None
+        return {field: self.entries[row][field] for field in KB_ENTRY_FIELDS}
+    
+    def embedding_for(self, key: str) -> Optional[np.ndarray]:
+        """Embedding d'une question vivante (évite de la réencoder)"""
+        if key in self.delta:
+            return self.delta[key][1]
+        row = self._live_row(key)
+        if row is None:
+            return None
+        return np.asarray(self.embeddings[row])
+    
+    def search(self, queries: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-K (lignes, scores) sur la base vivante ; lignes masquées à -inf"""
+        chunks_indices, chunks_scores = [], []
+        if self.n_base:
+            # Sur-échantillonner la base pour compenser les lignes supprimées
+            indices, scores = self.index.search(queries, top_k + len(self.deleted))
+            if len(self.deleted):
+                scores = np.where(np.isin(indices, self.deleted), -np.inf, scores)
+            chunks_indices.append(indices)
+            chunks_scores.append(scores)
+        if self.delta_embeddings is not None:
+            scores = dot_scores(queries, self.delta_embeddings)
+            indices = top_k_indices(scores, top_k)
+            chunks_indices.append(indices + self.n_base)
+            chunks_scores.append(np.take_along_axis(scores, indices, axis=-1))
+        
+        if not chunks_indices:
+            empty = np.empty((queries.shape[0], 0))
+            return empty.astype(np.intp), empty.astype(np.float32)
+        
+        indices = np.concatenate(chunks_indices, axis=1)
+        scores = np.concatenate(chunks_scores, axis=1)
+        best = top_k_indices(scores, top_k)
+        return np.take_along_axis(indices, best, axis=-1), np.take_along_axis(scores, best, axis=-1)
+    
+    def search_partitioned(self, queries: np.ndarray, intents: Sequence[str], top_k: int,
+                           top_n: int, threshold, partitions: Optional[IntentPartitions] = None
+                           ) -> Tuple[List[np.ndarray], List[np.ndarray], List[bool]]:
+        """Top-K dans les partitions des intentions probables (+ delta)
+        
+        Recherche élargie à toute la base quand le meilleur score reste
+        sous `threshold` (un seuil ou un par requête) ; le troisième
+        élément indique ces élargissements. `partitions` : segments à
+        utiliser à la place des partitions par intention (langues).
+        """
+        partitions = partitions if partitions is not None else self.partitions
+        thresholds = np.broadcast_to(np.asarray(threshold, dtype=np.float32), (len(queries),))
+        all_indices, all_scores, widened = [], [], []
+        for query, intent, threshold in zip(queries, intents, thresholds):
+            selected = partitions.select(query, intent, top_n)
+            indices, scores = partitions.search(query, selected, top_k, self.deleted)
+            if self.delta_embeddings is not None:
+                delta_scores = dot_scores(query[None], self.delta_embeddings)[0]
+                indices = np.concatenate([indices, self.n_base + np.arange(len(delta_scores))])
+                scores = np.concatenate([scores, delta_scores])
+                best = top_k_indices(scores, top_k)
+                indices, scores = indices[best], scores[best]
+            
+            wide = not len(scores) or float(scores.max()) < threshold
+            if wide:
+                indices, scores = self.search(query[None], top_k)
+                indices, scores = indices[0], scores[0]
+            all_indices.append(indices)
+            all_scores.append(scores)
+            widened.append(wide)
+        return all_indices, all_scores, widened
+    
+    def vectors(self, rows: np.ndarray) -> np.ndarray:
+        """Embeddings de lignes quelconques (base ou delta)"""
+        in_base = rows < self.n_base
+        if in_base.all():
+            return self.embeddings[rows]
+        vectors = np.empty((len(rows), self.embeddings.shape[1]), dtype=np.float32)
+        vectors[in_base] = self.embeddings[rows[in_base]]
+        vectors[~in_base] = self.delta_embeddings[rows[~in_base] - self.n_base]
+        return vectors
+    
+    def lexical_scores(self, texts: Sequence[str]) -> np.ndarray:
+        """Scores BM25 sur toutes les lignes (base puis delta), supprimées à 0"""
+        scores = self.lexical.score(texts)
+        if len(self.deleted):
+            scores[:, self.deleted] = 0
+        if self.delta_lexical is not None:
+            scores = np.concatenate([scores, self.delta_lexical.score(texts)], axis=1)
+        return scores
+    
+    def search_lexical(self, queries: np.ndarray, texts: Sequence[str], top_k: int,
+                       mode: str = 'hybrid', n_candidates: int = 100, fusion: str = 'rrf',
+                       rrf_k: int = 60, alpha: float = 0.5) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+        """Top-K (lignes, cosinus) avec le BM25, par requête
+        
+        `prefilter` : les `n_candidates` meilleurs documents BM25 sont
+        reclassés par cosinus (index dense si aucun terme ne correspond).
+        `hybrid` : les listes lexicale et dense sont fusionnées (rangs
+        réciproques ou scores pondérés). Dans les deux cas la similarité
+        renvoyée reste le cosinus, seul l'ordre dépend du BM25.
+        """
+        lexical = self.lexical_scores(texts)
+        lexical_top = top_k_indices(lexical, n_candidates)
+        dense_top = dense_scores = None
+        if mode == 'hybrid':
+            dense_top, dense_scores = self.search(queries, n_candidates)
+        
+        all_indices, all_scores = [], []
+        for i, query in enumerate(queries):
+            lexical_rows = lexical_top[i][lexical[i, lexical_top[i]] > 0]
+            if mode == 'prefilter':
+                if len(lexical_rows) < top_k:
+                    indices, scores = self.search(query[None], top_k)
+                    all_indices.append(indices[0])
+                    all_scores.append(scores[0])
+                    continue
+                candidates = lexical_rows
+                similarities = dot_scores(query[None], self.vectors(candidates))[0]
+                fused = similarities
+            else:
+                dense_rows = dense_top[i][np.isfinite(dense_scores[i])]
+                candidates = np.union1d(dense_rows, lexical_rows)
+                similarities = dot_scores(query[None], self.vectors(candidates))[0]
+                if fusion == 'rrf':
+                    fused = np.zeros(len(candidates), dtype=np.float32)
+                    for rows in (dense_rows, lexical_rows):
+                        fused[np.searchsorted(candidates, rows)] += 1.0 / (rrf_k + 1 + np.arange(len(rows)))
+                else:
+                    bm25 = lexical[i, candidates]
+                    fused = alpha * similarities + (1 - alpha) * bm25 / max(float(bm25.max()), 1e-9)
+            
+            best = top_k_indices(fused, top_k)
+            all_indices.append(candidates[best])
+            all_scores.append(similarities[best])
+        return all_indices, all_scores
+    
+    def changed(self, operations: Sequence[Tuple]) -> 'KnowledgeSnapshot':
+        """Nouveau snapshot après `('upsert', clé, entrée, embedding)` / `('delete', clé)`
+        
+        Une clé remplace toutes les lignes de base de même question
+        (les doublons sont fusionnés).
+        """
+        keys = self.base_keys()
+        delta = dict(self.delta)
+        deleted = set(self.deleted.tolist())
+        for op, key, *payload in operations:
+            rows = keys.get(key, ())
+            if op == 'upsert':
+                entry, embedding = payload
+                delta.pop(key, None)  # Réinsertion en fin de delta
+                delta[key] = (entry, np.asarray(embedding, dtype=self.embeddings.dtype))
+            else:
+                delta.pop(key, None)
+            deleted.update(rows)
+        return KnowledgeSnapshot(
+            self.entries, self.embeddings, self.index,
+            deleted=np.array(sorted(deleted), dtype=np.intp), delta=delta,
+            version=self.version + 1, base_keys=keys, lexical=self.lexical,
+            partitions=self.partitions, shards=self.shards
+        )
+    
+    def materialize(self) -> Tuple[List[Dict], np.ndarray]:
+        """Entrées et embeddings vivants en un seul segment (compaction)"""
+        live = np.ones(self.n_base, dtype=bool)
+        live[self.deleted] = False
+        rows = np.nonzero(live)[0]
+        entries = [{field: self.entries[row][field] for field in KB_ENTRY_FIELDS} for row in rows]
+        entries += self.delta_entries
+        blocks = [np.asarray(self.embeddings[rows])]
+        if self.delta_embeddings is not None:
+            blocks.append(self.delta_embeddings)
+        return entries, np.concatenate(blocks)
+    
+    def stats(self) -> Dict:
+        return {
+            'version': self.version,
+            'size': len(self),
+            'base_rows': self.n_base,
+            'delta_rows': len(self.delta_entries),
+            'deleted_rows': int(len(self.deleted)),
+            'lexical_terms': len(self.lexical.vocabulary) if self.lexical is not None else None,
+            'intent_partitions': len(self.partitions.labels) if self.partitions is not None else None,
+            'language_shards': (dict(zip(self.shards.labels, np.diff(self.shards.offsets).tolist()))
+                                if self.shards is not None else None),
+        }
+
+def journal_record(op: str, key: str, entry: Optional[Dict] = None,
+                   embedding: Optional[np.ndarray] = None) -> Dict:
+    """Ligne du journal des mises à jour (embedding en base64 float32)"""
+    record = {'op': op, 'key': key}
+    if op == 'upsert':
+        record['entry'] = entry
+        record['embedding'] = base64.b64encode(
+            np.asarray(embedding, dtype=np.float32).tobytes()
+        ).decode('ascii')
+    return record
+
+def read_journal(path: str) -> List[Tuple]:
+    """Opérations du journal, dans l'ordre (ignore une dernière ligne tronquée)"""
+    operations = []
+    if not os.path.exists(path):
+        return operations
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"⚠️  Ligne de journal illisible ignorée ({path})")
+                continue
+            if record['op'] == 'upsert':
+                embedding = np.frombuffer(base64.b64decode(record['embedding']), dtype=np.float32)
+                operations.append(('upsert', record['key'], record['entry'], embedding))
+            else:
+                operations.append(('delete', record['key']))
+    return operations
+
+# ============================================================================
+# CACHE DES RÉPONSES
+# ============================================================================
+
+def normalize_text(text: str) -> str:
+    """Clé de cache : minuscules, sans accents, espaces normalisés"""
+    text = unicodedata.normalize('NFKD', text.casefold())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(text.split()).rstrip(' ?!.')
+
+def cache_key(query: str, language: Optional[str]) -> str:
+    """Clé du cache de réponses : la langue choisit seuils et segment de base"""
+    return f"{language or ''}:{normalize_text(query)}"
+
+class QueryCache:
+    """Cache à deux niveaux devant le pipeline
+    
+    - exact : LRU sur le texte normalisé (et la langue, voir `cache_key`)
+    - sémantique : réutilise la réponse d'une requête de même langue dont
+      l'embedding est à moins de `max_distance` (cosinus). Les embeddings
+      sont stockés dans une matrice préallouée, remplacée en FIFO.
+    """
+    
+    def __init__(self, max_size: int, ttl_s: float,
+                 semantic_size: int = 0, max_distance: Optional[float] = None):
+        self.max_size = max_size
+        self.ttl_s = ttl_s
+        self.semantic_size = semantic_size if max_distance is not None else 0
+        self.max_distance = max_distance
+        self.hits = {'exact': 0, 'semantic': 0}
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.clear()
+    
+    @property
+    def semantic_enabled(self) -> bool:
+        return self.semantic_size > 0
+    
+    def clear(self):
+        """Vider le cache (ex. après rechargement de la base)"""
+        with self._lock:
+            self._entries = OrderedDict()  # clé -> (réponse, expiration)
+            self._vectors = None           # Alloué au premier embedding
+            self._semantic_responses = [None] * self.semantic_size
+            self._semantic_expires = np.zeros(self.semantic_size)
+            self._semantic_languages = np.full(self.semantic_size, None, dtype=object)
+            self._semantic_next = 0
+    
+    def get(self, key: str) -> Optional[Dict]:
+        """Recherche exacte"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits['exact'] += 1
+                    return entry[0]
+                del self._entries[key]
+        return None
+    
+    def peek(self, key: str) -> Optional[Dict]:
+        """Recherche exacte sans effet sur l'ordre LRU ni les compteurs"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                return entry[0]
+        return None
+    
+    def get_similar(self, embedding: np.ndarray, language: Optional[str] = None) -> Optional[Dict]:
+        """Recherche sémantique (embedding normalisé) parmi les réponses de `language`"""
+        with self._lock:
+            if self._vectors is not None:
+                scores = self._vectors @ embedding
+                scores[self._semantic_expires <= time.monotonic()] = -np.inf
+                scores[self._semantic_languages != language] = -np.inf
+                best = int(np.argmax(scores))
+                if 1.0 - scores[best] <= self.max_distance:
+                    self.hits['semantic'] += 1
+                    return self._semantic_responses[best]
+        return None
+    
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+    
+    def put(self, key: str, response: Dict, embedding: Optional[np.ndarray] = None,
+            language: Optional[str] = None):
+        """Ajouter une réponse (et son embedding pour le tier sémantique)"""
+        expires_at = time.monotonic() + self.ttl_s
+        with self._lock:
+            if self.max_size > 0:
+                self._entries[key] = (response, expires_at)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+            
+            if embedding is not None and self.semantic_enabled:
+                if self._vectors is None:
+                    self._vectors = np.zeros((self.semantic_size, embedding.shape[0]), dtype=np.float32)
+                slot = self._semantic_next
+                self._vectors[slot] = embedding
+                self._semantic_responses[slot] = response
+                self._semantic_expires[slot] = expires_at
+                self._semantic_languages[slot] = language
+                self._semantic_next = (slot + 1) % self.semantic_size
+    
+    def stats(self) -> Dict:
+        """Compteurs du cache"""
+        with self._lock:
+            hits = sum(self.hits.values())
+            return {
+                'exact_entries': len(self._entries),
+                'semantic_entries': sum(r is not None for r in self._semantic_responses),
+                'exact_hits': self.hits['exact'],
+                'semantic_hits': self.hits['semantic'],
+                'misses': self.misses,
+                'hit_rate': hits / (hits + self.misses) if hits + self.misses else None,
+            }
+
+class EmbeddingCache:
+    """Cache LRU d'embeddings stockés en float16 dans une matrice préallouée
+    
+    Seuls la correspondance clé -> ligne et l'ordre LRU sont des objets
+    Python ; les vecteurs vivent dans une matrice unique (`slab`).
+    """
+    
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._slots = OrderedDict()  # clé -> ligne de la matrice
+        self._slab = None            # Alloué au premier embedding
+        self._lock = threading.Lock()
+    
+    def get_many(self, keys: List[str]) -> List[Optional[np.ndarray]]:
+        """Embeddings (float32) en cache, None pour les absents"""
+        results = []
+        with self._lock:
+            for key in keys:
+                slot = self._slots.get(key)
+                if slot is None:
+                    self.misses += 1
+                    results.append(None)
+                else:
+                    self._slots.move_to_end(key)
+                    self.hits += 1
+                    results.append(self._slab[slot].astype(np.float32))
+        return results
+    
+    def put_many(self, keys: List[str], embeddings: np.ndarray):
+        """Ajouter des embeddings (évince les moins récemment utilisés)"""
+        with self._lock:
+            if self._slab is None:
+                self._slab = np.zeros((self.capacity, embeddings.shape[1]), dtype=np.float16)
+            for key, embedding in zip(keys, embeddings):
+                slot = self._slots.get(key)
+                if slot is None:
+                    if len(self._slots) < self.capacity:
+                        slot = len(self._slots)
+                    else:
+                        _, slot = self._slots.popitem(last=False)
+                self._slots[key] = slot
+                self._slots.move_to_end(key)
+                self._slab[slot] = embedding
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            dim = self._slab.shape[1] if self._slab is not None else 0
+            return {
+                'entries': len(self._slots),
+                'capacity': self.capacity,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else None,
+                'bytes_used': len(self._slots) * dim * 2,
+                'bytes_allocated': self._slab.nbytes if self._slab is not None else 0,
+            }
+
+class LRUCache:
+    """Petit cache LRU générique (thread-safe) avec compteurs"""
+    
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            return value
+    
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'capacity': self.capacity,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else None,
+            }
+
+# ============================================================================
+# SESSIONS DE CONVERSATION
+# ============================================================================
+
+def pool_context(context: Optional[np.ndarray], embeddings: np.ndarray, decay: float) -> np.ndarray:
+    """Intégrer des embeddings de tours (dans l'ordre) au contexte : moyenne mobile normalisée"""
+    for embedding in embeddings:
+        embedding = np.asarray(embedding, dtype=np.float32)
+        context = embedding if context is None else decay * context + (1.0 - decay) * embedding
+        context = context / (np.linalg.norm(context) or 1.0)
+    return context
+
+class SessionContext:
+    """Copie de l'état d'une session pour un tour (hors verrou)
+    
+    `pending` : questions récentes pas encore intégrées à `embedding` (les
+    tours routés par intention ne calculent pas d'embedding). Le pipeline
+    les encode seulement si le contexte sert, puis appelle `fold`.
+    """
+    
+    __slots__ = ('embedding', 'pending', 'last_intent', 'last_question', 'folded')
+    
+    def __init__(self, embedding, pending, last_intent, last_question):
+        self.embedding = embedding
+        self.pending = pending
+        self.last_intent = last_intent
+        self.last_question = last_question
+        self.folded = 0
+    
+    @property
+    def has_context(self) -> bool:
+        return self.embedding is not None or bool(self.pending)
+    
+    def fold(self, embeddings: np.ndarray, decay: float):
+        """Intégrer les embeddings des questions en attente"""
+        self.embedding = pool_context(self.embedding, embeddings, decay)
+        self.folded = len(self.pending)
+        self.pending = []
+
+class Session:
+    __slots__ = ('embedding', 'turns', 'unfolded', 'last_intent', 'expires_at', 'nbytes')
+    
+    def __init__(self, max_turns: int):
+        self.embedding = None        # Contexte poolé (float16)
+        self.turns = deque(maxlen=max_turns)  # Questions récentes (tronquées)
+        self.unfolded = 0            # Dernières questions absentes de `embedding`
+        self.last_intent = None
+        self.expires_at = 0.0
+        self.nbytes = 0
+
+# Surcoût fixe d'une session : objet, deque, entrée de l'OrderedDict et clé
+SESSION_OVERHEAD_BYTES = sys.getsizeof(Session(1)) + sys.getsizeof(deque(maxlen=1)) + 200
+
+class SessionStore:
+    """États de conversation bornés en nombre, en mémoire et en durée
+    
+    Chaque session garde ses `max_turns` dernières questions (tronquées à
+    `max_chars`), la dernière intention et un embedding de contexte
+    (float16) mis à jour par moyenne mobile à chaque tour : l'historique
+    n'est jamais ré-encodé. La taille de chaque session est mesurée ; les
+    sessions les moins récentes sont évincées au-delà de `max_sessions`
+    ou de `max_bytes`, et après `ttl_s` d'inactivité (l'ordre LRU est
+    aussi l'ordre d'expiration).
+    """
+    
+    def __init__(self, max_sessions: int, max_bytes: int, ttl_s: float,
+                 max_turns: int = 4, max_chars: int = 256, decay: float = 0.5):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self.max_turns = max_turns
+        self.max_chars = max_chars
+        self.decay = decay
+        self.nbytes = 0
+        self.evicted = {'ttl': 0, 'lru': 0}
+        self.followups = 0
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def __len__(self) -> int:
+        return len(self._sessions)
+    
+    def _expire(self, now: float):
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.expires_at > now:
+                break
+            self._drop(session_id, 'ttl')
+    
+    def _drop(self, session_id: str, reason: str):
+        session = self._sessions.pop(session_id)
+        self.nbytes -= session.nbytes
+        self.evicted[reason] += 1
+    
+    def get(self, session_id: str) -> Optional[SessionContext]:
+        """Contexte de la session (None si inconnue ou expirée)"""
+        with self._lock:
+            self._expire(time.monotonic())
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            embedding = session.embedding.astype(np.float32) if session.embedding is not None else None
+            pending = list(session.turns)[len(session.turns) - session.unfolded:]
+            return SessionContext(embedding, pending, session.last_intent,
+                                  session.turns[-1] if session.turns else None)
+    
+    def record(self, session_id: str, context: Optional[SessionContext], question: str,
+               intent: Optional[str], embedding: Optional[np.ndarray] = None, followup: bool = False):
+        """Ajouter un tour (embedding de la question s'il a été calculé)"""
+        question = question[:self.max_chars]
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = Session(self.max_turns)
+            else:
+                self._sessions.move_to_end(session_id)
+            
+            # Questions en attente intégrées par le pipeline pendant ce tour
+            if context is not None and context.folded:
+                session.embedding = context.embedding.astype(np.float16)
+                session.unfolded = max(0, session.unfolded - context.folded)
+            session.turns.append(question)
+            if embedding is not None and session.unfolded == 0:
+                current = session.embedding.astype(np.float32) if session.embedding is not None else None
+                session.embedding = pool_context(current, embedding[None], self.decay).astype(np.float16)
+            else:
+                session.unfolded += 1
+            session.unfolded = min(session.unfolded, len(session.turns))
+            session.last_intent = intent
+            session.expires_at = now + self.ttl_s
+            self.followups += followup
+            
+            self.nbytes -= session.nbytes
+            session.nbytes = (SESSION_OVERHEAD_BYTES + sys.getsizeof(session_id)
+                              + sum(sys.getsizeof(turn) for turn in session.turns)
+                              + (session.embedding.nbytes if session.embedding is not None else 0))
+            self.nbytes += session.nbytes
+            while self._sessions and (len(self._sessions) > self.max_sessions or self.nbytes > self.max_bytes):
+                self._drop(next(iter(self._sessions)), 'lru')
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            self._expire(time.monotonic())
+            return {
+                'sessions': len(self._sessions),
+                'max_sessions': self.max_sessions,
+                'memory_bytes': self.nbytes,
+                'max_bytes': self.max_bytes,
+                'bytes_per_session': self.nbytes / len(self._sessions) if self._sessions else None,
+                'followups': self.followups,
+                'evicted': dict(self.evicted),
+            }
+
+# ============================================================================
+# TOKENISATION
+# ============================================================================
+
+def load_intent_tokenizer(model_path: str, fast: bool = True):
+    """Tokenizer du classifieur : Rust (tokenizer.json) s'il a été vérifié
+    
+    verify_tokenizer.py convertit `sentencepiece.bpe.model`, compare les
+    token ids aux deux tokenizers et n'écrit `tokenizer.json` que s'ils
+    sont identiques.
+    """
+    if fast and os.path.exists(os.path.join(model_path, 'tokenizer.json')):
+        return XLMRobertaTokenizerFast.from_pretrained(model_path)
+    if fast:
+        logger.info("   Tokenizer SentencePiece (lent) : lancer verify_tokenizer.py pour le tokenizer rapide")
+    return XLMRobertaTokenizer.from_pretrained(model_path)
+
+# ============================================================================
+# MICRO-BATCHING
+# ============================================================================
+
+def length_buckets(lengths: Sequence[int], batch_size: int) -> List[List[int]]:
+    """Lots d'indices de longueurs voisines (minimise le padding)"""
+    order = np.argsort(np.asarray(lengths), kind='stable').tolist()
+    return [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+
+def length_groups(lengths: Sequence[int], max_ratio: Optional[float]) -> List[List[int]]:
+    """Sous-lots de longueurs voisines pour un même forward pass
+    
+    Un nouveau sous-lot commence dès qu'une séquence dépasse `max_ratio`
+    fois la plus courte du sous-lot : une longue question ne fait plus
+    payer son padding (et son attention) aux questions courtes.
+    """
+    if not max_ratio:
+        return [list(range(len(lengths)))]
+    groups = []
+    for i in np.argsort(np.asarray(lengths), kind='stable').tolist():
+        if groups and lengths[i] <= max_ratio * lengths[groups[-1][0]]:
+            groups[-1].append(i)
+        else:
+            groups.append([i])
+    return groups
+
+class IntentBatcher:
+    """Regroupe les requêtes concurrentes en un seul forward pass
+    
+    Les appelants (threads) déposent leur texte dans une file ; un thread
+    dédié collecte les requêtes pendant `window_ms` (ou jusqu'à
+    `max_batch_size`), exécute `classify_batch` une seule fois puis
+    redistribue les résultats.
+    
+    Chaque appelant bloque son thread jusqu'au résultat : un lot ne peut
+    pas dépasser le nombre de threads qui appellent `submit` en même
+    temps (`inference_workers` derrière l'API).
+    """
+    
+    def __init__(self, classify_batch: Callable[[List[str]], List[Tuple[str, float]]],
+                 window_ms: float, max_batch_size: int):
+        self.classify_batch = classify_batch
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.queue_wait_ms = Histogram(LATENCY_BUCKETS_MS)
+        self._queue = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='intent-batcher', daemon=True)
+        self._thread.start()
+    
+    def submit(self, text: str) -> Tuple[str, float]:
+        """Classifier un texte (bloque jusqu'au traitement de son lot)"""
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("IntentBatcher arrêté")
+            self._queue.put((text, future, time.perf_counter()))
+        return future.result()
+    
+    def close(self):
+        """Arrêter le thread de batching (les requêtes déjà reçues sont traitées)"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join(timeout=5)
+    
+    def _collect(self, first) -> Tuple[List, bool]:
+        """Collecter un lot à partir de la première requête reçue"""
+        batch = [first]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+    
+    def _run(self):
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch, stopping = self._collect(first)
+            
+            now = time.perf_counter()
+            for _, _, enqueued_at in batch:
+                self.queue_wait_ms.observe((now - enqueued_at) * 1000)
+            self.batch_sizes.observe(len(batch))
+            
+            try:
+                results = self.classify_batch([text for text, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future, _), result in zip(batch, results):
+                    future.set_result(result)
+    
+    def stats(self) -> Dict:
+        """Statistiques de batching"""
+        return {
+            'window_ms': self.window * 1000,
+            'max_batch_size': self.max_batch_size,
+            'pending': self._queue.qsize(),
+            'batch_size': self.batch_sizes.snapshot(),
+            'queue_wait_ms': self.queue_wait_ms.snapshot(),
+        }
+
+# ============================================================================
+# EXÉCUTEUR D'INFÉRENCE
+# ============================================================================
+
+class ExecutorSaturated(Exception):
+    """File d'inférence pleine, ou attente estimée au-delà du SLO"""
+    
+    def __init__(self, reason: str = 'queue_full', retry_after_s: float = 1.0):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after_s = retry_after_s
+
+class InferenceExecutor:
+    """Pool de threads dédié à l'inférence, avec file d'attente prioritaire bornée
+    
+    Garde la boucle asyncio libre pendant les calculs torch. Chaque tâche
+    porte un coût attendu (1 = réponse d'intention) : la file est ordonnée
+    par échéance virtuelle `arrivée + coût × priority_cost_ms`, ce qui fait
+    passer les requêtes bon marché devant les requêtes RAG arrivées en même
+    temps sans affamer ces dernières. Les requêtes sont refusées au-delà de
+    `workers + max_queue_depth`, ou quand l'attente estimée (coût en file ×
+    durée moyenne par unité de coût / workers) dépasse `queue_slo_ms` ; une
+    tâche qui a déjà attendu plus que le SLO est abandonnée au défilement.
+    """
+    
+    def __init__(self, workers: int, max_queue_depth: int,
+                 queue_slo_ms: Optional[float] = None, priority_cost_ms: float = 50.0):
+        self.workers = workers
+        self.max_queue_depth = max_queue_depth
+        self.queue_slo_ms = queue_slo_ms
+        self.priority_cost_ms = priority_cost_ms
+        self.running = 0
+        self.rejections = {'queue_full': 0, 'slo': 0, 'expired': 0}
+        self.queue_wait_ms = Histogram(LATENCY_BUCKETS_MS)
+        self.ms_per_cost = None     # Moyenne mobile de la durée par unité de coût
+        self._queue = []            # Tas de (échéance, séquence, coût, arrivée, future, fn, args)
+        self._queued_cost = 0.0
+        self._seq = 0
+        self._stopping = False
+        self._cond = threading.Condition()
+        self._threads = [threading.Thread(target=self._worker, name=f'inference-{i}', daemon=True)
+                         for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+    
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+    
+    @property
+    def in_flight(self) -> int:
+        return self.running + len(self._queue)
+    
+    @property
+    def rejected(self) -> int:
+        return sum(self.rejections.values())
+    
+    def estimated_wait_ms(self, extra_cost: float = 0.0) -> float:
+        """Attente estimée d'une tâche ajoutée derrière la file actuelle"""
+        if self.ms_per_cost is None:
+            return 0.0
+        return (self._queued_cost + extra_cost) * self.ms_per_cost / self.workers
+    
+    def submit(self, fn: Callable, *args, cost: float = 1.0) -> asyncio.Future:
+        """Soumettre `fn(*args)` avec son coût attendu (lève ExecutorSaturated)
+        
+        À appeler depuis la boucle asyncio.
+        """
+        with self._cond:
+            if self.in_flight >= self.workers + self.max_queue_depth:
+                self.rejections['queue_full'] += 1
+                raise ExecutorSaturated('queue_full', self._retry_after_s())
+            # Seule l'attente derrière la file compte : un worker libre sert tout de suite
+            if self.queue_slo_ms is not None and self.in_flight >= self.workers:
+                wait_ms = self.estimated_wait_ms()
+                if wait_ms > self.queue_slo_ms:
+                    self.rejections['slo'] += 1
+                    raise ExecutorSaturated('slo', self._retry_after_s(wait_ms))
+            
+            future = Future()
+            enqueued_at = time.perf_counter()
+            deadline = enqueued_at + cost * self.priority_cost_ms / 1000
+            self._seq += 1
+            heapq.heappush(self._queue, (deadline, self._seq, cost, enqueued_at, future, fn, args))
+            self._queued_cost += cost
+            self._cond.notify()
+        return asyncio.wrap_future(future)
+    
+    def _retry_after_s(self, wait_ms: Optional[float] = None) -> float:
+        if wait_ms is None:
+            wait_ms = self.estimated_wait_ms()
+        return max(1.0, wait_ms / 1000)
+    
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._stopping:
+                    self._cond.wait()
+                if self._stopping:
+                    return
+                _, _, cost, enqueued_at, future, fn, args = heapq.heappop(self._queue)
+                self._queued_cost = max(0.0, self._queued_cost - cost)
+                waited_ms = (time.perf_counter() - enqueued_at) * 1000
+                expired = self.queue_slo_ms is not None and waited_ms > self.queue_slo_ms
+                if expired:
+                    self.rejections['expired'] += 1
+                else:
+                    self.running += 1
+            
+            self.queue_wait_ms.observe(waited_ms)
+            if expired:
+                # Le client a probablement abandonné : ne pas calculer pour rien
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(ExecutorSaturated('expired', self._retry_after_s()))
+                continue
+            if not future.set_running_or_notify_cancel():
+                with self._cond:
+                    self.running -= 1
+                continue
+            
+            start = time.perf_counter()
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                with self._cond:
+                    self.running -= 1
+                    per_cost = elapsed_ms / max(cost, 1e-3)
+                    self.ms_per_cost = per_cost if self.ms_per_cost is None else \
+                        0.9 * self.ms_per_cost + 0.1 * per_cost
+    
+    async def run(self, fn: Callable, *args, cost: float = 1.0):
+        """Exécuter `fn(*args)` dans le pool et attendre le résultat"""
+        return await self.submit(fn, *args, cost=cost)
+    
+    def shutdown(self):
+        """Arrêter les workers et annuler les tâches en file"""
+        with self._cond:
+            self._stopping = True
+            pending, self._queue = self._queue, []
+            self._queued_cost = 0.0
+            self._cond.notify_all()
+        for item in pending:
+            item[4].cancel()
+    
+    def stats(self) -> Dict:
+        """Statistiques de l'exécuteur"""
+        with self._cond:
+            return {
+                'workers': self.workers,
+                'max_queue_depth': self.max_queue_depth,
+                'queue_slo_ms': self.queue_slo_ms,
+                'in_flight': self.in_flight,
+                'running': self.running,
+                'queued': len(self._queue),
+                'queued_cost': self._queued_cost,
+                'ms_per_cost': self.ms_per_cost,
+                'estimated_wait_ms': self.estimated_wait_ms(),
+                'rejected': self.rejected,
+                'rejections': dict(self.rejections),
+                'queue_wait_ms': self.queue_wait_ms.snapshot(),
+            }
+
+# ============================================================================
+# LIMITATION DE DÉBIT PAR CLIENT
+# ============================================================================
+
+class ClientLimiter:
+    """Seau à jetons par client (adresse IP ou clé d'API), en unités de coût
+    
+    Chaque client dispose de `burst` unités, rechargées à `rate` unités par
+    seconde. Une requête est débitée de son coût attendu à l'admission puis
+    régularisée avec son coût réel (le solde peut devenir négatif : un
+    client qui enchaîne les requêtes RAG attend plus longtemps). Le coût
+    attendu d'un client est une moyenne mobile de ses coûts réels. Les
+    clients les moins récents sont oubliés au-delà de `max_clients`. Avec
+    `rate=None`, rien n'est refusé : seuls les coûts moyens sont suivis.
+    
+    À appeler depuis la boucle asyncio.
+    """
+    
+    def __init__(self, rate: Optional[float], burst: float, max_clients: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.limited = 0
+        self.default_cost = 1.0     # Moyenne mobile sur tous les clients
+        self._clients = OrderedDict()  # clé -> [jetons, dernière recharge, coût moyen]
+    
+    def _bucket(self, key: str) -> List:
+        now = time.monotonic()
+        bucket = self._clients.get(key)
+        if bucket is None:
+            bucket = self._clients[key] = [self.burst, now, self.default_cost]
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+        else:
+            self._clients.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * (self.rate or 0.0))
+            bucket[1] = now
+        return bucket
+    
+    def expected_cost(self, key: str) -> float:
+        """Coût attendu de la prochaine requête du client"""
+        bucket = self._clients.get(key)
+        return bucket[2] if bucket is not None else self.default_cost
+    
+    def admit(self, key: str, cost: float) -> Optional[float]:
+        """Débiter `cost` ; None si admis, sinon délai (s) avant assez de jetons"""
+        bucket = self._bucket(key)
+        if self.rate is None:
+            return None
+        # Une requête plus chère que le seau entier passe quand il est plein
+        needed = min(cost, self.burst)
+        if bucket[0] < needed:
+            self.limited += 1
+            return (needed - bucket[0]) / self.rate
+        bucket[0] -= cost
+        return None
+    
+    def refund(self, key: str, charged: float):
+        """Rendre les jetons d'une requête refusée en aval"""
+        bucket = self._clients.get(key)
+        if bucket is not None:
+            bucket[0] = min(self.burst, bucket[0] + charged)
+    
+    def settle(self, key: str, charged: float, actual: float, n_queries: int = 1):
+        """Régulariser avec le coût réel et mettre à jour les coûts moyens"""
+        bucket = self._clients.get(key)
+        if bucket is not None:
+            bucket[0] = min(self.burst, bucket[0] + charged - actual)
+            bucket[2] = 0.8 * bucket[2] + 0.2 * actual / n_queries
+        self.default_cost = 0.99 * self.default_cost + 0.01 * actual / n_queries
+    
+    def stats(self) -> Dict:
+        return {
+            'rate': self.rate,
+            'burst': self.burst,
+            'clients': len(self._clients),
+            'limited': self.limited,
+            'default_cost': self.default_cost,
+        }
+
+def response_cost(response: Dict, config: Dict) -> float:
+    """Coût réel d'une réponse : cache, sinon coût de sa route"""
+    if response.get('cache'):
+        return config['cached_cost']
+    return config['route_costs'].get(response['method'], 1.0)
+
+# ============================================================================
+# ROUTAGE SPÉCULATIF
+# ============================================================================
+
+SPECULATION_MODES = ('off', 'always', 'adaptive')
+
+class SpeculativeRetrieval:
+    """Politique de recherche RAG spéculative et compteurs de travail perdu
+    
+    En mode `adaptive`, la recherche n'est lancée en parallèle de la
+    classification que si la part de requêtes routées vers le RAG sur la
+    fenêtre récente dépasse `min_rag_rate`.
+    """
+    
+    def __init__(self, mode: str, min_rag_rate: float = 0.3, window: int = 200):
+        if mode not in SPECULATION_MODES:
+            raise ValueError(f"Mode spéculatif inconnu : {mode}")
+        self.mode = mode
+        self.min_rag_rate = min_rag_rate
+        self.recent = deque(maxlen=window)
+        self.outcomes = Counter()
+        self.wasted_ms = 0.0
+        self._lock = threading.Lock()
+    
+    def should_speculate(self) -> bool:
+        """Lancer la recherche avant de connaître la confiance ?"""
+        if self.mode == 'off':
+            return False
+        if self.mode == 'always':
+            return True
+        return self.rag_rate() >= self.min_rag_rate
+    
+    def rag_rate(self) -> float:
+        """Part de requêtes RAG récentes (1.0 sans historique)"""
+        with self._lock:
+            return sum(self.recent) / len(self.recent) if self.recent else 1.0
+    
+    def record_route(self, rag: bool):
+        with self._lock:
+            self.recent.append(rag)
+    
+    def record_outcome(self, outcome: str, wasted_ms: float = 0.0):
+        """`used`, `cancelled` (pas encore démarrée) ou `wasted` (calcul jeté)"""
+        with self._lock:
+            self.outcomes[outcome] += 1
+            self.wasted_ms += wasted_ms
+    
+    def stats(self) -> Dict:
+        """Statistiques de spéculation"""
+        with self._lock:
+            launched = sum(self.outcomes.values())
+            return {
+                'mode': self.mode,
+                'launched': launched,
+                'used': self.outcomes['used'],
+                'cancelled': self.outcomes['cancelled'],
+                'wasted': self.outcomes['wasted'],
+                'wasted_ms': round(self.wasted_ms, 3),
+                'recent_rag_rate': sum(self.recent) / len(self.recent) if self.recent else None,
+            }
+
+# ============================================================================
+# BACKENDS D'INFÉRENCE
+# ============================================================================
+
+INFERENCE_BACKENDS = ('torch', 'torch_int8', 'onnx')
+ONNX_INTENT_FILE = 'intent_classifier.onnx'
+ONNX_EMBEDDING_FILE = 'embedding_model.onnx'
+
+def quantize_int8(model: torch.nn.Module) -> torch.nn.Module:
+    """Quantification dynamique int8 des couches linéaires (CPU)"""
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+class OnnxModel:
+    """Session onnxruntime appelée avec les features du tokenizer"""
+    
+    def __init__(self, path: str, threads: Optional[int] = None):
+        import onnxruntime as ort  # Optionnel : seulement pour le backend 'onnx'
+        
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+    
+    def __call__(self, features: Dict[str, torch.Tensor]) -> np.ndarray:
+        feeds = {name: features[name].cpu().numpy().astype(np.int64) for name in self.input_names}
+        return self.session.run(None, feeds)[0]
+
 # ============================================================================
-# MODÈLES PYDANTIC
+# TÊTE D'INTENTION (MODE SINGLE_ENCODER)
 # ============================================================================
 
-class QueryRequest(BaseModel):
-    """Requête utilisateur"""
-    message: str
-    language: Optional[str] = "fr"
+PIPELINE_MODES = ('hybrid', 'single_encoder')
 
-class QueryResponse(BaseModel):
-    """Réponse du chatbot"""
-    answer: str
-    method: str  # "intent", "rag", "fallback"
-    confidence: float
-    intent: Optional[str] = None
-    sources: Optional[List[Dict]] = None
-    latency_ms: float
+class IntentHead:
+    """Classifieur linéaire sur les embeddings de phrase normalisés
+    
+    Remplace XLM-R en mode `single_encoder` : l'embedding de la requête
+    sert à la fois à l'intention et à la recherche vectorielle.
+    """
+    
+    def __init__(self, weights: np.ndarray, bias: np.ndarray, labels: Sequence[str],
+                 threshold: Optional[float] = None, method: str = 'logreg'):
+        self.weights = np.ascontiguousarray(weights, dtype=np.float32)
+        self.bias = np.asarray(bias, dtype=np.float32)
+        self.labels = list(labels)
+        self.threshold = threshold
+        self.method = method
+    
+    @classmethod
+    def from_centroids(cls, embeddings: np.ndarray, labels: Sequence[str],
+                       temperature: float = 20.0) -> 'IntentHead':
+        """Plus proche centroïde (cosinus) par intention"""
+        names = sorted(set(labels))
+        codes = np.array([names.index(label) for label in labels])
+        centroids = np.stack([embeddings[codes == c].mean(axis=0) for c in range(len(names))])
+        return cls(normalize_rows(centroids) * temperature, np.zeros(len(names)), names,
+                   method='centroid')
+    
+    def predict(self, embeddings: np.ndarray) -> List[tuple]:
+        """(intention, probabilité) pour chaque embedding"""
+        logits = np.asarray(embeddings, dtype=np.float32) @ self.weights.T + self.bias
+        logits -= logits.max(axis=1, keepdims=True)
+        probs = np.exp(logits)
+        probs /= probs.sum(axis=1, keepdims=True)
+        best = probs.argmax(axis=1)
+        return [(self.labels[i], float(probs[row, i])) for row, i in enumerate(best)]
+    
+    def save(self, path: str, **extra):
+        """Sauvegarder la tête (+ tableaux annexes, ex. lignes d'évaluation)"""
+        np.savez(
+            path,
+            weights=self.weights,
+            bias=self.bias,
+            labels=np.array(self.labels),
+            threshold=np.array(np.nan if self.threshold is None else self.threshold),
+            method=np.array(self.method),
+            **extra
+        )
+    
+    @classmethod
+    def load(cls, path: str) -> 'IntentHead':
+        data = np.load(path)
+        threshold = float(data['threshold'])
+        return cls(data['weights'], data['bias'], [str(label) for label in data['labels']],
+                   threshold=None if np.isnan(threshold) else threshold,
+                   method=str(data['method']))
+
+# ============================================================================
+# CHARGEMENT DES COMPOSANTS
+# ============================================================================
+
+class ComponentState:
+    """État de chargement d'un composant (modèle, base...)"""
+    
+    def __init__(self, loader: Callable[[], None], required: bool = True):
+        self.loader = loader
+        self.required = required
+        self.state = 'pending'  # pending → loading → ready | failed
+        self.duration_s = None
+        self.error = None
+        self.future = None
+    
+    def load(self, name: str):
+        """Exécuter le chargement en mesurant sa durée"""
+        self.state = 'loading'
+        start = time.perf_counter()
+        try:
+            self.loader()
+        except Exception as e:
+            self.state, self.error = 'failed', str(e)
+            logger.error(f"❌ Échec du chargement de {name}: {e}")
+            raise
+        else:
+            self.state = 'ready'
+        finally:
+            self.duration_s = time.perf_counter() - start
+        logger.info(f"   ✅ {name} chargé en {self.duration_s:.1f}s")
+    
+    def snapshot(self) -> Dict:
+        return {
+            'state': self.state,
+            'required': self.required,
+            'load_duration_s': self.duration_s,
+            'error': self.error,
+        }
 
 # ============================================================================
 # CLASSE CHATBOT
@@ -62,47 +2432,555 @@ class QueryResponse(BaseModel):
 class HybridChatbot:
     """Chatbot hybride pour inférence"""
     
-    def __init__(self, config: Dict):
+    def __init__(self, config: Dict, wait: bool = True):
         self.config = config
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         
         logger.info("🚀 Initialisation du chatbot...")
         logger.info(f"   Device: {self.device}")
         
-        # Charger le modèle Intent
+        if config.get('torch_threads'):
+            torch.set_num_threads(config['torch_threads'])
+        logger.info(f"   Threads torch: {torch.get_num_threads()}")
+        
+        self.backend = config.get('inference_backend', 'torch')
+        if self.backend not in INFERENCE_BACKENDS:
+            raise ValueError(f"Backend d'inférence inconnu : {self.backend}")
+        logger.info(f"   Backend: {self.backend}")
+        
+        self.pipeline_mode = config.get('pipeline_mode', 'hybrid')
+        if self.pipeline_mode not in PIPELINE_MODES:
+            raise ValueError(f"Mode de pipeline inconnu : {self.pipeline_mode}")
+        single_encoder = self.pipeline_mode == 'single_encoder'
+        logger.info(f"   Pipeline: {self.pipeline_mode}")
+        
+        # Composants chargés en parallèle dans des threads de fond
+        # (single_encoder : pas de XLM-R, le modèle d'embedding devient requis)
+        if single_encoder:
+            intent_name, intent_loader = 'intent_head', self._load_intent_head
+        else:
+            intent_name, intent_loader = 'intent_model', self._load_intent_model
+        self.components = {
+            intent_name: ComponentState(intent_loader, required=True),
+            'knowledge_base': ComponentState(self._load_knowledge_base, required=True),
+            'embedding_model': ComponentState(
+                self._load_embedding_model,
+                required=single_encoder or config.get('eager_embedding_model', False)
+            ),
+        }
+        self.intent_head = None
+        self.snapshot = None
+        self._kb_lock = threading.Lock()
+        self._compaction = None
+        self._watcher = None
+        self._embedding_model = None
+        self._shared_tokenizer = False
+        self._load_lock = threading.Lock()
+        self._loader = ThreadPoolExecutor(max_workers=len(self.components), thread_name_prefix='loader')
+        self.query_cache = None
+        self.metrics = MetricsRegistry()
+        
+        # Caches d'embeddings et de tokenisation
+        self.embedding_cache = None
+        if config.get('embedding_cache_size', 0) > 0:
+            self.embedding_cache = EmbeddingCache(config['embedding_cache_size'])
+        self.token_cache = None
+        if config.get('token_cache_size', 0) > 0:
+            self.token_cache = LRUCache(config['token_cache_size'])
+        
+        # Charger les réponses par défaut
+        self._load_intent_templates()
+        
+        # Cache des réponses
+        if config.get('query_cache_size', 0) > 0:
+            self.query_cache = QueryCache(
+                config['query_cache_size'],
+                ttl_s=config.get('query_cache_ttl_s', 3600),
+                semantic_size=config.get('semantic_cache_size', 0),
+                max_distance=config.get('semantic_cache_distance')
+            )
+        
+        # Sessions de conversation (questions de suivi)
+        self.sessions = None
+        if config.get('session_max', 0) > 0:
+            self.sessions = SessionStore(
+                config['session_max'],
+                max_bytes=int(config.get('session_memory_mb', 64) * 1e6),
+                ttl_s=config.get('session_ttl_s', 1800),
+                max_turns=config.get('session_max_turns', 4),
+                max_chars=config.get('session_max_chars', 256),
+                decay=config.get('session_decay', 0.5)
+            )
+        
+        # Identification de la langue (routage, seuils et segments par langue)
+        self.language_id = load_language_identifier(config)
+        self.language_stats = LanguageStats()
+        
+        # Recherche RAG spéculative (pool dédié : ne bloque pas l'exécuteur HTTP)
+        self.speculation = SpeculativeRetrieval(
+            config.get('speculative_retrieval', 'off'),
+            min_rag_rate=config.get('speculative_min_rag_rate', 0.3),
+            window=config.get('speculative_window', 200)
+        )
+        self._start_background()
+        
+        # Lancer les chargements (le modèle d'embedding est paresseux par défaut)
+        for name, component in self.components.items():
+            if component.required:
+                self._start_loading(name)
+        
+        if wait:
+            self.wait_ready()
+    
+    @property
+    def ready(self) -> bool:
+        """Tous les composants requis sont chargés"""
+        return all(c.state == 'ready' for c in self.components.values() if c.required)
+    
+    def wait_ready(self):
+        """Bloquer jusqu'au chargement des composants requis"""
+        for name, component in self.components.items():
+            if component.required:
+                self._start_loading(name).result()
+        logger.info("✅ Chatbot prêt!")
+    
+    def _start_loading(self, name: str) -> Future:
+        """Lancer le chargement d'un composant en arrière-plan (idempotent)"""
+        with self._load_lock:
+            component = self.components[name]
+            if component.future is None:
+                component.future = self._loader.submit(component.load, name)
+            return component.future
+    
+    def _require(self, name: str):
+        """Attendre qu'un composant soit chargé (le charge si nécessaire)"""
+        self._start_loading(name).result()
+    
+    def _start_background(self):
+        """Démarrer les threads de fond (batching, spéculation, surveillance)"""
+        self._closed = threading.Event()
+        
+        # Micro-batching de la classification
+        self.intent_batcher = None
+        if self.pipeline_mode != 'single_encoder' and self.config.get('max_batch_size', 1) > 1:
+            self.intent_batcher = IntentBatcher(
+                self.classify_intents,
+                window_ms=self.config.get('batch_window_ms', 10),
+                max_batch_size=self.config['max_batch_size']
+            )
+            workers = self.config.get('inference_workers', 4)
+            if self.config['max_batch_size'] > workers:
+                logger.info(f"   Micro-batching : lots limités à {workers} requêtes "
+                            f"(inference_workers) malgré max_batch_size={self.config['max_batch_size']}")
+        
+        self._speculator = None
+        if self.speculation.mode != 'off':
+            self._speculator = ThreadPoolExecutor(
+                max_workers=self.config.get('inference_workers', 4),
+                thread_name_prefix='speculative'
+            )
+        
+        # Synchronisation à chaud avec un fichier de base de connaissances
+        self._watcher = None
+        if self.config.get('kb_watch_path'):
+            self._watcher = threading.Thread(target=self._watch_knowledge_base,
+                                             name='kb-watcher', daemon=True)
+            self._watcher.start()
+    
+    def close(self, wait: bool = False):
+        """Libérer les ressources (threads de fond)"""
+        self._closed.set()
+        if self.intent_batcher is not None:
+            self.intent_batcher.close()
+        if self._speculator is not None:
+            self._speculator.shutdown(wait=wait, cancel_futures=True)
+        self._loader.shutdown(wait=wait, cancel_futures=True)
+        if wait and self._watcher is not None:
+            self._watcher.join()
+    
+    def prepare_fork(self):
+        """Tout charger une fois, puis arrêter les threads avant `os.fork()`
+        
+        Les poids torch passent en mémoire partagée et les workers forkés
+        héritent du reste (base, index, caches vides) en copy-on-write.
+        Les threads ne survivent pas au fork : `after_fork` les relance.
+        """
+        if self.backend == 'onnx':
+            raise RuntimeError("Les sessions onnxruntime ne supportent pas le fork : "
+                               "utiliser les backends torch en multi-workers")
+        self.wait_ready()
+        self._require('embedding_model')
+        for model in (getattr(self, 'model', None), self._embedding_model):
+            if isinstance(model, torch.nn.Module):
+                model.share_memory()
+        self.close(wait=True)
+    
+    def after_fork(self):
+        """Relancer les threads de fond dans un worker forké"""
+        if self.config.get('torch_threads'):
+            torch.set_num_threads(self.config['torch_threads'])
+        self._loader = ThreadPoolExecutor(max_workers=len(self.components), thread_name_prefix='loader')
+        self._compaction = None
+        self._start_background()
+    
+    def _load_intent_model(self):
+        """Charger le modèle d'intention et ses mappings"""
         logger.info("📥 Chargement du modèle d'intention...")
-        self.tokenizer = XLMRobertaTokenizer.from_pretrained(config['model_path'])
-        self.model = XLMRobertaForSequenceClassification.from_pretrained(
-            config['model_path']
-        ).to(self.device)
-        self.model.eval()
-        
-        # Charger les mappings
-        with open(f"{config['model_path']}/label_mappings.json", 'r') as f:
+        self.tokenizer = load_intent_tokenizer(self.config['model_path'],
+                                               fast=self.config.get('fast_tokenizer', True))
+        logger.info(f"   Tokenizer: {type(self.tokenizer).__name__}")
+        
+        if self.backend == 'onnx':
+            self.model = OnnxModel(
+                os.path.join(self.config['onnx_model_dir'], ONNX_INTENT_FILE),
+                threads=self.config.get('torch_threads')
+            )
+        else:
+            self.model = XLMRobertaForSequenceClassification.from_pretrained(
+                self.config['model_path']
+            ).to(self.device)
+            self.model.eval()
+            if self.backend == 'torch_int8':
+                self.model = quantize_int8(self.model)
+        
+        with open(f"{self.config['model_path']}/label_mappings.json", 'r') as f:
             mappings = json.load(f)
             self.id2label = {int(k): v for k, v in mappings['id2label'].items()}
+    
+    def _load_embedding_model(self):
+        """Charger le modèle d'embedding"""
+        logger.info("📥 Chargement du modèle d'embedding...")
+        model = SentenceTransformer(self.config['embedding_model'])
+        if self.backend == 'torch_int8':
+            model = quantize_int8(model)
+        elif self.backend == 'onnx':
+            # Le SentenceTransformer reste chargé pour son tokenizer
+            self._embedding_session = OnnxModel(
+                os.path.join(self.config['onnx_model_dir'], ONNX_EMBEDDING_FILE),
+                threads=self.config.get('torch_threads')
+            )
+        
+        if self.pipeline_mode == 'single_encoder':
+            # Seul tokenizer du service
+            self.tokenizer = model.tokenizer
+            self._shared_tokenizer = model.max_seq_length == MAX_SEQ_LENGTH
+        else:
+            # La vérification du vocabulaire a besoin du tokenizer d'intention
+            self._require('intent_model')
+            self._shared_tokenizer = self._tokenizers_compatible(model)
+        logger.info(f"   Tokenisation partagée: {self._shared_tokenizer}")
+        self._embedding_model = model
+    
+    def _load_intent_head(self):
+        """Charger la tête d'intention linéaire (mode single_encoder)"""
+        logger.info("📥 Chargement de la tête d'intention...")
+        self.intent_head = IntentHead.load(self.config['intent_head_path'])
+        logger.info(f"   {len(self.intent_head.labels)} intentions ({self.intent_head.method})")
+    
+    @property
+    def intent_threshold(self) -> float:
+        """Seuil de confiance (celui calibré avec la tête en mode single_encoder)"""
+        if self.intent_head is not None and self.intent_head.threshold is not None:
+            return self.intent_head.threshold
+        return self.config['intent_threshold']
+    
+    def detect_language(self, text: str) -> str:
+        """Langue d'une requête (`default_language` si la détection est désactivée)"""
+        if not self.config.get('language_detection', True):
+            return self.config.get('default_language', 'fr')
+        return self.language_id.identify(text)
+    
+    def known_language(self, language: Optional[str]) -> Optional[str]:
+        """Langue fournie par le client, normalisée (`" FR"` → `fr`)
         
-        # Charger la base vectorielle
+        None si elle n'est pas une langue du modèle : la requête est alors
+        traitée comme sans langue (détection), ce qui borne les clés des
+        statistiques, des seuils et des segments.
+        """
+        if language is None:
+            return None
+        language = language.strip().lower()
+        return language if language in self.language_id.languages else None
+    
+    def thresholds(self, language: Optional[str]) -> Tuple[float, float]:
+        """Seuils (intention, similarité) de la langue, sinon les seuils globaux"""
+        overrides = self.config.get('language_thresholds', {}).get(language, {})
+        return (overrides.get('intent_threshold', self.intent_threshold),
+                overrides.get('similarity_threshold', self.config['similarity_threshold']))
+    
+    @property
+    def embedding_model(self) -> SentenceTransformer:
+        """Modèle d'embedding (chargé au premier usage si paresseux)"""
+        if self._embedding_model is None:
+            self._require('embedding_model')
+        return self._embedding_model
+    
+    @property
+    def shared_tokenizer(self) -> bool:
+        """Le modèle d'embedding réutilise-t-il les token ids du classifieur ?"""
+        if self._embedding_model is None:
+            self._require('embedding_model')
+        return self._shared_tokenizer
+    
+    def _load_knowledge_base(self):
+        """Charger la base vectorielle, son index et la base de connaissances"""
         logger.info("📥 Chargement de la base vectorielle...")
-        vector_data = np.load(config['vector_db_path'])
-        self.embeddings = vector_data['embeddings']
+        dtype = np.dtype(self.config.get('embedding_dtype', 'float32'))
+        store_path = self.config.get('kb_store_path')
         
-        # Charger la base de connaissances
-        with open(config['knowledge_base_path'], 'r', encoding='utf-8') as f:
-            self.knowledge_base = json.load(f)
+        if store_path and os.path.exists(os.path.join(store_path, 'manifest.json')):
+            # Format mmap : aucune copie, pages partagées entre workers
+            knowledge_base = MappedKnowledgeBase(store_path)
+            embeddings = knowledge_base.embeddings
+            check_kb_manifest(knowledge_base.manifest, embeddings, len(knowledge_base),
+                              self.config, store_path)
+            source = knowledge_base.manifest.get('checksum')
+            if embeddings.dtype != dtype:
+                logger.warning(f"⚠️  Base mmap en {embeddings.dtype}, conversion en {dtype} (copie)")
+                embeddings = embeddings.astype(dtype)
+            logger.info(f"   Base mmap: {store_path}")
+        else:
+            vector_data = np.load(self.config['vector_db_path'])
+            with open(self.config['knowledge_base_path'], 'r', encoding='utf-8') as f:
+                knowledge_base = json.load(f)
+            manifest_path = vector_db_manifest_path(self.config)
+            source = None
+            if os.path.exists(manifest_path):
+                with open(manifest_path, 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+                check_kb_manifest(manifest, vector_data['embeddings'], len(knowledge_base),
+                                  self.config, self.config['vector_db_path'])
+                source = manifest.get('checksum')
+            embeddings = normalize_rows(vector_data['embeddings'], dtype=dtype)
         
-        logger.info(f"   ✅ {len(self.knowledge_base)} paires Q-A chargées")
+        index = load_vector_index(self.config, embeddings, source)
+        logger.info(f"   Index vectoriel: {index.kind}")
+        lexical = load_lexical_index(self.config, knowledge_base)
+        partitions = None
+        if self.config.get('intent_partitions'):
+            partitions = IntentPartitions.build(embeddings, knowledge_base_intents(knowledge_base))
+            logger.info(f"   Partitions par intention: {len(partitions.labels)}")
+        shards = self._build_language_shards(knowledge_base, embeddings)
         
-        # Charger le modèle d'embedding
-        logger.info("📥 Chargement du modèle d'embedding...")
-        self.embedding_model = SentenceTransformer(
-            'sentence-transformers/paraphrase-multilingual-mpnet-base-v2'
-        )
+        snapshot = KnowledgeSnapshot(knowledge_base, embeddings, index,
+                                     lexical=lexical, partitions=partitions, shards=shards)
         
-        # Charger les réponses par défaut
-        self._load_intent_templates()
+        # Rejouer les mises à jour faites depuis la dernière compaction
+        operations = read_journal(self.config['kb_journal_path']) if self.config.get('kb_journal_path') else []
+        if operations:
+            snapshot = snapshot.changed(operations)
+            logger.info(f"   Journal: {len(operations)} mises à jour rejouées")
         
-        logger.info("✅ Chatbot prêt!")
+        self.snapshot = snapshot
+        logger.info(f"   ✅ {len(snapshot)} paires Q-A chargées")
+    
+    def _build_language_shards(self, knowledge_base, embeddings: np.ndarray) -> Optional[IntentPartitions]:
+        """Segments de la base par langue des questions (`language_shards`)"""
+        if not self.config.get('language_shards'):
+            return None
+        start = time.perf_counter()
+        shards = IntentPartitions.build(embeddings, knowledge_base_languages(knowledge_base, self.language_id))
+        sizes = dict(zip(shards.labels, np.diff(shards.offsets).tolist()))
+        logger.info(f"   Segments par langue: {sizes} ({time.perf_counter() - start:.1f}s)")
+        return shards
+    
+    @property
+    def knowledge_base(self) -> KnowledgeSnapshot:
+        """Base de connaissances courante (snapshot immuable)"""
+        return self.snapshot
+    
+    @property
+    def index(self):
+        """Index vectoriel du segment de base courant"""
+        return self.snapshot.index
+    
+    def reload_knowledge_base(self):
+        """Recharger la base depuis le disque et invalider le cache"""
+        with self._kb_lock:
+            self._load_knowledge_base()
+        if self.query_cache is not None:
+            self.query_cache.clear()
+    
+    def update_knowledge_base(self, upserts: Sequence[Dict] = (), deletes: Sequence[str] = ()) -> Dict:
+        """Ajouter / modifier / supprimer des paires Q-A à chaud
+        
+        Les entrées sont identifiées par leur question normalisée. Seules
+        les questions nouvelles sont encodées ; le changement est journalisé
+        puis publié par remplacement atomique du snapshot.
+        """
+        self._require('knowledge_base')
+        with self._kb_lock:
+            snapshot = self.snapshot
+            counts = Counter()
+            # Une entrée par question (la dernière l'emporte)
+            wanted = {}
+            for entry in upserts:
+                entry = {field: entry[field] for field in KB_ENTRY_FIELDS}
+                wanted[normalize_text(entry['question'])] = entry
+            changes = {}
+            for key, entry in wanted.items():
+                current = snapshot.lookup(key)
+                if current == entry:
+                    counts['unchanged'] += 1
+                    continue
+                counts['updated' if current is not None else 'added'] += 1
+                changes[key] = entry
+            removed = {normalize_text(question) for question in deletes}
+            removed = {key for key in removed if snapshot.lookup(key) is not None}
+            counts['deleted'] = len(removed)
+            
+            # Encoder seulement les questions absentes de la base
+            new_keys = [key for key in changes if snapshot.lookup(key) is None]
+            encoded = dict(zip(new_keys, self._encode([changes[key]['question'] for key in new_keys]))) \
+                if new_keys else {}
+            
+            operations, records = [], []
+            for key, entry in changes.items():
+                embedding = encoded[key] if key in encoded else snapshot.embedding_for(key)
+                operations.append(('upsert', key, entry, embedding))
+                records.append(journal_record('upsert', key, entry, embedding))
+            for key in removed:
+                operations.append(('delete', key))
+                records.append(journal_record('delete', key))
+            
+            if operations:
+                self._append_journal(records)
+                self.snapshot = snapshot.changed(operations)
+                if self.query_cache is not None:
+                    self.query_cache.clear()
+                logger.info(f"🔄 Base mise à jour (v{self.snapshot.version}): {dict(counts)}")
+                self._maybe_compact()
+        
+        return {**counts, 'encoded': len(new_keys), **self.snapshot.stats()}
+    
+    def _append_journal(self, records: List[Dict]):
+        """Écrire les changements sur disque avant de les publier"""
+        path = self.config.get('kb_journal_path')
+        if not path or not self.config.get('kb_writer', True):
+            return
+        with open(path, 'a', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+    
+    def _maybe_compact(self):
+        """Planifier une compaction si le delta devient trop gros
+        
+        Aussi sur les workers secondaires (`kb_writer` False) : la
+        compaction y reste en mémoire, sans écriture disque ni journal.
+        """
+        stats = self.snapshot.stats()
+        pending = stats['delta_rows'] + stats['deleted_rows']
+        limit = max(self.config.get('kb_compact_min_rows', 1000),
+                    self.config.get('kb_compact_ratio', 0.1) * stats['base_rows'])
+        if pending > limit and (self._compaction is None or self._compaction.done()):
+            self._compaction = self._loader.submit(self.compact_knowledge_base)
+    
+    def compact_knowledge_base(self) -> Dict:
+        """Refondre base + delta en un nouveau segment (index, et disque si `kb_writer`)"""
+        self._require('knowledge_base')
+        with self._kb_lock:
+            start = time.perf_counter()
+            snapshot = self.snapshot
+            entries, embeddings = snapshot.materialize()
+            dtype = np.dtype(self.config.get('embedding_dtype', 'float32'))
+            persist = self.config.get('kb_writer', True)
+            
+            store_path = self.config.get('kb_store_path')
+            source = None
+            if store_path and persist:
+                MappedKnowledgeBase.write(store_path, embeddings, entries, dtype=str(dtype),
+                                          embedding_model=self.config['embedding_model'])
+                entries = MappedKnowledgeBase(store_path)
+                source = entries.manifest.get('checksum')
+                embeddings = entries.embeddings
+                if embeddings.dtype != dtype:
+                    embeddings = embeddings.astype(dtype)
+            else:
+                embeddings = normalize_rows(embeddings, dtype=dtype)
+                if persist:
+                    source = self._write_json_knowledge_base(entries, embeddings)['checksum']
+            
+            # IVF : garder les centroïdes, seule l'affectation est refaite
+            if snapshot.index.kind == 'ivf':
+                index = IVFIndex.assign(embeddings, snapshot.index.centroids,
+                                        nprobe=snapshot.index.nprobe)
+                index.source = source
+                if persist:
+                    index.save(self.config['vector_index_path'])
+            else:
+                index = FlatIndex(embeddings)
+            
+            lexical = None
+            if snapshot.lexical is not None:
+                lexical = BM25Index.build([lexical_text(entries[row]) for row in range(len(entries))])
+                if persist and self.config.get('lexical_index_path'):
+                    lexical.save(self.config['lexical_index_path'])
+            
+            partitions = None
+            if snapshot.partitions is not None:
+                partitions = IntentPartitions.build(embeddings, knowledge_base_intents(entries))
+            shards = self._build_language_shards(entries, embeddings)
+            
+            self.snapshot = KnowledgeSnapshot(entries, embeddings, index, version=snapshot.version + 1,
+                                              lexical=lexical, partitions=partitions, shards=shards)
+            journal_path = self.config.get('kb_journal_path')
+            if persist and journal_path and os.path.exists(journal_path):
+                os.remove(journal_path)
+            
+            elapsed_s = time.perf_counter() - start
+            logger.info(f"🗜️  Base compactée (v{self.snapshot.version}): "
+                        f"{len(self.snapshot)} paires en {elapsed_s:.1f}s")
+        return {**self.snapshot.stats(), 'duration_s': round(elapsed_s, 3)}
+    
+    def _write_json_knowledge_base(self, entries: List[Dict], embeddings: np.ndarray) -> Dict:
+        """Réécrire vector_database.npz + knowledge_base.json (fichiers temporaires puis rename)
+        
+        Retourne le manifeste écrit.
+        """
+        vector_path, kb_path = self.config['vector_db_path'], self.config['knowledge_base_path']
+        with open(vector_path + '.tmp', 'wb') as f:
+            np.savez(f, embeddings=np.asarray(embeddings, dtype=np.float32))
+        with open(kb_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(entries, f, ensure_ascii=False)
+        manifest = {'count': len(entries), 'dim': int(embeddings.shape[1]),
+                    'embedding_model': self.config['embedding_model'],
+                    'checksum': embeddings_checksum(np.asarray(embeddings, dtype=np.float32))}
+        manifest_path = vector_db_manifest_path(self.config)
+        with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(vector_path + '.tmp', vector_path)
+        os.replace(kb_path + '.tmp', kb_path)
+        os.replace(manifest_path + '.tmp', manifest_path)
+        return manifest
+    
+    def _watch_knowledge_base(self):
+        """Appliquer les changements d'un fichier JSON surveillé (différentiel)"""
+        path = self.config['kb_watch_path']
+        interval = self.config.get('kb_watch_interval_s', 2.0)
+        last_mtime = None
+        while not self._closed.wait(interval):
+            if self.components['knowledge_base'].state != 'ready' or not os.path.exists(path):
+                continue
+            mtime = os.path.getmtime(path)
+            if mtime == last_mtime:
+                continue
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    entries = json.load(f)
+            except json.JSONDecodeError:
+                continue  # Fichier en cours d'écriture : réessayer au prochain tour
+            
+            wanted = {normalize_text(entry['question']) for entry in entries}
+            deletes = [entry['question'] for entry in self.snapshot
+                       if normalize_text(entry['question']) not in wanted]
+            try:
+                summary = self.update_knowledge_base(entries, deletes)
+                logger.info(f"👀 {path} synchronisé : {summary}")
+            except Exception as e:
+                logger.error(f"❌ Synchronisation de {path} impossible : {e}")
+            last_mtime = mtime
     
     def _load_intent_templates(self):
         """Charger les templates de réponses par intention"""
@@ -156,106 +3034,675 @@ class HybridChatbot:
     
     def classify_intent(self, text: str) -> tuple:
         """Classifier l'intention"""
-        inputs = self.tokenizer(
-            text,
-            return_tensors='pt',
-            max_length=128,
-            truncation=True,
-            padding=True
-        ).to(self.device)
-        
-        with torch.no_grad():
-            outputs = self.model(**inputs)
-            probs = torch.softmax(outputs.logits, dim=1)
+        if self.intent_batcher is not None:
+            return self.intent_batcher.submit(text)
+        return self.classify_intents([text])[0]
+    
+    def _tokenizers_compatible(self, embedding_model: SentenceTransformer) -> bool:
+        """Le modèle d'embedding accepte-t-il les token ids du classifieur ?
+        
+        Vrai pour paraphrase-multilingual-mpnet-base-v2, qui reprend le
+        vocabulaire SentencePiece de XLM-R.
+        """
+        st_tokenizer = getattr(embedding_model, 'tokenizer', None)
+        if st_tokenizer is None or embedding_model.max_seq_length != MAX_SEQ_LENGTH:
+            return False
+        probes = ["Comment m'inscrire à l'UM5 ?", "متى تبدأ التسجيلات؟", "Library opening hours"]
+        return len(st_tokenizer) == len(self.tokenizer) and all(
+            st_tokenizer(p)['input_ids'] == self.tokenizer(p)['input_ids'] for p in probes
+        )
+    
+    def tokenize(self, texts: List[str]) -> Dict[str, torch.Tensor]:
+        """Tokeniser et padder un lot (token ids mémoïsés par texte)"""
+        if self.token_cache is None:
+            return self.tokenizer(texts, return_tensors='pt', max_length=MAX_SEQ_LENGTH,
+                                  truncation=True, padding=True)
+        return self.tokenizer.pad({'input_ids': self.token_ids(texts)}, return_tensors='pt')
+    
+    def token_ids(self, texts: List[str]) -> List[List[int]]:
+        """Token ids non paddés (mémoïsés par texte si le cache est actif)"""
+        if self.token_cache is None:
+            return self.tokenizer(texts, max_length=MAX_SEQ_LENGTH, truncation=True)['input_ids']
+        
+        ids = [self.token_cache.get(text) for text in texts]
+        missing = [text for text, found in zip(texts, ids) if found is None]
+        if missing:
+            encoded = iter(self.tokenizer(missing, max_length=MAX_SEQ_LENGTH, truncation=True)['input_ids'])
+            for i, found in enumerate(ids):
+                if found is None:
+                    ids[i] = next(encoded)
+                    self.token_cache.put(texts[i], ids[i])
+        return ids
+    
+    def classify_intents(self, texts: List[str]) -> List[tuple]:
+        """Classifier un lot de textes en un seul forward pass"""
+        if self.intent_head is not None:
+            return self.intent_head.predict(self.encode_queries(texts))
+        
+        with self.metrics.time('um5_batch_stage_duration_milliseconds', stage='tokenization'):
+            token_ids = self.token_ids(texts)
+        
+        # Un forward pass par groupe de longueurs voisines (padding borné)
+        predictions = [None] * len(texts)
+        for group in length_groups([len(ids) for ids in token_ids], self.config.get('max_padding_ratio')):
+            inputs = self.tokenizer.pad({'input_ids': [token_ids[j] for j in group]}, return_tensors='pt')
+            for j, prediction in zip(group, self._classify(inputs)):
+                predictions[j] = prediction
+        return predictions
+    
+    def _classify(self, inputs) -> List[tuple]:
+        """Forward pass du classifieur sur un lot déjà tokenisé"""
+        inputs = inputs.to(self.device)
+        with torch.no_grad(), self.metrics.time('um5_batch_stage_duration_milliseconds',
+                                                stage='intent_forward'):
+            if self.backend == 'onnx':
+                logits = torch.from_numpy(self.model(inputs))
+            else:
+                logits = self.model(**inputs).logits
+            probs = torch.softmax(logits, dim=1)
             confidence, pred_idx = torch.max(probs, dim=1)
         
-        intent = self.id2label[pred_idx.item()]
-        return intent, confidence.item()
+        return [
+            (self.id2label[idx], conf)
+            for idx, conf in zip(pred_idx.tolist(), confidence.tolist())
+        ]
+    
+    def search_similar(self, query: str, top_k: int = 3, language: Optional[str] = None) -> List[Dict]:
+        """Recherche par similarité (dans le segment de `language` si `language_shards`)"""
+        return self.search_similar_many([query], top_k=top_k,
+                                        languages=[language] if language else None)[0]
     
-    def search_similar(self, query: str, top_k: int = 3) -> List[Dict]:
-        """Recherche par similarité"""
-        # Encoder la requête
-        query_embedding = self.embedding_model.encode([query])[0]
+    def search_similar_many(self, queries: List[str], top_k: int = 3,
+                            languages: Optional[List[str]] = None) -> List[List[Dict]]:
+        """Recherche par similarité pour un lot de requêtes"""
+        return self.search_embeddings(self.encode_queries(queries), top_k=top_k, queries=queries,
+                                      languages=languages)
+    
+    def encode_queries(self, queries: List[str]) -> np.ndarray:
+        """Encoder des requêtes (normalisées : cosinus = produit scalaire)"""
+        if self.embedding_cache is None:
+            return self._encode(queries)
         
-        # Calculer les similarités
-        similarities = cosine_similarity(
-            [query_embedding], 
-            self.embeddings
-        )[0]
+        keys = [normalize_text(q) for q in queries]
+        cached = self.embedding_cache.get_many(keys)
+        missing = [i for i, vector in enumerate(cached) if vector is None]
+        if missing:
+            encoded = self._encode([queries[i] for i in missing])
+            self.embedding_cache.put_many([keys[i] for i in missing], encoded)
+            for i, vector in zip(missing, encoded):
+                cached[i] = vector
+        return np.stack(cached)
+    
+    def _encode(self, queries: List[str]) -> np.ndarray:
+        """Passe avant du modèle d'embedding (réutilise les token ids si possible)"""
+        model = self.embedding_model
+        with self.metrics.time('um5_batch_stage_duration_milliseconds', stage='embedding_forward'):
+            if self.backend == 'onnx':
+                features = self.tokenize(queries) if self.shared_tokenizer else model.tokenize(queries)
+                return normalize_rows(self._embedding_session(features))
+            if not self.shared_tokenizer:
+                return normalize_rows(model.encode(queries))
+            
+            features = self.tokenize(queries).to(model.device)
+            with torch.no_grad():
+                output = model(dict(features))
+            return normalize_rows(output['sentence_embedding'].cpu().numpy())
+    
+    def search_embeddings(self, query_embeddings: np.ndarray, top_k: int = 3,
+                          queries: Optional[List[str]] = None,
+                          mode: Optional[str] = None,
+                          intents: Optional[List[str]] = None,
+                          languages: Optional[List[str]] = None) -> List[List[Dict]]:
+        """Recherche par similarité à partir d'embeddings déjà calculés
         
-        # Top-K
-        top_indices = np.argsort(similarities)[-top_k:][::-1]
+        Avec le texte des requêtes et un index BM25, `retrieval_mode`
+        (ou `mode`) choisit la recherche hybride ou le pré-filtrage lexical.
+        En mode dense, la langue des requêtes restreint la recherche à son
+        segment (`language_shards`), sinon les intentions prédites à leurs
+        partitions (`intent_partitions`).
+        """
+        # Top-K sur un snapshot cohérent de la base
+        snapshot = self.snapshot
+        mode = mode or self.config.get('retrieval_mode', 'dense')
+        if mode != 'dense' and queries is not None and snapshot.lexical is not None:
+            top_indices, top_scores = snapshot.search_lexical(
+                query_embeddings, queries, top_k, mode=mode,
+                n_candidates=self.config.get('lexical_candidates', 100),
+                fusion=self.config.get('hybrid_fusion', 'rrf'),
+                rrf_k=self.config.get('rrf_k', 60),
+                alpha=self.config.get('hybrid_alpha', 0.5)
+            )
+        elif mode == 'dense' and languages is not None and snapshot.shards is not None:
+            top_indices, top_scores, widened = snapshot.search_partitioned(
+                query_embeddings, languages, top_k, top_n=1,
+                threshold=[self.thresholds(language)[1] for language in languages],
+                partitions=snapshot.shards
+            )
+            for wide in widened:
+                self.metrics.inc('um5_language_shard_searches_total', outcome='widened' if wide else 'shard')
+        elif mode == 'dense' and intents is not None and snapshot.partitions is not None:
+            top_indices, top_scores, widened = snapshot.search_partitioned(
+                query_embeddings, intents, top_k,
+                top_n=self.config.get('intent_partition_top_n', 2),
+                threshold=self.config['similarity_threshold']
+            )
+            for wide in widened:
+                self.metrics.inc('um5_partitioned_searches_total', outcome='widened' if wide else 'partition')
+        else:
+            top_indices, top_scores = snapshot.search(query_embeddings, top_k)
         
+        return [
+            self._build_results(snapshot, indices, scores)
+            for indices, scores in zip(top_indices, top_scores)
+        ]
+    
+    def _build_results(self, snapshot: KnowledgeSnapshot, indices, similarities) -> List[Dict]:
+        """Construire les documents résultats à partir des indices et scores"""
         results = []
-        for idx in top_indices:
+        for idx, similarity in zip(indices, similarities):
+            if not np.isfinite(similarity):
+                continue  # Ligne supprimée
+            entry = snapshot[idx]
             results.append({
-                'question': self.knowledge_base[idx]['question'],
-                'answer': self.knowledge_base[idx]['answer'],
-                'intent': self.knowledge_base[idx]['intent'],
-                'similarity': float(similarities[idx])
+                'question': entry['question'],
+                'answer': entry['answer'],
+                'intent': entry['intent'],
+                'similarity': float(similarity)
             })
         
         return results
     
-    def process_query(self, query: str) -> Dict:
-        """Pipeline principal"""
-        start_time = time.time()
+    def process_query(self, query: str, include_timings: bool = False,
+                      on_event: Optional[Callable[[str, Dict], None]] = None,
+                      session_id: Optional[str] = None, language: Optional[str] = None) -> Dict:
+        """Pipeline principal (derrière le cache), instrumenté par étape
         
-        # 1. Classification d'intention
-        intent, confidence = self.classify_intent(query)
+        `on_event('route', {...})` est appelé dès que le routage est connu
+        (après la classification ou un hit de cache), avant la recherche RAG.
+        Avec `session_id`, les tours précédents servent à router les
+        questions de suivi (voir `_contextual_search`). La langue (détectée
+        si `language` n'est pas fournie) choisit les seuils et le segment
+        de base à parcourir.
+        """
+        timer = StageTimer()
+        language = self.known_language(language)
+        if language is None:
+            with timer.stage('language'):
+                language = self.detect_language(query)
+        session = None
+        if session_id is not None and self.sessions is not None:
+            with timer.stage('session'):
+                session = self.sessions.get(session_id)
+        
+        response, cache_tier, query_embedding = self._answer(query, timer, on_event, session, language)
+        
+        if session_id is not None and self.sessions is not None:
+            with timer.stage('session'):
+                self.sessions.record(session_id, session, query, response['intent'],
+                                     query_embedding, followup=response.get('followup', False))
+        response = {**response, 'cache': cache_tier, 'language': language, 'latency_ms': timer.elapsed_ms()}
+        
+        route = response['method']
+        self.metrics.inc('um5_requests_total', route=route, cache=cache_tier or 'miss')
+        self.metrics.histogram('um5_request_duration_milliseconds', route=route).observe(response['latency_ms'])
+        self.language_stats.record(language, route, response['latency_ms'])
+        for stage, elapsed_ms in timer.stages.items():
+            self.metrics.histogram('um5_stage_duration_milliseconds', stage=stage, route=route).observe(elapsed_ms)
+        
+        if include_timings:
+            response['timings'] = dict(timer.stages)
+        return response
+    
+    def _answer(self, query: str, timer: StageTimer,
+                on_event: Optional[Callable[[str, Dict], None]] = None,
+                session: Optional[SessionContext] = None, language: Optional[str] = None
+                ) -> Tuple[Dict, Optional[str], Optional[np.ndarray]]:
+        """Réponse depuis le cache (et son niveau) ou depuis le pipeline, et embedding calculé"""
+        if self.query_cache is None:
+            response, query_embedding, _ = self._run_pipeline(query, timer, on_event=on_event,
+                                                              session=session, language=language)
+            return response, None, query_embedding
+        
+        key = cache_key(query, language)
+        with timer.stage('cache'):
+            cached = self.query_cache.get(key)
+        
+        # En session, une réponse RAG en cache a été calculée sans contexte :
+        # seule une réponse d'intention reste valable
+        if (cached is not None and session is not None and session.has_context
+                and cached['method'] != 'intent_classification'):
+            cached = None
+        
+        if cached is not None:
+            if on_event is not None:
+                on_event('route', {'route': cached['method'], 'intent': cached['intent'],
+                                   'confidence': cached['confidence'], 'cache': 'exact'})
+            return cached, 'exact', None
+        
+        # Le tier sémantique est consulté par le pipeline après la
+        # classification, sur la seule branche RAG (hors contexte de session)
+        semantic = self.query_cache.semantic_enabled and (session is None or not session.has_context)
+        response, query_embedding, tier = self._run_pipeline(query, timer, None, on_event,
+                                                             session, language, semantic)
+        if tier is None:
+            self.query_cache.record_miss()
+            # Une réponse calculée avec le contexte d'une session n'est pas
+            # réutilisable hors de cette session
+            if session is None or not session.has_context:
+                self.query_cache.put(key, response, query_embedding, language)
+        return response, tier, query_embedding
+    
+    def _run_pipeline(self, query: str, timer: StageTimer,
+                      query_embedding: Optional[np.ndarray] = None,
+                      on_event: Optional[Callable[[str, Dict], None]] = None,
+                      session: Optional[SessionContext] = None, language: Optional[str] = None,
+                      semantic: bool = False) -> Tuple[Dict, Optional[np.ndarray], Optional[str]]:
+        """Classification puis routing intent / RAG / fallback (seuils de la langue)
+        
+        Avec `semantic`, une requête routée vers le RAG est d'abord cherchée
+        dans le cache sémantique : son embedding est calculé de toute façon,
+        alors que les questions à haute confiance (la majorité) n'en ont pas
+        besoin. Retourne la réponse, l'embedding et le niveau de cache.
+        """
+        intent_threshold, similarity_threshold = self.thresholds(language)
+        languages = [language] if language else None
+        # 0. Recherche spéculative en parallèle de la classification
+        # (seulement si le modèle d'embedding est déjà chargé)
+        speculative = None
+        if (query_embedding is None and self._speculator is not None
+                and self.intent_head is None
+                and self.components['embedding_model'].state == 'ready'
+                and self.speculation.should_speculate()):
+            speculative = self._speculator.submit(self._speculative_search, query, languages)
+        
+        # 1. Classification d'intention (single_encoder : sur l'embedding de la requête)
+        if self.intent_head is not None:
+            if query_embedding is None:
+                with timer.stage('embedding'):
+                    query_embedding = self.encode_queries([query])[0]
+            with timer.stage('classification'):
+                intent, confidence = self.intent_head.predict(query_embedding[None])[0]
+        else:
+            with timer.stage('classification'):
+                intent, confidence = self.classify_intent(query)
+        
+        rag = confidence < intent_threshold
+        self.speculation.record_route(rag)
+        if on_event is not None:
+            route = 'rag_retrieval' if rag else 'intent_classification'
+            on_event('route', {'route': route, 'intent': intent, 'confidence': confidence, 'cache': None})
         
         # 2. Décision de routing
-        if confidence >= self.config['intent_threshold']:
+        if not rag:
             # Haute confiance → Réponse directe
-            answer = self.intent_templates.get(intent, self.intent_templates['default'])
-            
-            response = {
-                'answer': answer,
-                'method': 'intent_classification',
-                'confidence': confidence,
-                'intent': intent,
-                'sources': None,
-                'latency_ms': (time.time() - start_time) * 1000
-            }
-        else:
-            # Basse confiance → RAG
-            similar_docs = self.search_similar(query, top_k=self.config['top_k'])
-            best_similarity = max([doc['similarity'] for doc in similar_docs])
-            
-            if best_similarity >= self.config['similarity_threshold']:
-                # Bon match RAG
-                answer = similar_docs[0]['answer']
-                
-                response = {
-                    'answer': answer,
-                    'method': 'rag_retrieval',
-                    'confidence': best_similarity,
-                    'intent': intent,
-                    'sources': similar_docs,
-                    'latency_ms': (time.time() - start_time) * 1000
-                }
+            if speculative is not None:
+                self._discard_speculation(speculative)
+            with timer.stage('response'):
+                response = self._intent_response(intent, confidence)
+            return response, query_embedding, None
+        
+        # Basse confiance → RAG
+        similar_docs = None
+        if speculative is not None:
+            with timer.stage('speculative_wait'):
+                query_embedding, similar_docs, _ = speculative.result()
+            self._record_speculation('used')
+        elif query_embedding is None:
+            with timer.stage('embedding'):
+                query_embedding = self.encode_queries([query])[0]
+        
+        if semantic:
+            with timer.stage('cache'):
+                cached = self.query_cache.get_similar(query_embedding, language)
+            if cached is not None:
+                return cached, query_embedding, 'semantic'
+        
+        if similar_docs is None:
+            with timer.stage('search'):
+                similar_docs = self.search_embeddings(query_embedding[None], top_k=self.config['top_k'],
+                                                      queries=[query], intents=[intent],
+                                                      languages=languages)[0]
+        
+        followup = False
+        if session is not None and session.has_context:
+            similar_docs, followup = self._contextual_search(query, query_embedding, similar_docs,
+                                                             session, timer, languages)
+        
+        with timer.stage('response'):
+            if followup:
+                best = max(similar_docs, key=lambda doc: doc['similarity'])
+                response = {**self._retrieval_response(best['intent'], similar_docs, similarity_threshold),
+                            'followup': True}
             else:
-                # Fallback
-                answer = f"""Je ne suis pas certain de bien comprendre votre question.
+                response = self._retrieval_response(intent, similar_docs, similarity_threshold)
+        
+        return response, query_embedding, None
+    
+    def _contextual_search(self, query: str, query_embedding: np.ndarray, similar_docs: List[Dict],
+                           session: SessionContext, timer: StageTimer,
+                           languages: Optional[List[str]] = None) -> Tuple[List[Dict], bool]:
+        """Recherche avec le contexte de la session (questions de suivi)
+        
+        La requête est mélangée à l'embedding de contexte de la session
+        (« et pour le master ? » après une question sur l'inscription) ;
+        le résultat n'est gardé que s'il est plus proche que la recherche
+        sans contexte, ce qui laisse passer les changements de sujet.
+        """
+        if session.pending:
+            # Questions des tours routés par intention, encodées une seule fois
+            with timer.stage('embedding'):
+                session.fold(self.encode_queries(session.pending), self.config.get('session_decay', 0.5))
+        
+        with timer.stage('search'):
+            blended = normalize_rows(query_embedding + self.config.get('session_context_weight', 1.0)
+                                     * session.embedding)
+            contextual = self.search_embeddings(blended[None], top_k=self.config['top_k'],
+                                                queries=[f"{session.last_question} {query}"],
+                                                intents=[session.last_intent], languages=languages)[0]
+        
+        best = max((doc['similarity'] for doc in similar_docs), default=-1.0)
+        if contextual and max(doc['similarity'] for doc in contextual) > best:
+            return contextual, True
+        return similar_docs, False
+    
+    def _speculative_search(self, query: str, languages: Optional[List[str]] = None
+                            ) -> Tuple[np.ndarray, List[Dict], float]:
+        """Embedding + recherche lancés avant la classification"""
+        start = time.perf_counter()
+        query_embedding = self.encode_queries([query])[0]
+        similar_docs = self.search_embeddings(query_embedding[None], top_k=self.config['top_k'],
+                                              queries=[query], languages=languages)[0]
+        return query_embedding, similar_docs, (time.perf_counter() - start) * 1000
+    
+    def _discard_speculation(self, speculative: Future):
+        """Annuler la recherche spéculative, ou comptabiliser le calcul perdu"""
+        if speculative.cancel():
+            self._record_speculation('cancelled')
+            return
+        
+        def on_done(future):
+            wasted_ms = future.result()[2] if future.exception() is None else 0.0
+            self._record_speculation('wasted', wasted_ms)
+        speculative.add_done_callback(on_done)
+    
+    def _record_speculation(self, outcome: str, wasted_ms: float = 0.0):
+        self.speculation.record_outcome(outcome, wasted_ms)
+        self.metrics.inc('um5_speculative_retrievals_total', outcome=outcome)
+        if wasted_ms:
+            self.metrics.inc('um5_speculative_wasted_milliseconds_total', wasted_ms)
+    
+    def _intent_response(self, intent: str, confidence: float) -> Dict:
+        """Réponse directe depuis le template de l'intention"""
+        return {
+            'answer': self.intent_templates.get(intent, self.intent_templates['default']),
+            'method': 'intent_classification',
+            'confidence': confidence,
+            'intent': intent,
+            'sources': None
+        }
+    
+    def _retrieval_response(self, intent: str, similar_docs: List[Dict],
+                            threshold: Optional[float] = None) -> Dict:
+        """Réponse RAG, ou fallback si aucun document n'est assez proche
+        
+        `similar_docs` peut être vide (base vidée par des suppressions).
+        """
+        best_similarity = max([doc['similarity'] for doc in similar_docs], default=0.0)
+        threshold = self.config['similarity_threshold'] if threshold is None else threshold
+        
+        if similar_docs and best_similarity >= threshold:
+            # Bon match RAG
+            answer = similar_docs[0]['answer']
+            method = 'rag_retrieval'
+        else:
+            # Fallback
+            hint = f"""
 
 **Voici ce qui pourrait vous aider :**
 
-{similar_docs[0]['answer'][:200]}...
+{similar_docs[0]['answer'][:200]}...""" if similar_docs else ""
+            answer = f"""Je ne suis pas certain de bien comprendre votre question.{hint}
 
 📞 **Pour plus d'informations** :
 - Email : info@um5.ac.ma
 - Téléphone : +212 5XX-XX-XX-XX"""
-                
-                response = {
-                    'answer': answer,
-                    'method': 'fallback',
-                    'confidence': best_similarity,
-                    'intent': intent,
-                    'sources': similar_docs,
-                    'latency_ms': (time.time() - start_time) * 1000
-                }
+            method = 'fallback'
         
-        return response
+        return {
+            'answer': answer,
+            'method': method,
+            'confidence': best_similarity,
+            'intent': intent,
+            'sources': similar_docs
+        }
+    
+    def process_queries(self, queries: List[str], batch_size: Optional[int] = None,
+                        language: Optional[str] = None) -> List[Dict]:
+        """Pipeline par lots (évaluation, préchauffage des caches)
+        
+        Classification et embedding par lots de longueurs voisines, puis
+        recherche vectorisée de toutes les requêtes routées vers le RAG.
+        Les réponses sont rendues dans l'ordre ; `latency_ms` est la durée
+        du lot entier. `language` s'applique à tout le lot (sinon détectée
+        par requête).
+        """
+        batch_size = batch_size or self.config.get('bulk_batch_size', 64)
+        start = time.perf_counter()
+        language = self.known_language(language)
+        languages = [language or self.detect_language(q) for q in queries]
+        responses, tiers = [None] * len(queries), [None] * len(queries)
+        
+        # Cache exact, puis dédoublonnage des requêtes restantes
+        keys = [cache_key(q, lang) for q, lang in zip(queries, languages)]
+        pending = {}
+        for i, key in enumerate(keys):
+            if key in pending:
+                continue
+            if self.query_cache is not None:
+                cached = self.query_cache.get(key)
+                if cached is not None:
+                    responses[i], tiers[i] = cached, 'exact'
+                    continue
+                self.query_cache.record_miss()
+            pending[key] = i
+        
+        rows = list(pending.values())
+        texts = [queries[i] for i in rows]
+        with self.metrics.time('um5_batch_stage_duration_milliseconds', stage='tokenization'):
+            token_ids = self.token_ids(texts)
+        
+        # 1. Classification par lots de longueurs voisines
+        predictions = [None] * len(texts)
+        embeddings, documents = {}, {}
+        for bucket in length_buckets([len(ids) for ids in token_ids], batch_size):
+            if self.intent_head is not None:
+                encoded = self.encode_queries([texts[j] for j in bucket])
+                for j, embedding, prediction in zip(bucket, encoded, self.intent_head.predict(encoded)):
+                    embeddings[j], predictions[j] = embedding, prediction
+            else:
+                inputs = self.tokenizer.pad({'input_ids': [token_ids[j] for j in bucket]}, return_tensors='pt')
+                for j, prediction in zip(bucket, self._classify(inputs)):
+                    predictions[j] = prediction
+        
+        # 2. Embedding (si pas déjà fait) + recherche pour les requêtes à basse confiance
+        thresholds = [self.thresholds(languages[i]) for i in rows]
+        rag = [j for j, (_, confidence) in enumerate(predictions) if confidence < thresholds[j][0]]
+        for bucket in length_buckets([len(token_ids[j]) for j in rag], batch_size):
+            selected = [rag[b] for b in bucket]
+            missing = [j for j in selected if j not in embeddings]
+            if missing:
+                for j, embedding in zip(missing, self.encode_queries([texts[j] for j in missing])):
+                    embeddings[j] = embedding
+            found = self.search_embeddings(np.stack([embeddings[j] for j in selected]),
+                                           top_k=self.config['top_k'],
+                                           queries=[texts[j] for j in selected],
+                                           intents=[predictions[j][0] for j in selected],
+                                           languages=[languages[rows[j]] for j in selected])
+            for j, docs in zip(selected, found):
+                documents[j] = docs
+        
+        # 3. Réponses (et remplissage du cache)
+        for j, (i, (intent, confidence)) in enumerate(zip(rows, predictions)):
+            if j in documents:
+                responses[i] = self._retrieval_response(intent, documents[j], thresholds[j][1])
+            else:
+                responses[i] = self._intent_response(intent, confidence)
+            if self.query_cache is not None:
+                self.query_cache.put(keys[i], responses[i], embeddings.get(j), languages[i])
+        
+        for i, key in enumerate(keys):
+            if responses[i] is None:
+                responses[i] = responses[pending[key]]
+        
+        latency_ms = (time.perf_counter() - start) * 1000
+        for response, tier in zip(responses, tiers):
+            self.metrics.inc('um5_requests_total', route=response['method'], cache=tier or 'miss')
+        self.metrics.histogram('um5_bulk_duration_milliseconds').observe(latency_ms)
+        
+        return [
+            {**response, 'cache': tier, 'language': language, 'latency_ms': latency_ms}
+            for response, tier, language in zip(responses, tiers, languages)
+        ]
+
+# ============================================================================
+# RÉPONSES PRÉCOMPILÉES ET FICHIERS STATIQUES
+# ============================================================================
+
+try:
+    import orjson  # Optionnel : sérialisation JSON rapide
+except ImportError:
+    orjson = None
+try:
+    import brotli  # Optionnel : variantes brotli des fichiers statiques
+except ImportError:
+    brotli = None
+
+QUERY_RESPONSE_FIELDS = tuple(QueryResponse.model_fields)
+QUERY_RESPONSE_DEFAULTS = {'followup': False}
+
+def dump_json(data) -> bytes:
+    """JSON UTF-8 compact (orjson s'il est installé)"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+class ChatPayloads:
+    """Corps JSON des réponses de chat, sans passer par Pydantic
+    
+    Une réponse d'intention ne varie que par `confidence`, `cache` et
+    `latency_ms` : le reste (dont le template, l'essentiel des octets)
+    est sérialisé une fois par (intention, réponse) et simplement
+    concaténé à la partie variable.
+    """
+    
+    def __init__(self):
+        self._prefixes = {}
+    
+    def precompile(self, templates: Dict[str, str]):
+        """Sérialiser d'avance la partie fixe de chaque template"""
+        for intent, answer in templates.items():
+            self._prefix(intent, answer)
+    
+    def _prefix(self, intent: str, answer: str) -> bytes:
+        key = (intent, answer)  # Le hash des templates est mis en cache par Python
+        prefix = self._prefixes.get(key)
+        if prefix is None:
+            fixed = {'answer': answer, 'method': 'intent_classification', 'intent': intent,
+                     'sources': None, 'timings': None, 'followup': False}
+            prefix = self._prefixes[key] = dump_json(fixed)[:-1] + b','
+        return prefix
+    
+    def render(self, response: Dict) -> bytes:
+        """Octets d'une réponse (champs de QueryResponse)"""
+        if (response['method'] == 'intent_classification' and not response.get('sources')
+                and response.get('timings') is None):
+            variable = {'confidence': response['confidence'], 'latency_ms': response['latency_ms'],
+                        'cache': response.get('cache'), 'language': response.get('language')}
+            return self._prefix(response['intent'], response['answer']) + dump_json(variable)[1:]
+        return dump_json({field: response.get(field, QUERY_RESPONSE_DEFAULTS.get(field))
+                          for field in QUERY_RESPONSE_FIELDS})
+
+class StaticAsset:
+    """Fichier statique en mémoire et ses variantes compressées"""
+    
+    COMPRESSIBLE = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+    
+    def __init__(self, path: str, min_compress_bytes: int = 512):
+        with open(path, 'rb') as f:
+            body = f.read()
+        self.media_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if self.media_type.startswith('text/'):
+            self.media_type += '; charset=utf-8'
+        self.mtime = int(os.path.getmtime(path))
+        self.last_modified = email.utils.formatdate(self.mtime, usegmt=True)
+        # ETag faible : le même pour toutes les variantes compressées
+        self.etag = f'W/"{hashlib.sha1(body).hexdigest()[:20]}"'
+        
+        self.variants = {'identity': body}
+        if self.media_type.startswith(self.COMPRESSIBLE) and len(body) >= min_compress_bytes:
+            candidates = {'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                candidates['br'] = brotli.compress(body, quality=11)
+            self.variants.update({k: v for k, v in candidates.items() if len(v) < len(body)})
+    
+    def not_modified(self, headers) -> bool:
+        """Requête conditionnelle satisfaite (If-None-Match prioritaire)"""
+        if_none_match = headers.get('if-none-match')
+        if if_none_match is not None:
+            tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+            return '*' in tags or self.etag.removeprefix('W/') in tags
+        if_modified_since = headers.get('if-modified-since')
+        if if_modified_since:
+            try:
+                return self.mtime <= email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+    
+    def encoding_for(self, accept_encoding: str) -> str:
+        """Meilleure variante acceptée par le client (br, puis gzip)"""
+        accepted = set()
+        for part in accept_encoding.split(','):
+            name, _, params = part.strip().partition(';')
+            q = params.strip().removeprefix('q=')
+            try:
+                if params and float(q) <= 0:
+                    continue
+            except ValueError:
+                continue
+            accepted.add(name.strip().lower())
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and (encoding in accepted or '*' in accepted):
+                return encoding
+        return 'identity'
+
+class StaticAssets:
+    """Répertoire statique lu une fois et servi depuis la mémoire
+    
+    ETag, Last-Modified et réponses 304 pour les requêtes
+    conditionnelles ; variantes gzip/brotli précompressées au démarrage.
+    Un fichier modifié n'est pris en compte qu'au redémarrage.
+    """
+    
+    def __init__(self, directory: str):
+        self.files = {}
+        for root, _, names in os.walk(directory):
+            for name in names:
+                path = os.path.join(root, name)
+                self.files[os.path.relpath(path, directory).replace(os.sep, '/')] = StaticAsset(path)
+    
+    def response(self, name: str, request: Request, cache_control: str) -> Response:
+        asset = self.files.get(name)
+        if asset is None:
+            raise HTTPException(status_code=404, detail="Not Found")
+        headers = {'ETag': asset.etag, 'Last-Modified': asset.last_modified,
+                   'Cache-Control': cache_control, 'Vary': 'Accept-Encoding'}
+        if asset.not_modified(request.headers):
+            return Response(status_code=304, headers=headers)
+        encoding = asset.encoding_for(request.headers.get('accept-encoding', ''))
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        return Response(content=asset.variants[encoding], media_type=asset.media_type, headers=headers)
 
 # ============================================================================
 # APPLICATION FASTAPI
@@ -276,70 +3723,401 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialiser le chatbot (global)
+# Initialiser le chatbot et l'exécuteur (globaux)
 chatbot = None
+executor = None
+limiter = None
+profiler = SamplingProfiler()
+chat_payloads = ChatPayloads()
+static_assets = StaticAssets('static')
+if not static_assets.files:
+    logger.warning("Static directory not found")
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Protéger les endpoints d'administration par CONFIG['admin_token']"""
+    expected = CONFIG.get('admin_token')
+    if not expected or not x_admin_token or not hmac.compare_digest(x_admin_token, expected):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+def client_key(request: Request) -> str:
+    """Identité de limitation : clé d'API connue, sinon adresse du client"""
+    api_key = request.headers.get('x-api-key')
+    if api_key and any(hmac.compare_digest(api_key, k) for k in CONFIG['api_keys']):
+        return 'key:' + hashlib.sha256(api_key.encode()).hexdigest()[:16]
+    if CONFIG['trust_forwarded_for']:
+        forwarded = request.headers.get('x-forwarded-for')
+        if forwarded:
+            return forwarded.split(',')[0].strip()
+    return request.client.host if request.client else 'unknown'
+
+def admit_client(request: Request, messages: List[str],
+                 language: Optional[str] = None) -> Tuple[str, float]:
+    """Coût attendu des messages et débit du seau du client (429 si vide)
+    
+    Un message déjà dans le cache exact coûte `cached_cost` ; les autres
+    le coût moyen récent du client.
+    """
+    key = client_key(request)
+    cache, per_query = chatbot.query_cache, limiter.expected_cost(key)
+    cost = len(messages) * per_query
+    if cache is not None:
+        language = chatbot.known_language(language)
+        cost = sum(CONFIG['cached_cost']
+                   if cache.peek(cache_key(m, language or chatbot.detect_language(m))) is not None
+                   else per_query for m in messages)
+    retry_after = limiter.admit(key, cost)
+    if retry_after is not None:
+        chatbot.metrics.inc('um5_rate_limited_total')
+        raise HTTPException(status_code=429, detail="Rate limit exceeded",
+                            headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+    return key, cost
+
+def saturated(e: ExecutorSaturated) -> HTTPException:
+    """503 avec le délai estimé avant que la file se libère"""
+    detail = ("Inference queue full, retry later" if e.reason == 'queue_full'
+              else "Inference queue wait above SLO, retry later")
+    return HTTPException(status_code=503, detail=detail,
+                         headers={"Retry-After": str(math.ceil(e.retry_after_s))})
 
 @app.on_event("startup")
 async def startup_event():
     """Initialisation au démarrage"""
-    global chatbot
-    chatbot = HybridChatbot(CONFIG)
+    global chatbot, executor, limiter
+    # Les modèles se chargent en arrière-plan : le serveur accepte les
+    # connexions tout de suite et /health/ready indique quand il est prêt.
+    # Sous serve.py, le chatbot est déjà chargé par le processus parent.
+    if chatbot is None:
+        chatbot = HybridChatbot(CONFIG, wait=False)
+    executor = InferenceExecutor(CONFIG['inference_workers'], CONFIG['max_queue_depth'],
+                                 CONFIG['queue_slo_ms'], CONFIG['priority_cost_ms'])
+    limiter = ClientLimiter(CONFIG['rate_limit_rps'], CONFIG['rate_limit_burst'],
+                            CONFIG['rate_limit_max_clients'])
+    chat_payloads.precompile(chatbot.intent_templates)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Arrêt propre"""
+    profiler.stop()
+    if executor:
+        executor.shutdown()
+    if chatbot:
+        chatbot.close()
 
 @app.get("/", response_class=HTMLResponse)
-async def root():
-    """Page d'accueil avec interface de chat"""
-    with open('static/index.html', 'r', encoding='utf-8') as f:
-        return f.read()
+async def root(request: Request):
+    """Page d'accueil avec interface de chat (servie depuis la mémoire)"""
+    # no-cache : le navigateur revalide (304) à chaque visite
+    return static_assets.response('index.html', request, cache_control='no-cache')
+
+@app.get("/static/{path:path}")
+async def static_file(path: str, request: Request):
+    """Fichiers statiques (mémoire, variantes compressées, 304)"""
+    return static_assets.response(path, request, cache_control='public, max-age=3600')
+
+def component_states() -> Dict:
+    """État de chargement de chaque composant"""
+    if not chatbot:
+        return {}
+    return {name: c.snapshot() for name, c in chatbot.components.items()}
 
 @app.get("/health")
 async def health_check():
     """Health check"""
     return {
         "status": "healthy",
-        "model_loaded": chatbot is not None,
-        "device": str(chatbot.device) if chatbot else "N/A"
+        "model_loaded": bool(chatbot and chatbot.ready),
+        "device": str(chatbot.device) if chatbot else "N/A",
+        "components": component_states()
     }
 
+@app.get("/health/live")
+async def liveness():
+    """Liveness : le processus répond"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness():
+    """Readiness : les composants requis sont chargés"""
+    ready = bool(chatbot and chatbot.ready)
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "loading", "components": component_states()}
+    )
+
 @app.post("/api/chat", response_model=QueryResponse)
-async def chat(request: QueryRequest):
+async def chat(request: QueryRequest, http_request: Request):
     """Endpoint principal de chat"""
     try:
-        if not chatbot:
-            raise HTTPException(status_code=503, detail="Chatbot not initialized")
+        if not chatbot or not chatbot.ready:
+            raise HTTPException(status_code=503, detail="Chatbot not ready",
+                                headers={"Retry-After": "5"})
+        key, cost = admit_client(http_request, [request.message], request.language)
         
-        # Traiter la requête
-        response = chatbot.process_query(request.message)
+        # Traiter la requête hors de la boucle asyncio, priorité selon son coût ;
+        # une requête en échec n'est pas facturée
+        try:
+            response = await executor.run(chatbot.process_query, request.message,
+                                          request.include_timings, None, request.session_id,
+                                          request.language, cost=cost)
+        except ExecutorSaturated as e:
+            limiter.refund(key, cost)
+            raise saturated(e)
+        except Exception:
+            limiter.refund(key, cost)
+            raise
+        limiter.settle(key, cost, response_cost(response, CONFIG))
         
-        return QueryResponse(**response)
+        # Sérialisation directe (partie fixe précompilée pour les intentions)
+        return Response(content=chat_payloads.render(response), media_type='application/json')
     
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error processing query: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/chat/batch", response_model=BatchQueryResponse)
+async def chat_batch(request: BatchQueryRequest, http_request: Request):
+    """Traitement d'un lot de requêtes (évaluation, préchauffage des caches)"""
+    if not chatbot or not chatbot.ready:
+        raise HTTPException(status_code=503, detail="Chatbot not ready",
+                            headers={"Retry-After": "5"})
+    if len(request.messages) > CONFIG['max_bulk_queries']:
+        raise HTTPException(status_code=413,
+                            detail=f"Batch too large (max {CONFIG['max_bulk_queries']} messages)")
+    key, cost = admit_client(http_request, request.messages, request.language)
+    
+    try:
+        start = time.perf_counter()
+        try:
+            results = await executor.run(chatbot.process_queries, request.messages, None,
+                                         request.language, cost=cost)
+        except Exception:
+            limiter.refund(key, cost)
+            raise
+        limiter.settle(key, cost, sum(response_cost(r, CONFIG) for r in results),
+                       n_queries=max(1, len(results)))
+        body = (b'{"results":[' + b','.join(chat_payloads.render(r) for r in results)
+                + b'],"latency_ms":' + dump_json((time.perf_counter() - start) * 1000) + b'}')
+        return Response(content=body, media_type='application/json')
+    except ExecutorSaturated as e:
+        raise saturated(e)
+    except Exception as e:
+        logger.error(f"Error processing batch: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+STREAM_CHUNK_CHARS = 160
+
+def sse_event(event: str, data) -> str:
+    """Formater un événement Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def answer_chunks(text: str, size: int = STREAM_CHUNK_CHARS):
+    """Découper une réponse en morceaux, de préférence sur les espaces"""
+    start = 0
+    while start < len(text):
+        end = min(len(text), start + size)
+        if end < len(text):
+            space = text.rfind(' ', start, end)
+            if space > start:
+                end = space + 1
+        yield text[start:end]
+        start = end
+
+@app.post("/api/chat/stream")
+async def chat_stream(request: QueryRequest, http_request: Request):
+    """Chat en streaming (SSE)
+    
+    Événements : `route` (dès la classification), `answer` (morceaux de
+    la réponse), `sources` (documents RAG), puis `done` (métadonnées)
+    ou `error`.
+    """
+    if not chatbot or not chatbot.ready:
+        raise HTTPException(status_code=503, detail="Chatbot not ready",
+                            headers={"Retry-After": "5"})
+    
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    
+    def emit(event: str, data: Dict):
+        loop.call_soon_threadsafe(events.put_nowait, (event, data))
+    
+    key, cost = admit_client(http_request, [request.message], request.language)
+    try:
+        future = executor.submit(chatbot.process_query, request.message,
+                                 request.include_timings, emit, request.session_id,
+                                 request.language, cost=cost)
+    except ExecutorSaturated as e:
+        limiter.refund(key, cost)
+        raise saturated(e)
+    
+    def settle(done):
+        if done.cancelled() or done.exception() is not None:
+            limiter.refund(key, cost)
+        else:
+            limiter.settle(key, cost, response_cost(done.result(), CONFIG))
+    
+    future.add_done_callback(settle)
+    # Les événements émis avant la fin du calcul passent avant ce marqueur
+    future.add_done_callback(lambda _: events.put_nowait(None))
+    
+    async def stream():
+        while (item := await events.get()) is not None:
+            yield sse_event(*item)
+        
+        try:
+            response = future.result()
+        except Exception as e:
+            logger.error(f"Error processing query: {e}")
+            yield sse_event('error', {'detail': str(e)})
+            return
+        
+        for chunk in answer_chunks(response['answer']):
+            yield sse_event('answer', {'text': chunk})
+        if response['sources']:
+            yield sse_event('sources', response['sources'])
+        yield sse_event('done', {k: v for k, v in response.items() if k not in ('answer', 'sources')})
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/api/stats")
 async def get_stats():
     """Statistiques du modèle"""
-    if not chatbot:
-        raise HTTPException(status_code=503, detail="Chatbot not initialized")
+    if not chatbot or not chatbot.ready:
+        raise HTTPException(status_code=503, detail="Chatbot not ready")
     
-    return {
+    stats = {
         "model_info": {
-            "intent_model": "XLM-RoBERTa-base",
+            "intent_model": ("XLM-RoBERTa-base" if chatbot.intent_head is None
+                             else f"Tête linéaire ({chatbot.intent_head.method})"),
             "embedding_model": "MPNet-Base-V2",
+            "pipeline_mode": chatbot.pipeline_mode,
             "knowledge_base_size": len(chatbot.knowledge_base),
-            "device": str(chatbot.device)
+            "vector_index": chatbot.index.stats(),
+            "device": str(chatbot.device),
+            "inference_backend": chatbot.backend
         },
         "thresholds": {
-            "intent_confidence": CONFIG['intent_threshold'],
-            "similarity": CONFIG['similarity_threshold']
+            "intent_confidence": chatbot.intent_threshold,
+            "similarity": CONFIG['similarity_threshold'],
+            "by_language": CONFIG.get('language_thresholds', {})
         }
     }
+    
+    stats["knowledge_base"] = chatbot.snapshot.stats()
+    if chatbot.intent_batcher is not None:
+        stats["batching"] = chatbot.intent_batcher.stats()
+    if executor is not None:
+        stats["executor"] = executor.stats()
+    if limiter is not None:
+        stats["rate_limit"] = limiter.stats()
+    if chatbot.query_cache is not None:
+        stats["cache"] = chatbot.query_cache.stats()
+    if chatbot.embedding_cache is not None:
+        stats["embedding_cache"] = chatbot.embedding_cache.stats()
+    if chatbot.token_cache is not None:
+        stats["token_cache"] = chatbot.token_cache.stats()
+    if chatbot.speculation.mode != 'off':
+        stats["speculation"] = chatbot.speculation.stats()
+    if chatbot.sessions is not None:
+        stats["sessions"] = chatbot.sessions.stats()
+    stats["languages"] = chatbot.language_stats.stats()
+    
+    return stats
 
-# Monter les fichiers statiques
-try:
-    app.mount("/static", StaticFiles(directory="static"), name="static")
-except:
-    logger.warning("Static directory not found")
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Métriques au format texte Prometheus"""
+    lines = []
+    if chatbot:
+        lines.extend(chatbot.metrics.render())
+        
+        if chatbot.intent_batcher is not None:
+            lines.append("# TYPE um5_intent_batch_size histogram")
+            lines.extend(render_histogram("um5_intent_batch_size", chatbot.intent_batcher.batch_sizes, {}))
+            lines.append("# TYPE um5_intent_queue_wait_milliseconds histogram")
+            lines.extend(render_histogram("um5_intent_queue_wait_milliseconds",
+                                          chatbot.intent_batcher.queue_wait_ms, {}))
+        
+        caches = {'query': chatbot.query_cache, 'embedding': chatbot.embedding_cache,
+                  'token': chatbot.token_cache}
+        lines.append("# TYPE um5_cache_requests_total counter")
+        for name, cache in caches.items():
+            if cache is None:
+                continue
+            cache_stats = cache.stats()
+            hits = cache_stats.get('hits', cache_stats.get('exact_hits', 0) + cache_stats.get('semantic_hits', 0))
+            lines.append(f'um5_cache_requests_total{{cache="{name}",result="hit"}} {hits}')
+            lines.append(f'um5_cache_requests_total{{cache="{name}",result="miss"}} {cache_stats["misses"]}')
+        
+        lines.append("# TYPE um5_ready gauge")
+        lines.append(f"um5_ready {int(chatbot.ready)}")
+        
+        if chatbot.sessions is not None:
+            session_stats = chatbot.sessions.stats()
+            lines.append("# TYPE um5_sessions gauge")
+            lines.append(f"um5_sessions {session_stats['sessions']}")
+            lines.append("# TYPE um5_sessions_memory_bytes gauge")
+            lines.append(f"um5_sessions_memory_bytes {session_stats['memory_bytes']}")
+    
+    if executor is not None:
+        lines.append("# TYPE um5_executor_in_flight gauge")
+        lines.append(f"um5_executor_in_flight {executor.in_flight}")
+        lines.append("# TYPE um5_executor_queued gauge")
+        lines.append(f"um5_executor_queued {executor.queued}")
+        lines.append("# TYPE um5_executor_rejected_total counter")
+        for reason, count in executor.rejections.items():
+            lines.append(f'um5_executor_rejected_total{{reason="{reason}"}} {count}')
+        lines.append("# TYPE um5_executor_queue_wait_milliseconds histogram")
+        lines.extend(render_histogram("um5_executor_queue_wait_milliseconds", executor.queue_wait_ms, {}))
+    
+    return PlainTextResponse('\n'.join(lines) + '\n', media_type="text/plain; version=0.0.4")
+
+@app.post("/api/profiler/start", dependencies=[Depends(require_admin)])
+async def start_profiler(interval_ms: float = 5):
+    """Démarrer le profileur par échantillonnage"""
+    profiler.start(interval_ms)
+    return profiler.stats()
+
+@app.post("/api/profiler/stop", dependencies=[Depends(require_admin)])
+async def stop_profiler():
+    """Arrêter le profileur (les échantillons restent consultables)"""
+    profiler.stop()
+    return profiler.stats()
+
+@app.get("/api/profiler", response_class=PlainTextResponse, dependencies=[Depends(require_admin)])
+async def profiler_stacks():
+    """Piles échantillonnées (format collapsed : flamegraph.pl, speedscope)"""
+    return profiler.collapsed()
+
+@app.get("/api/admin/kb", dependencies=[Depends(require_admin)])
+async def knowledge_base_stats():
+    """État de la base vivante (version, delta, suppressions)"""
+    if not chatbot or not chatbot.ready:
+        raise HTTPException(status_code=503, detail="Chatbot not ready")
+    return chatbot.snapshot.stats()
+
+@app.post("/api/admin/kb", dependencies=[Depends(require_admin)])
+async def update_knowledge_base(request: KBUpdateRequest):
+    """Ajouter / modifier / supprimer des paires Q-A sans redémarrer"""
+    if not chatbot or not chatbot.ready:
+        raise HTTPException(status_code=503, detail="Chatbot not ready")
+    return await asyncio.to_thread(
+        chatbot.update_knowledge_base,
+        [entry.model_dump() for entry in request.upserts],
+        request.deletes
+    )
+
+@app.post("/api/admin/kb/compact", dependencies=[Depends(require_admin)])
+async def compact_knowledge_base():
+    """Refondre le delta dans la base (disque + index)"""
+    if not chatbot or not chatbot.ready:
+        raise HTTPException(status_code=503, detail="Chatbot not ready")
+    return await asyncio.to_thread(chatbot.compact_knowledge_base)
 
 # ============================================================================
 # MAIN
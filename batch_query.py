@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Traitement hors-ligne d'un fichier JSONL de questions (évaluation,
+préchauffage des caches) par lots, à mémoire bornée
+
+Chaque ligne d'entrée contient au moins `message` (ou `question`) ; les
+autres champs sont recopiés tels quels. Si `intent` est présent, la
+précision de la classification est rapportée.
+
+Usage :
+    python batch_query.py questions.jsonl --output reponses.jsonl
+    python batch_query.py questions.jsonl --url http://localhost:8000
+"""
+
+import argparse
+import json
+import sys
+import time
+import urllib.request
+from itertools import islice
+
+from app import CONFIG
+
+def read_chunks(path, chunk_size):
+    """Lire le JSONL par blocs de `chunk_size` lignes"""
+    with open(path, 'r', encoding='utf-8') as f:
+        rows = (json.loads(line) for line in f if line.strip())
+        while chunk := list(islice(rows, chunk_size)):
+            yield chunk
+
+def inprocess_target(batch_size):
+    """Chatbot chargé dans ce processus"""
+    from app import HybridChatbot
+    chatbot = HybridChatbot({**CONFIG, 'bulk_batch_size': batch_size})
+    return chatbot.process_queries, chatbot.close
+
+def http_target(url):
+    """Serveur démarré, via /api/chat/batch"""
+    def process(messages):
+        request = urllib.request.Request(
+            url.rstrip('/') + '/api/chat/batch',
+            data=json.dumps({'messages': messages}).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}
+        )
+        with urllib.request.urlopen(request) as response:
+            return json.load(response)['results']
+    return process, lambda: None
+
+def main():
+    parser = argparse.ArgumentParser(description="Traitement par lots pour le chatbot UM5")
+    parser.add_argument('input', help="Fichier JSONL de questions")
+    parser.add_argument('--output', default=None, help="Fichier JSONL des réponses (défaut : stdout)")
+    parser.add_argument('--chunk-size', type=int, default=CONFIG['max_bulk_queries'],
+                        help="Lignes lues et traitées à la fois")
+    parser.add_argument('--batch-size', type=int, default=CONFIG['bulk_batch_size'],
+                        help="Requêtes par forward pass (en process)")
+    parser.add_argument('--url', default=None, help="Passer par un serveur démarré")
+    parser.add_argument('--no-sources', action='store_true', help="Ne pas écrire les sources RAG")
+    args = parser.parse_args()
+
+    log = sys.stderr
+    print("="*70, file=log)
+    print("📦 TRAITEMENT PAR LOTS", file=log)
+    print("="*70, file=log)
+
+    if args.url:
+        chunk_size = min(args.chunk_size, CONFIG['max_bulk_queries'])
+        process, close = http_target(args.url)
+    else:
+        chunk_size = args.chunk_size
+        process, close = inprocess_target(args.batch_size)
+
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    n_queries, n_labeled, n_correct = 0, 0, 0
+    methods = {}
+    start = time.perf_counter()
+    try:
+        for chunk in read_chunks(args.input, chunk_size):
+            messages = [row.get('message', row.get('question', '')) for row in chunk]
+            for row, result in zip(chunk, process(messages)):
+                if args.no_sources:
+                    result.pop('sources', None)
+                out.write(json.dumps({**row, 'response': result}, ensure_ascii=False) + '\n')
+
+                methods[result['method']] = methods.get(result['method'], 0) + 1
+                if 'intent' in row:
+                    n_labeled += 1
+                    n_correct += row['intent'] == result['intent']
+            n_queries += len(chunk)
+            elapsed = time.perf_counter() - start
+            print(f"   {n_queries} requêtes ({n_queries / elapsed:.1f} req/s)", file=log)
+    finally:
+        close()
+        if out is not sys.stdout:
+            out.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"\n✅ {n_queries} requêtes en {elapsed:.1f}s ({n_queries / max(elapsed, 1e-9):.1f} req/s)", file=log)
+    for method, count in sorted(methods.items()):
+        print(f"   {method:<24}{count:>8}", file=log)
+    if n_labeled:
+        print(f"   Précision intention : {n_correct / n_labeled:.3f} ({n_labeled} étiquetées)", file=log)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,477 @@
+#!/usr/bin/env python3
+"""
+Banc de charge et de latence du chatbot UM5
+
+Pilote /api/chat (HTTP) ou HybridChatbot.process_query (en processus)
+avec un mélange de questions couvrant les routes intent / RAG / fallback,
+en boucle fermée (concurrence fixe) ou ouverte (arrivées de Poisson).
+Rapporte le débit et les p50/p95/p99 par route, et sauvegarde un JSON
+comparable d'un commit à l'autre.
+
+Usage :
+    python benchmark.py --fixture --concurrency 8 --requests 1000
+    python benchmark.py --target http --url http://localhost:8000 --rate 50 --requests 2000
+    python benchmark.py --fixture --output after.json --compare before.json
+    python benchmark.py --fixture --serve-workers 1 2 4 8 --output workers.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Questions typiques par route attendue, avec la part du trafic réel
+QUERY_MIX = {
+    'intent_classification': (0.68, [
+        "Comment m'inscrire à l'UM5?",
+        "Comment puis-je m'inscrire à l'UM5 ?",
+        "Quelles sont les bourses disponibles ?",
+        "Comment demander une bourse d'excellence ?",
+        "Quels sont les horaires de la bibliothèque ?",
+        "La bibliothèque est-elle ouverte le samedi ?",
+        "Comment consulter mon emploi du temps ?",
+        "Où trouver le planning des cours ?",
+    ]),
+    'rag_retrieval': (0.24, [
+        "Quels sont les axes de recherche en IA?",
+        "Quels laboratoires accueillent des doctorants ?",
+        "Comment s'inscrire en master à la FSJES ?",
+        "Quelles formations propose l'ENSIAS ?",
+        "Comment obtenir une attestation de scolarité ?",
+        "Quelles sont les conditions d'accès au doctorat ?",
+    ]),
+    'fallback': (0.08, [
+        "Quelle est la politique sur l'IA éthique?",
+        "Quel temps fera-t-il demain à Rabat ?",
+        "Peux-tu me raconter une blague ?",
+        "Qui a gagné le match hier soir ?",
+    ]),
+}
+
+# ============================================================================
+# FIXTURE : PETITS MODÈLES ALÉATOIRES (HORS-LIGNE)
+# ============================================================================
+
+FIXTURE_INTENTS = {
+    'inscription': "inscription inscrire dossier baccalauréat portail candidature master",
+    'bourses': "bourse excellence sociale financement aide mérite",
+    'emploi_du_temps': "emploi temps horaire cours planning semaine",
+    'bibliotheque': "bibliothèque livres horaires emprunt lecture salle samedi",
+    'recherche': "recherche laboratoire doctorat IA ENSIAS FSJES thèse",
+}
+
+def build_fixture(directory, entries_per_intent=40, seed=0):
+    """Construire une base et des modèles minuscules au format de production
+
+    Les poids sont aléatoires : la fixture mesure le coût du pipeline, pas
+    la qualité. Les seuils sont calibrés pour reproduire la répartition
+    des routes de QUERY_MIX.
+    """
+    import random
+
+    import sentencepiece as spm
+    import torch
+    from sentence_transformers import SentenceTransformer, models
+    from transformers import (XLMRobertaConfig, XLMRobertaForSequenceClassification,
+                              XLMRobertaModel, XLMRobertaTokenizer)
+
+    from app import CONFIG, HybridChatbot
+
+    rng = random.Random(seed)
+    torch.manual_seed(seed)
+    model_dir = os.path.join(directory, 'um5_hybrid_model')
+    embedder_dir = os.path.join(directory, 'embedding_model')
+    os.makedirs(model_dir, exist_ok=True)
+
+    # Base de connaissances synthétique
+    knowledge_base = []
+    for intent, vocabulary in FIXTURE_INTENTS.items():
+        words = vocabulary.split()
+        for i in range(entries_per_intent):
+            knowledge_base.append({
+                'question': ' '.join(rng.sample(words, 3)) + ' ?',
+                'answer': f"Réponse {intent} n°{i} : " + ' '.join(rng.sample(words, len(words))),
+                'intent': intent,
+            })
+
+    # Tokenizer SentencePiece entraîné sur la base et les questions de test
+    corpus_path = os.path.join(directory, 'corpus.txt')
+    with open(corpus_path, 'w', encoding='utf-8') as f:
+        for entry in knowledge_base:
+            f.write(f"{entry['question']}\n{entry['answer']}\n")
+        for _, queries in QUERY_MIX.values():
+            f.write('\n'.join(queries) + '\n')
+    spm.SentencePieceTrainer.train(
+        input=corpus_path, model_prefix=os.path.join(model_dir, 'sentencepiece.bpe'),
+        vocab_size=300, model_type='bpe', character_coverage=1.0,
+        hard_vocab_limit=False, minloglevel=2
+    )
+    tokenizer = XLMRobertaTokenizer(os.path.join(model_dir, 'sentencepiece.bpe.model'))
+
+    # Classifieur d'intention et modèle d'embedding minuscules
+    labels = list(FIXTURE_INTENTS)
+    encoder = dict(vocab_size=len(tokenizer), hidden_size=64, num_hidden_layers=2,
+                   num_attention_heads=2, intermediate_size=128, max_position_embeddings=160)
+    classifier = XLMRobertaForSequenceClassification(XLMRobertaConfig(
+        **encoder, num_labels=len(labels),
+        id2label=dict(enumerate(labels)), label2id={l: i for i, l in enumerate(labels)}
+    ))
+    classifier.save_pretrained(model_dir)
+    tokenizer.save_pretrained(model_dir)
+    with open(os.path.join(model_dir, 'label_mappings.json'), 'w') as f:
+        json.dump({'id2label': {str(i): l for i, l in enumerate(labels)},
+                   'label2id': {l: i for i, l in enumerate(labels)}}, f)
+
+    XLMRobertaModel(XLMRobertaConfig(**encoder)).save_pretrained(embedder_dir)
+    tokenizer.save_pretrained(embedder_dir)
+    transformer = models.Transformer(embedder_dir, max_seq_length=128)
+    embedder = SentenceTransformer(modules=[transformer, models.Pooling(64)])
+    embedder.save(embedder_dir)
+
+    with open(os.path.join(directory, 'knowledge_base.json'), 'w', encoding='utf-8') as f:
+        json.dump(knowledge_base, f, ensure_ascii=False)
+    embeddings = embedder.encode([e['question'] for e in knowledge_base])
+    np.savez(os.path.join(directory, 'vector_database.npz'), embeddings=embeddings)
+
+    # Seules les surcharges sont sauvegardées : pas de secrets (admin_token,
+    # api_keys) sur disque, et les autres clés suivent CONFIG
+    overrides = {
+        'model_path': model_dir,
+        'vector_db_path': os.path.join(directory, 'vector_database.npz'),
+        'knowledge_base_path': os.path.join(directory, 'knowledge_base.json'),
+        'kb_store_path': os.path.join(directory, 'kb_store'),
+        'kb_journal_path': os.path.join(directory, 'kb_journal.jsonl'),
+        'vector_index_path': os.path.join(directory, 'vector_index.npz'),
+        'onnx_model_dir': os.path.join(directory, 'um5_hybrid_model_onnx'),
+        'embedding_model': embedder_dir,
+        'eager_embedding_model': True,
+    }
+    config = {**CONFIG, **overrides}
+
+    # Calibrer les seuils sur le mélange de requêtes
+    chatbot = HybridChatbot({**config, 'max_batch_size': 1, 'query_cache_size': 0})
+    shares = {route: share for route, (share, _) in QUERY_MIX.items()}
+    queries = [q for _, qs in QUERY_MIX.values() for q in qs]
+    confidences = np.array([c for _, c in chatbot.classify_intents(queries)])
+    overrides['intent_threshold'] = float(np.quantile(confidences, 1 - shares['intent_classification']))
+    low = [q for q, c in zip(queries, confidences) if c < overrides['intent_threshold']]
+    best = np.array([docs[0]['similarity'] for docs in chatbot.search_similar_many(low)])
+    fallback_share = shares['fallback'] / (1 - shares['intent_classification'])
+    overrides['similarity_threshold'] = float(np.quantile(best, fallback_share))
+    chatbot.close()
+
+    with open(os.path.join(directory, 'fixture_config.json'), 'w') as f:
+        json.dump(overrides, f, indent=2)
+    return {**CONFIG, **overrides}
+
+def load_fixture(directory):
+    """Configuration de la fixture : CONFIG + surcharges (construite au premier appel)"""
+    from app import CONFIG
+
+    path = os.path.join(directory, 'fixture_config.json')
+    if os.path.exists(path):
+        with open(path) as f:
+            return {**CONFIG, **json.load(f)}
+    print(f"🔨 Construction de la fixture dans {directory}...")
+    return build_fixture(directory)
+
+# ============================================================================
+# CIBLES
+# ============================================================================
+
+def inprocess_target(chatbot):
+    """Appel direct de process_query"""
+    def send(query):
+        response = chatbot.process_query(query)
+        return response['method'], response.get('cache')
+    return send
+
+def http_target(url, timeout=30):
+    """POST /api/chat (bibliothèque standard uniquement)"""
+    def send(query):
+        request = urllib.request.Request(
+            f"{url.rstrip('/')}/api/chat",
+            data=json.dumps({'message': query}).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}
+        )
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            data = json.load(response)
+        return data['method'], data.get('cache')
+    return send
+
+def wait_ready(url, timeout=300, process=None):
+    """Attendre que /health/ready réponde 200"""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Serveur arrêté (code {process.returncode})")
+        try:
+            with urllib.request.urlopen(f"{url.rstrip('/')}/health/ready", timeout=2):
+                return
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.5)
+    raise TimeoutError(f"{url} pas prêt après {timeout}s")
+
+# ============================================================================
+# MÉMOIRE
+# ============================================================================
+
+def process_tree(pid):
+    """pid et tous ses descendants (/proc)"""
+    children = defaultdict(list)
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # Le nom du processus peut contenir des espaces : lire après ')'
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children[ppid].append(int(entry))
+    tree, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        tree.append(current)
+        stack.extend(children[current])
+    return tree
+
+def tree_memory(pid):
+    """RSS et PSS cumulés d'un arbre de processus (Mo)
+
+    La somme des RSS compte les pages partagées dans chaque worker ; la
+    PSS les répartit entre eux et mesure la mémoire réellement occupée.
+    """
+    totals = {'Rss': 0, 'Pss': 0}
+    processes = process_tree(pid)
+    for p in processes:
+        try:
+            with open(f'/proc/{p}/smaps_rollup') as f:
+                for line in f:
+                    key, _, value = line.partition(':')
+                    if key in totals:
+                        totals[key] += int(value.split()[0])
+        except OSError:
+            continue
+    return {'processes': len(processes), 'rss_mb': totals['Rss'] / 1024, 'pss_mb': totals['Pss'] / 1024}
+
+# ============================================================================
+# GÉNÉRATION DE CHARGE
+# ============================================================================
+
+def sample_queries(n, seed):
+    """Tirer n requêtes selon les parts de QUERY_MIX"""
+    rng = np.random.default_rng(seed)
+    routes = list(QUERY_MIX)
+    shares = np.array([QUERY_MIX[r][0] for r in routes])
+    picks = rng.choice(len(routes), size=n, p=shares / shares.sum())
+    return [QUERY_MIX[routes[i]][1][rng.integers(len(QUERY_MIX[routes[i]][1]))] for i in picks]
+
+def timed_call(send, query, started_at):
+    """Exécuter une requête ; latence mesurée depuis `started_at`"""
+    try:
+        route, cache = send(query)
+    except urllib.error.HTTPError as e:
+        route, cache = f"error_{e.code}", None
+    except Exception as e:
+        route, cache = f"error_{type(e).__name__}", None
+    return route, (time.perf_counter() - started_at) * 1000, cache
+
+def run_closed_loop(send, queries, concurrency):
+    """Concurrence fixe : chaque worker enchaîne les requêtes"""
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(lambda q: timed_call(send, q, time.perf_counter()), queries))
+
+def run_open_loop(send, queries, rate, max_workers=256, seed=0):
+    """Arrivées de Poisson à `rate` req/s, indépendantes des réponses
+
+    La latence part de l'instant d'arrivée prévu : l'attente côté client
+    quand le serveur sature est comptée (pas d'omission coordonnée).
+    """
+    rng = np.random.default_rng(seed)
+    arrivals = np.cumsum(rng.exponential(1.0 / rate, size=len(queries)))
+    futures = []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        start = time.perf_counter()
+        for query, offset in zip(queries, arrivals):
+            delay = start + offset - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(pool.submit(timed_call, send, query, start + offset))
+    return [f.result() for f in futures]
+
+def summarize(samples, wall_s):
+    """Débit global et percentiles par route"""
+    by_route = defaultdict(list)
+    cache_hits = defaultdict(int)
+    for route, latency_ms, cache in samples:
+        by_route[route].append(latency_ms)
+        by_route['all'].append(latency_ms)
+        cache_hits[route] += cache is not None
+
+    routes = {}
+    for route, latencies in sorted(by_route.items()):
+        latencies = np.array(latencies)
+        routes[route] = {
+            'count': len(latencies),
+            'cache_hits': cache_hits[route] if route != 'all' else sum(cache_hits.values()),
+            'mean_ms': float(latencies.mean()),
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p95_ms': float(np.percentile(latencies, 95)),
+            'p99_ms': float(np.percentile(latencies, 99)),
+        }
+    errors = sum(v['count'] for k, v in routes.items() if k.startswith('error_'))
+    return {'rps': len(samples) / wall_s, 'wall_s': wall_s, 'errors': errors, 'routes': routes}
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_summary(summary):
+    print(f"\n   Débit : {summary['rps']:.1f} req/s   Erreurs : {summary['errors']}")
+    print(f"\n   {'route':<24}{'n':>7}{'cache':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for route, row in summary['routes'].items():
+        print(f"   {route:<24}{row['count']:>7}{row['cache_hits']:>7}"
+              f"{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}")
+
+def print_comparison(summary, baseline):
+    """Écarts par rapport à un résultat précédent"""
+    def delta(new, old):
+        return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+
+    print(f"\n📈 Comparaison avec {baseline.get('commit') or 'la référence'}")
+    print(f"   Débit : {delta(summary['rps'], baseline['summary']['rps'])}")
+    for route, row in summary['routes'].items():
+        old = baseline['summary']['routes'].get(route)
+        if old:
+            print(f"   {route:<24}p50 {delta(row['p50_ms'], old['p50_ms']):>8}"
+                  f"   p99 {delta(row['p99_ms'], old['p99_ms']):>8}")
+
+def run_worker_sweep(args, worker_counts):
+    """Lancer serve.py pour chaque nombre de workers : débit, latence et mémoire"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    url = f"http://127.0.0.1:{args.port}"
+    rows = []
+    for n_workers in worker_counts:
+        command = [sys.executable, os.path.join(here, 'serve.py'),
+                   '--workers', str(n_workers), '--host', '127.0.0.1', '--port', str(args.port)]
+        if args.fixture:
+            load_fixture(args.fixture_dir)
+            command += ['--config', os.path.join(args.fixture_dir, 'fixture_config.json')]
+        print(f"\n🚀 {n_workers} worker(s)...")
+        server = subprocess.Popen(command, cwd=here)
+        try:
+            wait_ready(url, process=server)
+            send = http_target(url)
+            for query in sample_queries(args.warmup, args.seed + 1):
+                timed_call(send, query, time.perf_counter())
+            start = time.perf_counter()
+            samples = run_closed_loop(send, sample_queries(args.requests, args.seed), args.concurrency)
+            summary = summarize(samples, time.perf_counter() - start)
+            memory = tree_memory(server.pid)
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+        print_summary(summary)
+        rows.append({'workers': n_workers, 'memory': memory, 'summary': summary})
+
+    print(f"\n   {'workers':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'RSS Mo':>10}{'PSS Mo':>10}")
+    for row in rows:
+        total = row['summary']['routes']['all']
+        print(f"   {row['workers']:>8}{row['summary']['rps']:>10.1f}{total['p50_ms']:>10.1f}"
+              f"{total['p99_ms']:>10.1f}{row['memory']['rss_mb']:>10.0f}{row['memory']['pss_mb']:>10.0f}")
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Banc de charge du chatbot UM5")
+    parser.add_argument('--target', choices=['inprocess', 'http'], default='inprocess')
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--fixture', action='store_true',
+                        help="Utiliser de petits modèles aléatoires (hors-ligne)")
+    parser.add_argument('--fixture-dir', default='.bench_fixture')
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=None,
+                        help="Boucle ouverte : arrivées par seconde (sinon boucle fermée)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Désactiver les caches (cible en processus)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help="Fichier JSON des résultats")
+    parser.add_argument('--compare', default=None, help="Résultat JSON de référence")
+    parser.add_argument('--serve-workers', type=int, nargs='+', default=None,
+                        help="Lancer serve.py avec chacun de ces nombres de workers (débit + mémoire)")
+    parser.add_argument('--port', type=int, default=8765, help="Port des serveurs de --serve-workers")
+    args = parser.parse_args()
+
+    print("="*70)
+    print("🏁 BANC DE CHARGE UM5")
+    print("="*70)
+
+    if args.serve_workers:
+        rows = run_worker_sweep(args, args.serve_workers)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump({'commit': git_commit(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                           'params': {k: v for k, v in vars(args).items() if k != 'output'},
+                           'workers': rows}, f, indent=2)
+            print(f"\n   ✅ Résultats : {args.output}")
+        return
+
+    chatbot = None
+    if args.target == 'inprocess':
+        from app import CONFIG, HybridChatbot
+
+        config = load_fixture(args.fixture_dir) if args.fixture else dict(CONFIG)
+        if args.no_cache:
+            config.update(query_cache_size=0, embedding_cache_size=0, token_cache_size=0)
+        chatbot = HybridChatbot(config)
+        send = inprocess_target(chatbot)
+    else:
+        send = http_target(args.url)
+
+    queries = sample_queries(args.requests, args.seed)
+    for query in sample_queries(args.warmup, args.seed + 1):
+        timed_call(send, query, time.perf_counter())
+
+    mode = f"boucle ouverte {args.rate:g} req/s" if args.rate else f"concurrence {args.concurrency}"
+    print(f"\n🚀 {args.requests} requêtes ({args.target}, {mode})...")
+    start = time.perf_counter()
+    if args.rate:
+        samples = run_open_loop(send, queries, args.rate, seed=args.seed)
+    else:
+        samples = run_closed_loop(send, queries, args.concurrency)
+    summary = summarize(samples, time.perf_counter() - start)
+    print_summary(summary)
+
+    if chatbot is not None:
+        chatbot.close()
+
+    result = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'params': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')},
+        'summary': summary,
+    }
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(summary, json.load(f))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"\n   ✅ Résultats : {args.output}")
+
+if __name__ == "__main__":
+    main()
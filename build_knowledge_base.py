@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Construction locale de la base de connaissances (sans le notebook Kaggle)
+
+Lit des paires Q-A en flux depuis des fichiers JSONL, CSV ou JSON,
+écarte les questions quasi identiques (même texte normalisé : casse,
+accents, ponctuation finale, espaces), puis encode les questions avec
+le modèle d'embedding configuré : lots triés par longueur (peu de
+padding), répartis entre plusieurs processus, écrits au fur et à mesure
+dans une matrice projetée sur disque. Produit la base mmap
+(`kb_store_path`) dont le manifeste (modèle, dimension, somme de
+contrôle) est vérifié par HybridChatbot au chargement, et en option
+vector_database.npz + knowledge_base.json.
+
+Usage :
+    python build_knowledge_base.py data/qa.jsonl
+    python build_knowledge_base.py data/*.csv --workers 4 --batch-size 512
+    python build_knowledge_base.py data/qa.jsonl --json --dtype float16
+    python build_knowledge_base.py faq.csv --question-field Question --answer-field Réponse \\
+        --intent-field Catégorie --default-intent autre
+    python build_knowledge_base.py --verify
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import time
+from collections import Counter
+
+import numpy as np
+
+from app import (CONFIG, KnowledgeBaseWriter, MappedKnowledgeBase, check_kb_manifest,
+                 normalize_text, vector_db_manifest_path)
+
+# ----------------------------------------------------------------------------
+# Lecture en flux
+# ----------------------------------------------------------------------------
+
+def read_records(path):
+    """Lignes d'un fichier JSONL, CSV ou JSON (liste, format knowledge_base.json)"""
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        if extension == '.csv':
+            yield from csv.DictReader(f)
+        elif extension == '.json':
+            # Pas de lecture en flux possible pour une liste JSON
+            yield from json.load(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+def clean_records(paths, fields, default_intent, counts):
+    """Entrées complètes, une par question normalisée (la première est gardée)
+
+    Seules des empreintes sont gardées en mémoire. `counts` compte les
+    lignes lues, invalides, en double et en conflit (même question,
+    réponse différente).
+    """
+    seen = {}  # empreinte de la question -> empreinte de la réponse
+    for path in paths:
+        for row in read_records(path):
+            counts['read'] += 1
+            entry = {field: str(row.get(source) or '').strip() for field, source in fields.items()}
+            entry['intent'] = entry['intent'] or default_intent
+            if not (entry['question'] and entry['answer'] and entry['intent']):
+                counts['invalid'] += 1
+                continue
+            key = hashlib.blake2b(normalize_text(entry['question']).encode('utf-8'), digest_size=16).digest()
+            answer = hashlib.blake2b(entry['answer'].encode('utf-8'), digest_size=8).digest()
+            previous = seen.get(key)
+            if previous is not None:
+                counts['duplicates'] += 1
+                counts['conflicts'] += previous != answer
+                continue
+            seen[key] = answer
+            yield entry
+
+# ----------------------------------------------------------------------------
+# Encodage multi-processus
+# ----------------------------------------------------------------------------
+
+_model = None
+
+def init_worker(model_name, device, threads):
+    """Charger le modèle d'embedding une fois par processus"""
+    global _model
+    import torch
+    from sentence_transformers import SentenceTransformer
+    torch.set_num_threads(threads)
+    _model = SentenceTransformer(model_name, device=device)
+
+def encode_batch(task):
+    rows, texts = task
+    embeddings = _model.encode(texts, batch_size=len(texts), convert_to_numpy=True,
+                               normalize_embeddings=True, show_progress_bar=False)
+    return rows, embeddings.astype(np.float32)
+
+def length_sorted_batches(writer, batch_size):
+    """Lots de questions de longueurs voisines, les plus longs d'abord
+
+    Les plus longs partent en premier pour équilibrer la fin entre
+    processus ; les textes sont relus depuis le disque lot par lot.
+    """
+    lengths = writer.lengths('question')
+    order = np.argsort(-lengths, kind='stable')
+    for start in range(0, len(order), batch_size):
+        rows = order[start:start + batch_size]
+        yield rows, [writer.text('question', row) for row in rows]
+
+def encode_questions(writer, args):
+    """Remplir la matrice d'embeddings du writer ; retourne la dimension"""
+    threads = args.torch_threads or max(1, (os.cpu_count() or 1) // args.workers)
+    batches = length_sorted_batches(writer, args.batch_size)
+    n_batches = -(-writer.count // args.batch_size)
+
+    if args.workers > 1:
+        # spawn : pas d'état torch (ni CUDA) hérité du parent
+        pool = mp.get_context('spawn').Pool(args.workers, initializer=init_worker,
+                                            initargs=(args.model, args.device, threads))
+        results = pool.imap_unordered(encode_batch, batches)
+    else:
+        pool = None
+        init_worker(args.model, args.device, threads)
+        results = map(encode_batch, batches)
+
+    embeddings = None
+    start = time.perf_counter()
+    try:
+        for done, (rows, batch) in enumerate(results, 1):
+            if embeddings is None:
+                embeddings = writer.create_embeddings(batch.shape[1], args.dtype)
+            embeddings[rows] = batch
+            if done % args.log_every == 0 or done == n_batches:
+                encoded = min(done * args.batch_size, writer.count)
+                elapsed = time.perf_counter() - start
+                print(f"   {done}/{n_batches} lots, {encoded / elapsed:.0f} questions/s")
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return embeddings.shape[1]
+
+# ----------------------------------------------------------------------------
+# Artefacts au format Kaggle
+# ----------------------------------------------------------------------------
+
+def write_json_artifacts(store_path, config):
+    """vector_database.npz + knowledge_base.json (+ manifeste) depuis la base mmap"""
+    store = MappedKnowledgeBase(store_path)
+    vector_path, kb_path = config['vector_db_path'], config['knowledge_base_path']
+    # np.savez écrit la matrice projetée par blocs (pas de copie en mémoire)
+    with open(vector_path + '.tmp', 'wb') as f:
+        np.savez(f, embeddings=store.embeddings)
+    with open(kb_path + '.tmp', 'w', encoding='utf-8') as f:
+        f.write('[')
+        for i, entry in enumerate(store):
+            f.write((',\n' if i else '\n') + json.dumps(entry, ensure_ascii=False))
+        f.write('\n]\n')
+    manifest = {key: store.manifest[key] for key in ('count', 'dim', 'embedding_model', 'checksum')}
+    manifest_path = vector_db_manifest_path(config)
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    for path in (vector_path, kb_path, manifest_path):
+        os.replace(path + '.tmp', path)
+    return vector_path, kb_path
+
+# ----------------------------------------------------------------------------
+# Vérification (somme de contrôle complète, hors du démarrage du serveur)
+# ----------------------------------------------------------------------------
+
+def verify_store(path, config):
+    """Relire une base mmap et recalculer la somme de contrôle de ses embeddings"""
+    store = MappedKnowledgeBase(path)
+    check_kb_manifest(store.manifest, store.embeddings, len(store),
+                      {**config, 'kb_verify_checksum': True}, path)
+    return store.manifest
+
+def verify_json_artifacts(config):
+    """Même vérification pour vector_database.npz + knowledge_base.json (si manifeste)"""
+    manifest_path = vector_db_manifest_path(config)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    with open(config['knowledge_base_path'], 'r', encoding='utf-8') as f:
+        n_entries = len(json.load(f))
+    embeddings = np.load(config['vector_db_path'])['embeddings']
+    check_kb_manifest(manifest, embeddings, n_entries, {**config, 'kb_verify_checksum': True},
+                      config['vector_db_path'])
+    return manifest
+
+def verify(args):
+    """--verify : contrôler les bases existantes ; code de sortie 1 si l'une est invalide"""
+    ok = True
+    config = {**CONFIG, 'embedding_model': args.model}
+    checks = [(args.output, lambda: verify_store(args.output, config)
+               if os.path.exists(os.path.join(args.output, 'manifest.json')) else None),
+              (config['vector_db_path'], lambda: verify_json_artifacts(config))]
+    for path, check in checks:
+        start = time.perf_counter()
+        try:
+            manifest = check()
+        except (ValueError, OSError) as e:
+            print(f"   ❌ {e}")
+            ok = False
+            continue
+        if manifest is None:
+            print(f"   ⏭️  {path} : absent ou sans manifeste")
+        else:
+            print(f"   ✅ {path} : {manifest['count']} entrées, {manifest['checksum'][:19]}… "
+                  f"({time.perf_counter() - start:.1f}s)")
+    exit(0 if ok else 1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Construction de la base de connaissances UM5")
+    parser.add_argument('inputs', nargs='*', help="Fichiers JSONL, CSV ou JSON de paires Q-A")
+    parser.add_argument('--question-field', default='question')
+    parser.add_argument('--answer-field', default='answer')
+    parser.add_argument('--intent-field', default='intent')
+    parser.add_argument('--default-intent', default=None, help="Intention des lignes qui n'en ont pas")
+    parser.add_argument('--model', default=CONFIG['embedding_model'])
+    parser.add_argument('--device', default=None, help="cpu, cuda... (défaut : cuda si disponible)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Processus d'encodage (défaut : 1 sur GPU, min(4, cœurs) sur CPU)")
+    parser.add_argument('--torch-threads', type=int, default=None,
+                        help="Threads intra-op par processus (défaut : cœurs / workers)")
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--dtype', choices=['float32', 'float16'],
+                        default=CONFIG.get('embedding_dtype', 'float32'))
+    parser.add_argument('--output', default=CONFIG['kb_store_path'])
+    parser.add_argument('--json', action='store_true',
+                        help="Écrire aussi vector_database.npz et knowledge_base.json")
+    parser.add_argument('--log-every', type=int, default=50, help="Progression tous les N lots")
+    parser.add_argument('--verify', action='store_true',
+                        help="Vérifier les sommes de contrôle des bases existantes, sans rien construire")
+    args = parser.parse_args()
+
+    if args.verify:
+        print("="*70)
+        print("🔍 VÉRIFICATION DE LA BASE DE CONNAISSANCES")
+        print("="*70 + "\n")
+        verify(args)
+    if not args.inputs:
+        parser.error("fichiers d'entrée requis (ou --verify)")
+
+    if args.device is None:
+        import torch
+        args.device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    if args.workers is None:
+        args.workers = 1 if args.device.startswith('cuda') else min(4, os.cpu_count() or 1)
+
+    print("="*70)
+    print("🏗️  CONSTRUCTION DE LA BASE DE CONNAISSANCES")
+    print("="*70)
+
+    print(f"\n📥 Lecture de {len(args.inputs)} fichier(s)...")
+    start = time.perf_counter()
+    fields = {'question': args.question_field, 'answer': args.answer_field, 'intent': args.intent_field}
+    counts = Counter()
+    writer = KnowledgeBaseWriter(args.output)
+    for entry in clean_records(args.inputs, fields, args.default_intent, counts):
+        writer.append(entry)
+    writer.finish_texts()
+    print(f"   ✅ {writer.count} paires gardées sur {counts['read']} lignes "
+          f"({counts['duplicates']} doublons dont {counts['conflicts']} en conflit, "
+          f"{counts['invalid']} incomplètes) en {time.perf_counter() - start:.1f}s")
+    if writer.count == 0:
+        print("   ❌ Aucune paire Q-A : rien à construire")
+        exit(1)
+
+    print(f"\n🔢 Encodage : {args.model} sur {args.device}, {args.workers} processus, "
+          f"lots de {args.batch_size}")
+    start = time.perf_counter()
+    dim = encode_questions(writer, args)
+    encode_s = time.perf_counter() - start
+    print(f"   ✅ {writer.count} embeddings ({dim} dimensions) en {encode_s:.1f}s")
+
+    manifest = writer.commit(args.model, sources=[os.path.basename(p) for p in args.inputs],
+                             duplicates=counts['duplicates'])
+    print(f"\n💾 Base : {args.output} ({args.dtype}, {manifest['checksum'][:19]}…)")
+    # Relecture : la somme de contrôle n'est plus recalculée au démarrage
+    verify_store(args.output, {**CONFIG, 'embedding_model': args.model})
+    print("   ✅ Somme de contrôle vérifiée après relecture")
+
+    if args.json:
+        for path in write_json_artifacts(args.output, CONFIG):
+            print(f"   ✅ {path}")
+
+    # Les index dérivés de l'ancienne base ne correspondent plus
+    if os.path.abspath(args.output) == os.path.abspath(CONFIG['kb_store_path']):
+        for key in ('vector_index_path', 'lexical_index_path'):
+            path = CONFIG.get(key)
+            if path and os.path.exists(path):
+                os.remove(path)
+                print(f"   🗑️  {path} supprimé (obsolète)")
+        journal = CONFIG.get('kb_journal_path')
+        if journal and os.path.exists(journal):
+            print(f"   ⚠️  {journal} sera rejoué sur la nouvelle base au prochain démarrage")
+
+    print("\n💡 Index IVF : python build_vector_index.py (si CONFIG['vector_index'] = 'ivf')")
+
+if __name__ == "__main__":
+    main()
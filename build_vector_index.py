@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Construction hors-ligne de l'index vectoriel approximatif (IVF)
+et mesure du rappel@k / latence par rapport à la recherche exacte
+
+Usage :
+    python build_vector_index.py --n-lists 1024
+    python build_vector_index.py --evaluate-only --nprobe 1 4 8 16 32
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from app import (CONFIG, FlatIndex, IVFIndex, MappedKnowledgeBase, normalize_rows,
+                 vector_db_manifest_path)
+
+def load_embeddings(config):
+    """Base vectorielle normalisée et somme de contrôle de son manifeste
+
+    Même source que HybridChatbot : la base mmap si elle existe, sinon
+    vector_database.npz (somme de contrôle None sans manifeste).
+    """
+    dtype = np.dtype(config.get('embedding_dtype', 'float32'))
+    store_path = config.get('kb_store_path')
+    if store_path and os.path.exists(os.path.join(store_path, 'manifest.json')):
+        store = MappedKnowledgeBase(store_path)
+        return normalize_rows(np.asarray(store.embeddings), dtype=dtype), store.manifest.get('checksum')
+
+    vector_data = np.load(config['vector_db_path'])
+    source = None
+    manifest_path = vector_db_manifest_path(config)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            source = json.load(f).get('checksum')
+    return normalize_rows(vector_data['embeddings'], dtype=dtype), source
+
+def sample_queries(embeddings, n_queries, noise, seed=0):
+    """Requêtes de test : vecteurs de la base légèrement perturbés"""
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(embeddings.shape[0], min(n_queries, embeddings.shape[0]), replace=False)
+    queries = embeddings[rows].astype(np.float32)
+    queries += rng.normal(scale=noise, size=queries.shape).astype(np.float32)
+    return normalize_rows(queries)
+
+def timed_search(index, queries, top_k):
+    """Recherche requête par requête (comme en production) avec latences"""
+    indices, latencies_ms = [], []
+    for query in queries:
+        start = time.perf_counter()
+        found, _ = index.search(query[None], top_k)
+        latencies_ms.append((time.perf_counter() - start) * 1000)
+        indices.append(found[0])
+    return np.array(indices), np.array(latencies_ms)
+
+def recall_at_k(approx, exact):
+    """Proportion des voisins exacts retrouvés par l'index approximatif"""
+    hits = sum(len(set(a) & set(e)) for a, e in zip(approx, exact))
+    return hits / exact.size
+
+def evaluate(index, embeddings, queries, top_k, nprobes):
+    """Comparer l'index IVF à la recherche exacte pour plusieurs nprobe"""
+    exact_indices, exact_ms = timed_search(FlatIndex(embeddings), queries, top_k)
+    results = [{
+        'index': 'flat',
+        'recall_at_k': 1.0,
+        'p50_ms': float(np.percentile(exact_ms, 50)),
+        'p99_ms': float(np.percentile(exact_ms, 99)),
+    }]
+
+    for nprobe in nprobes:
+        index.nprobe = nprobe
+        approx_indices, approx_ms = timed_search(index, queries, top_k)
+        results.append({
+            'index': 'ivf',
+            'nprobe': nprobe,
+            'recall_at_k': recall_at_k(approx_indices, exact_indices),
+            'p50_ms': float(np.percentile(approx_ms, 50)),
+            'p99_ms': float(np.percentile(approx_ms, 99)),
+        })
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Index vectoriel IVF pour le chatbot UM5")
+    parser.add_argument('--n-lists', type=int, default=None,
+                        help="Nombre de listes inversées (défaut : ~sqrt(N))")
+    parser.add_argument('--n-iter', type=int, default=20, help="Itérations k-means")
+    parser.add_argument('--sample-size', type=int, default=None,
+                        help="Vecteurs échantillonnés pour l'entraînement k-means")
+    parser.add_argument('--output', default=CONFIG['vector_index_path'])
+    parser.add_argument('--evaluate-only', action='store_true',
+                        help="Évaluer un index existant sans le reconstruire")
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 8, 16, 32])
+    parser.add_argument('--top-k', type=int, default=CONFIG['top_k'])
+    parser.add_argument('--n-queries', type=int, default=500)
+    parser.add_argument('--noise', type=float, default=0.05,
+                        help="Bruit gaussien ajouté aux requêtes de test")
+    parser.add_argument('--report', default=None, help="Fichier JSON des résultats")
+    args = parser.parse_args()
+
+    print("="*70)
+    print("🧭 INDEX VECTORIEL IVF")
+    print("="*70)
+
+    embeddings, source = load_embeddings(CONFIG)
+    print(f"\n📥 {embeddings.shape[0]} vecteurs de dimension {embeddings.shape[1]}")
+
+    if args.evaluate_only:
+        index = IVFIndex.load(args.output, embeddings)
+        if index.source and source and index.source != source:
+            print("   ⚠️  Index construit sur une autre base : HybridChatbot ne l'utilisera pas")
+    else:
+        n_lists = args.n_lists or max(1, int(np.sqrt(embeddings.shape[0])))
+        print(f"\n🔨 Construction : {n_lists} listes, {args.n_iter} itérations k-means...")
+        start = time.perf_counter()
+        index = IVFIndex.build(embeddings, n_lists, n_iter=args.n_iter,
+                               sample_size=args.sample_size)
+        index.source = source
+        print(f"   ✅ Construit en {time.perf_counter() - start:.1f}s")
+        index.save(args.output)
+        print(f"   ✅ Sauvegardé : {args.output}")
+
+    print(f"\n📊 Rappel@{args.top_k} et latence ({args.n_queries} requêtes)")
+    queries = sample_queries(embeddings, args.n_queries, args.noise)
+    results = evaluate(index, embeddings, queries, args.top_k, args.nprobe)
+
+    print(f"\n   {'index':<8}{'nprobe':>8}{'rappel':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for row in results:
+        print(f"   {row['index']:<8}{row.get('nprobe', '-'):>8}{row['recall_at_k']:>10.3f}"
+              f"{row['p50_ms']:>10.3f}{row['p99_ms']:>10.3f}")
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'top_k': args.top_k, 'n_vectors': int(embeddings.shape[0]),
+                       'n_lists': int(index.centroids.shape[0]), 'results': results}, f, indent=2)
+        print(f"\n   ✅ Rapport : {args.report}")
+
+    print("\n💡 Activer l'index : CONFIG['vector_index'] = 'ivf' et choisir 'ivf_nprobe'")
+
+if __name__ == "__main__":
+    main()
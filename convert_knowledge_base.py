@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Conversion des artefacts Kaggle (vector_database.npz + knowledge_base.json)
+vers le format compact projeté en mémoire lu par HybridChatbot
+
+Usage :
+    python convert_knowledge_base.py
+    python convert_knowledge_base.py --dtype float16
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from app import CONFIG, MappedKnowledgeBase, check_kb_manifest
+
+def directory_size(path):
+    """Taille totale des fichiers d'un répertoire"""
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+def main():
+    parser = argparse.ArgumentParser(description="Conversion de la base UM5 au format mmap")
+    parser.add_argument('--vector-db', default=CONFIG['vector_db_path'])
+    parser.add_argument('--knowledge-base', default=CONFIG['knowledge_base_path'])
+    parser.add_argument('--output', default=CONFIG['kb_store_path'])
+    parser.add_argument('--dtype', choices=['float32', 'float16'],
+                        default=CONFIG.get('embedding_dtype', 'float32'))
+    args = parser.parse_args()
+
+    print("="*70)
+    print("🗜️  CONVERSION DE LA BASE DE CONNAISSANCES")
+    print("="*70)
+
+    print("\n📥 Chargement des artefacts...")
+    embeddings = np.load(args.vector_db)['embeddings']
+    with open(args.knowledge_base, 'r', encoding='utf-8') as f:
+        knowledge_base = json.load(f)
+    print(f"   ✅ {len(knowledge_base)} paires Q-A, embeddings {embeddings.shape}")
+
+    print(f"\n💾 Écriture : {args.output} ({args.dtype})")
+    MappedKnowledgeBase.write(args.output, embeddings, knowledge_base, dtype=args.dtype)
+    print(f"   ✅ {directory_size(args.output) / 1e6:.1f} MB")
+
+    # Vérification : relecture complète
+    start = time.perf_counter()
+    store = MappedKnowledgeBase(args.output)
+    open_ms = (time.perf_counter() - start) * 1000
+    mismatches = sum(store[i] != {k: entry[k] for k in ('question', 'answer', 'intent')}
+                     for i, entry in enumerate(knowledge_base))
+    if mismatches:
+        print(f"   ❌ {mismatches} entrées différentes après relecture")
+        exit(1)
+    check_kb_manifest(store.manifest, store.embeddings, len(store),
+                      {**CONFIG, 'kb_verify_checksum': True}, args.output)
+    print(f"   ✅ Relecture identique, somme de contrôle vérifiée (ouverture en {open_ms:.1f}ms)")
+
+    print("\n💡 HybridChatbot utilise automatiquement la base si CONFIG['kb_store_path'] existe")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Comparaison recherche dense / hybride BM25 / pré-filtrage lexical :
+taux de bonnes réponses et latence de la recherche
+
+Par défaut, les requêtes sont des questions de la base dont un mot est
+retiré ; la bonne réponse est l'entrée d'origine. Un fichier JSONL
+étiqueté (`question` ou `message`, et `intent` et/ou `expected_question`)
+peut être fourni à la place.
+
+Usage :
+    python eval_retrieval.py --n-queries 500
+    python eval_retrieval.py --queries eval.jsonl --report retrieval_report.json
+"""
+
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+
+from app import CONFIG, HybridChatbot, normalize_text
+
+# (mode de recherche, fusion)
+VARIANTS = [('dense', None), ('prefilter', None), ('hybrid', 'rrf'), ('hybrid', 'weighted')]
+
+def sample_queries(knowledge_base, n_queries, seed=0):
+    """Questions de la base avec un mot retiré (au moins trois mots restants)"""
+    rng = random.Random(seed)
+    rows = rng.sample(range(len(knowledge_base)), min(n_queries, len(knowledge_base)))
+    queries = []
+    for row in rows:
+        entry = knowledge_base[row]
+        words = entry['question'].split()
+        if len(words) > 3:
+            del words[rng.randrange(len(words))]
+        queries.append({'question': ' '.join(words), 'intent': entry['intent'],
+                        'expected_question': entry['question']})
+    return queries
+
+def read_queries(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    return [{**row, 'question': row.get('question', row.get('message', ''))} for row in rows]
+
+def evaluate(chatbot, queries, embeddings, mode, fusion, top_k):
+    """Recherche requête par requête (comme en production) : succès et latences"""
+    if fusion:
+        chatbot.config['hybrid_fusion'] = fusion
+    threshold = chatbot.config['similarity_threshold']
+    hits_1 = hits_k = intents = labeled = fallbacks = 0
+    latencies_ms = []
+    for query, embedding in zip(queries, embeddings):
+        start = time.perf_counter()
+        docs = chatbot.search_embeddings(embedding[None], top_k=top_k,
+                                         queries=[query['question']], mode=mode)[0]
+        latencies_ms.append((time.perf_counter() - start) * 1000)
+
+        fallbacks += not docs or max(doc['similarity'] for doc in docs) < threshold
+        if 'expected_question' in query:
+            expected = normalize_text(query['expected_question'])
+            found = [normalize_text(doc['question']) for doc in docs]
+            hits_1 += bool(found) and found[0] == expected
+            hits_k += expected in found
+        if 'intent' in query:
+            labeled += 1
+            intents += bool(docs) and docs[0]['intent'] == query['intent']
+
+    n_expected = sum('expected_question' in q for q in queries)
+    latencies_ms = np.array(latencies_ms)
+    return {
+        'mode': mode,
+        'fusion': fusion,
+        'hit_at_1': hits_1 / n_expected if n_expected else None,
+        'hit_at_k': hits_k / n_expected if n_expected else None,
+        'intent_at_1': intents / labeled if labeled else None,
+        'fallback_rate': fallbacks / len(queries),
+        'p50_ms': float(np.percentile(latencies_ms, 50)),
+        'p99_ms': float(np.percentile(latencies_ms, 99)),
+    }
+
+def fmt(value):
+    return f"{value:.3f}" if value is not None else "-"
+
+def main():
+    parser = argparse.ArgumentParser(description="Recherche dense vs hybride BM25 pour le chatbot UM5")
+    parser.add_argument('--queries', default=None, help="JSONL étiqueté (sinon questions de la base)")
+    parser.add_argument('--n-queries', type=int, default=500)
+    parser.add_argument('--top-k', type=int, default=CONFIG['top_k'])
+    parser.add_argument('--candidates', type=int, default=CONFIG['lexical_candidates'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--report', default=None, help="Fichier JSON des résultats")
+    args = parser.parse_args()
+
+    print("="*70)
+    print("🔎 RECHERCHE DENSE / HYBRIDE")
+    print("="*70)
+
+    # 'hybrid' force la construction de l'index BM25 ; le mode est choisi par appel
+    config = {**CONFIG, 'retrieval_mode': 'hybrid', 'lexical_candidates': args.candidates,
+              'eager_embedding_model': True, 'query_cache_size': 0, 'embedding_cache_size': 0}
+    chatbot = HybridChatbot(config)
+    try:
+        snapshot = chatbot.snapshot
+        queries = read_queries(args.queries) if args.queries else \
+            sample_queries(snapshot, args.n_queries, args.seed)
+        print(f"\n📥 {len(snapshot)} paires, {snapshot.lexical.stats()['terms']} termes BM25, "
+              f"{len(queries)} requêtes")
+        embeddings = chatbot.encode_queries([q['question'] for q in queries])
+
+        results = [evaluate(chatbot, queries, embeddings, mode, fusion, args.top_k)
+                   for mode, fusion in VARIANTS]
+    finally:
+        chatbot.close()
+
+    print(f"\n   {'mode':<20}{'hit@1':>8}{'hit@' + str(args.top_k):>8}{'intent':>8}"
+          f"{'fallback':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for row in results:
+        name = row['mode'] + (f"/{row['fusion']}" if row['fusion'] else '')
+        print(f"   {name:<20}{fmt(row['hit_at_1']):>8}{fmt(row['hit_at_k']):>8}{fmt(row['intent_at_1']):>8}"
+              f"{row['fallback_rate']:>10.3f}{row['p50_ms']:>10.3f}{row['p99_ms']:>10.3f}")
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'top_k': args.top_k, 'n_queries': len(queries),
+                       'candidates': args.candidates, 'results': results}, f, indent=2)
+        print(f"\n   ✅ Rapport : {args.report}")
+
+    print("\n💡 Activer : CONFIG['retrieval_mode'] = 'hybrid' ou 'prefilter'")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Export ONNX des modèles (intention + embedding) et vérification de la
+précision des backends optimisés par rapport au baseline PyTorch fp32
+
+Usage :
+    python export_inference_backends.py export
+    python export_inference_backends.py check --backends torch_int8 onnx
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import torch
+
+from app import (CONFIG, HybridChatbot, INFERENCE_BACKENDS, ONNX_EMBEDDING_FILE,
+                 ONNX_INTENT_FILE)
+
+SAMPLE_QUERIES = [
+    "Comment m'inscrire à l'UM5?",
+    "Quelles sont les bourses disponibles ?",
+    "Quels sont les horaires de la bibliothèque ?",
+    "Comment consulter mon emploi du temps ?",
+    "Quels sont les axes de recherche en IA?",
+    "Quelle est la politique sur l'IA éthique?",
+    "متى تبدأ التسجيلات في الجامعة؟",
+    "How do I apply for a scholarship?",
+]
+
+class IntentLogits(torch.nn.Module):
+    """Classifieur d'intention : (input_ids, attention_mask) -> logits"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+
+class SentenceEmbedding(torch.nn.Module):
+    """SentenceTransformer : (input_ids, attention_mask) -> embedding poolé"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        features = {'input_ids': input_ids, 'attention_mask': attention_mask}
+        return self.model(features)['sentence_embedding']
+
+def make_chatbot(backend):
+    """Chatbot sans cache ni batching, pour des mesures comparables"""
+    config = {
+        **CONFIG,
+        'inference_backend': backend,
+        'eager_embedding_model': True,
+        'max_batch_size': 1,
+        'query_cache_size': 0,
+        'embedding_cache_size': 0,
+        'token_cache_size': 0,
+    }
+    return HybridChatbot(config)
+
+def export_onnx(output_dir, opset):
+    """Exporter les deux modèles fp32 au format ONNX (axes batch/séquence dynamiques)"""
+    chatbot = make_chatbot('torch')
+    os.makedirs(output_dir, exist_ok=True)
+
+    dynamic_axes = {
+        'input_ids': {0: 'batch', 1: 'sequence'},
+        'attention_mask': {0: 'batch', 1: 'sequence'},
+    }
+    exports = [
+        (IntentLogits(chatbot.model), chatbot.tokenizer, ONNX_INTENT_FILE, 'logits'),
+        (SentenceEmbedding(chatbot.embedding_model), chatbot.embedding_model.tokenizer,
+         ONNX_EMBEDDING_FILE, 'sentence_embedding'),
+    ]
+    for module, tokenizer, filename, output_name in exports:
+        sample = tokenizer(SAMPLE_QUERIES[:2], return_tensors='pt', padding=True)
+        path = os.path.join(output_dir, filename)
+        torch.onnx.export(
+            module.eval(),
+            (sample['input_ids'], sample['attention_mask']),
+            path,
+            input_names=['input_ids', 'attention_mask'],
+            output_names=[output_name],
+            dynamic_axes={**dynamic_axes, output_name: {0: 'batch'}},
+            opset_version=opset
+        )
+        print(f"  ✅ {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+
+    chatbot.close()
+
+def measure(chatbot, queries):
+    """Intentions, embeddings et latences médianes requête par requête"""
+    intents, embeddings, intent_ms, embed_ms = [], [], [], []
+    for query in queries:
+        start = time.perf_counter()
+        intents.append(chatbot.classify_intent(query)[0])
+        intent_ms.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        embeddings.append(chatbot.encode_queries([query])[0])
+        embed_ms.append((time.perf_counter() - start) * 1000)
+
+    return intents, np.stack(embeddings), float(np.median(intent_ms)), float(np.median(embed_ms))
+
+def check_backends(backends, queries):
+    """Comparer chaque backend au baseline torch fp32"""
+    baseline = make_chatbot('torch')
+    base_intents, base_embeddings, base_intent_ms, base_embed_ms = measure(baseline, queries)
+    baseline.close()
+
+    results = [{
+        'backend': 'torch',
+        'intent_agreement': 1.0,
+        'cosine_drift_mean': 0.0,
+        'cosine_drift_max': 0.0,
+        'intent_p50_ms': base_intent_ms,
+        'embedding_p50_ms': base_embed_ms,
+    }]
+    for backend in backends:
+        chatbot = make_chatbot(backend)
+        intents, embeddings, intent_ms, embed_ms = measure(chatbot, queries)
+        chatbot.close()
+
+        drift = 1.0 - np.sum(base_embeddings * embeddings, axis=1)
+        results.append({
+            'backend': backend,
+            'intent_agreement': float(np.mean([a == b for a, b in zip(intents, base_intents)])),
+            'cosine_drift_mean': float(drift.mean()),
+            'cosine_drift_max': float(drift.max()),
+            'intent_p50_ms': intent_ms,
+            'embedding_p50_ms': embed_ms,
+        })
+    return results
+
+def load_queries(n_queries):
+    """Requêtes de vérification : exemples fixes + questions de la base"""
+    with open(CONFIG['knowledge_base_path'], 'r', encoding='utf-8') as f:
+        knowledge_base = json.load(f)
+    rng = np.random.default_rng(0)
+    rows = rng.choice(len(knowledge_base), min(n_queries, len(knowledge_base)), replace=False)
+    return SAMPLE_QUERIES + [knowledge_base[i]['question'] for i in rows]
+
+def main():
+    parser = argparse.ArgumentParser(description="Backends d'inférence optimisés pour le chatbot UM5")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    export = sub.add_parser('export', help="Exporter les modèles au format ONNX")
+    export.add_argument('--output', default=CONFIG['onnx_model_dir'])
+    export.add_argument('--opset', type=int, default=14)
+
+    check = sub.add_parser('check', help="Comparer les backends au baseline fp32")
+    check.add_argument('--backends', nargs='+', default=['torch_int8', 'onnx'],
+                       choices=[b for b in INFERENCE_BACKENDS if b != 'torch'])
+    check.add_argument('--n-queries', type=int, default=200)
+    check.add_argument('--report', default=None, help="Fichier JSON des résultats")
+    args = parser.parse_args()
+
+    print("="*70)
+    print("⚙️  BACKENDS D'INFÉRENCE")
+    print("="*70)
+
+    if args.command == 'export':
+        print(f"\n📦 Export ONNX vers {args.output}...")
+        export_onnx(args.output, args.opset)
+        print("\n💡 Activer : CONFIG['inference_backend'] = 'onnx'")
+        return
+
+    queries = load_queries(args.n_queries)
+    print(f"\n📊 Vérification sur {len(queries)} requêtes...")
+    results = check_backends(args.backends, queries)
+
+    print(f"\n   {'backend':<12}{'accord':>9}{'dérive moy':>12}{'dérive max':>12}"
+          f"{'intent ms':>11}{'embed ms':>10}")
+    for row in results:
+        print(f"   {row['backend']:<12}{row['intent_agreement']:>9.3f}"
+              f"{row['cosine_drift_mean']:>12.5f}{row['cosine_drift_max']:>12.5f}"
+              f"{row['intent_p50_ms']:>11.1f}{row['embedding_p50_ms']:>10.1f}")
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'n_queries': len(queries), 'results': results}, f, indent=2)
+        print(f"\n   ✅ Rapport : {args.report}")
+
+if __name__ == "__main__":
+    main()
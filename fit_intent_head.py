@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Tête d'intention du mode single_encoder : apprentissage sur les
+embeddings de la base de connaissances et comparaison avec le pipeline
+hybride (XLM-R + MPNet)
+
+Usage :
+    python fit_intent_head.py fit --method logreg --target-precision 0.95
+    python fit_intent_head.py eval --n-queries 500
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from app import CONFIG, HybridChatbot, IntentHead, MappedKnowledgeBase, normalize_rows
+
+def load_training_data(config):
+    """Embeddings normalisés et intentions de la base (mmap ou npz + json)"""
+    store_path = config.get('kb_store_path')
+    if store_path and os.path.exists(os.path.join(store_path, 'manifest.json')):
+        store = MappedKnowledgeBase(store_path)
+        labels = [store.intent_labels[code] for code in store.intent_codes]
+        return normalize_rows(np.asarray(store.embeddings)), labels, [e['question'] for e in store]
+
+    embeddings = np.load(config['vector_db_path'])['embeddings']
+    with open(config['knowledge_base_path'], 'r', encoding='utf-8') as f:
+        knowledge_base = json.load(f)
+    labels = [entry['intent'] for entry in knowledge_base]
+    return normalize_rows(embeddings), labels, [entry['question'] for entry in knowledge_base]
+
+def split_rows(n_rows, holdout, seed=0):
+    """Indices d'apprentissage / d'évaluation"""
+    rows = np.random.default_rng(seed).permutation(n_rows)
+    n_eval = max(1, int(n_rows * holdout))
+    return np.sort(rows[n_eval:]), np.sort(rows[:n_eval])
+
+def fit_logreg(embeddings, labels, c):
+    """Régression logistique multinomiale (scikit-learn)"""
+    from sklearn.linear_model import LogisticRegression
+    model = LogisticRegression(C=c, max_iter=1000)
+    model.fit(embeddings, labels)
+    weights, bias = model.coef_, model.intercept_
+    if len(model.classes_) == 2:
+        # Forme binaire (une ligne) → deux classes pour le softmax
+        weights, bias = np.vstack([-weights, weights]) / 2, np.array([-bias[0], bias[0]]) / 2
+    return IntentHead(weights, bias, model.classes_.tolist(), method='logreg')
+
+def calibrate_threshold(head, embeddings, labels, target_precision):
+    """Plus petit seuil de confiance atteignant la précision cible"""
+    predictions = head.predict(embeddings)
+    confidences = np.array([conf for _, conf in predictions])
+    correct = np.array([intent == label for (intent, _), label in zip(predictions, labels)])
+
+    order = np.argsort(-confidences)
+    precision = np.cumsum(correct[order]) / np.arange(1, len(order) + 1)
+    reached = np.nonzero(precision >= target_precision)[0]
+    if len(reached) == 0:
+        return 1.0, float(correct.mean()), 0.0
+    last = reached[-1]
+    return float(confidences[order][last]), float(correct.mean()), (last + 1) / len(order)
+
+def fit(args):
+    embeddings, labels, _ = load_training_data(CONFIG)
+    print(f"\n📥 {len(labels)} paires Q-A, {len(set(labels))} intentions")
+
+    train_rows, eval_rows = split_rows(len(labels), args.holdout)
+    train_labels = [labels[i] for i in train_rows]
+    eval_labels = [labels[i] for i in eval_rows]
+
+    print(f"\n🔨 Apprentissage ({args.method}) sur {len(train_rows)} exemples...")
+    start = time.perf_counter()
+    if args.method == 'centroid':
+        head = IntentHead.from_centroids(embeddings[train_rows], train_labels,
+                                         temperature=args.temperature)
+    else:
+        head = fit_logreg(embeddings[train_rows], train_labels, args.c)
+    print(f"   ✅ {time.perf_counter() - start:.1f}s")
+
+    head.threshold, accuracy, coverage = calibrate_threshold(
+        head, embeddings[eval_rows], eval_labels, args.target_precision
+    )
+    print(f"\n📊 Validation ({len(eval_rows)} exemples)")
+    print(f"   Précision top-1 : {accuracy:.3f}")
+    print(f"   Seuil pour {args.target_precision:.0%} de précision : {head.threshold:.3f} "
+          f"({coverage:.1%} des requêtes répondues par l'intention)")
+
+    head.save(args.output, eval_rows=eval_rows)
+    print(f"\n   ✅ Sauvegardé : {args.output}")
+    print("\n💡 Activer : CONFIG['pipeline_mode'] = 'single_encoder'")
+
+def resident_mb(chatbot):
+    """Taille des poids des modèles résidents"""
+    modules = [chatbot.embedding_model]
+    if chatbot.intent_head is None and hasattr(chatbot.model, 'parameters'):
+        modules.append(chatbot.model)
+    size = sum(p.numel() * p.element_size() for m in modules for p in m.parameters())
+    if chatbot.intent_head is not None:
+        size += chatbot.intent_head.weights.nbytes
+    return size / 1e6
+
+def evaluate_mode(mode, queries, labels):
+    """Précision d'intention et latence de bout en bout d'un mode de pipeline"""
+    config = {
+        **CONFIG,
+        'pipeline_mode': mode,
+        'eager_embedding_model': True,
+        'max_batch_size': 1,
+        'speculative_retrieval': 'off',
+        'query_cache_size': 0,
+        'embedding_cache_size': 0,
+        'token_cache_size': 0,
+    }
+    chatbot = HybridChatbot(config)
+    latencies, correct, routes = [], 0, {}
+    for query, label in zip(queries, labels):
+        response = chatbot.process_query(query)
+        latencies.append(response['latency_ms'])
+        correct += response['intent'] == label
+        routes[response['method']] = routes.get(response['method'], 0) + 1
+    result = {
+        'mode': mode,
+        'intent_accuracy': correct / len(queries),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'resident_models_mb': resident_mb(chatbot),
+        'routes': routes,
+    }
+    chatbot.close()
+    return result
+
+def evaluate(args):
+    _, labels, questions = load_training_data(CONFIG)
+    eval_rows = np.load(CONFIG['intent_head_path'])['eval_rows'][:args.n_queries]
+    queries = [questions[i] for i in eval_rows]
+    eval_labels = [labels[i] for i in eval_rows]
+    print(f"\n📊 {len(queries)} questions non vues par la tête")
+
+    results = [evaluate_mode(mode, queries, eval_labels) for mode in ('hybrid', 'single_encoder')]
+
+    print(f"\n   {'mode':<16}{'précision':>11}{'p50 ms':>10}{'p95 ms':>10}{'modèles MB':>12}")
+    for row in results:
+        print(f"   {row['mode']:<16}{row['intent_accuracy']:>11.3f}{row['p50_ms']:>10.1f}"
+              f"{row['p95_ms']:>10.1f}{row['resident_models_mb']:>12.1f}")
+        print(f"   {'':<16}routes : {row['routes']}")
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'n_queries': len(queries), 'results': results}, f, indent=2)
+        print(f"\n   ✅ Rapport : {args.report}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Tête d'intention du mode single_encoder")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    fit_parser = sub.add_parser('fit', help="Apprendre la tête sur les embeddings de la base")
+    fit_parser.add_argument('--method', choices=['logreg', 'centroid'], default='logreg')
+    fit_parser.add_argument('--c', type=float, default=10.0, help="Régularisation inverse (logreg)")
+    fit_parser.add_argument('--temperature', type=float, default=20.0, help="Échelle des cosinus (centroid)")
+    fit_parser.add_argument('--holdout', type=float, default=0.2, help="Part gardée pour la validation")
+    fit_parser.add_argument('--target-precision', type=float, default=0.95,
+                            help="Précision visée pour calibrer le seuil de confiance")
+    fit_parser.add_argument('--output', default=CONFIG['intent_head_path'])
+
+    eval_parser = sub.add_parser('eval', help="Comparer single_encoder au pipeline hybride")
+    eval_parser.add_argument('--n-queries', type=int, default=500)
+    eval_parser.add_argument('--report', default=None, help="Fichier JSON des résultats")
+    args = parser.parse_args()
+
+    print("="*70)
+    print("🎯 TÊTE D'INTENTION (SINGLE ENCODER)")
+    print("="*70)
+
+    if args.command == 'fit':
+        fit(args)
+    else:
+        evaluate(args)
+
+if __name__ == "__main__":
+    main()
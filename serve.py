@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Serveur multi-workers : modèles chargés une fois, partagés par fork
+
+Le processus parent charge HybridChatbot (XLM-R, MPNet, base, index),
+place les poids torch en mémoire partagée puis forke N workers uvicorn
+qui écoutent sur la même socket. Les workers héritent des modèles et de
+la base en copy-on-write : la mémoire n'augmente presque pas avec le
+nombre de workers. Le parent relance les workers qui meurent.
+
+Seul le worker 0 écrit le journal de la base et la base compactée sur
+disque, les autres compactent en mémoire ; les mises à jour à chaud via
+/api/admin/kb ne touchent que le worker qui les reçoit, utiliser
+`kb_watch_path` pour que tous les workers convergent.
+
+Usage :
+    python serve.py --workers 4
+    python serve.py --workers 8 --port 8000 --torch-threads 1
+    python serve.py --workers 2 --config .bench_fixture/fixture_config.json
+"""
+
+import argparse
+import gc
+import json
+import os
+import signal
+import socket
+import time
+
+import uvicorn
+
+import app as server
+from app import CONFIG, HybridChatbot, logger
+
+def bind_socket(host, port, backlog=2048):
+    """Socket d'écoute partagée par tous les workers"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+def run_worker(chatbot, sock, index, log_level):
+    """Corps d'un worker forké (ne retourne pas)"""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    chatbot.config['kb_writer'] = index == 0
+    chatbot.after_fork()
+    server.chatbot = chatbot
+
+    config = uvicorn.Config(server.app, log_level=log_level)
+    status = 0
+    try:
+        uvicorn.Server(config).run(sockets=[sock])
+    except Exception:
+        logger.exception(f"❌ Worker {index} arrêté sur erreur")
+        status = 1
+    os._exit(status)
+
+def main():
+    parser = argparse.ArgumentParser(description="Serveur multi-workers du chatbot UM5")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 8000)))
+    parser.add_argument('--torch-threads', type=int, default=None,
+                        help="Threads intra-op par worker (défaut : cœurs / workers)")
+    parser.add_argument('--inference-workers', type=int, default=None,
+                        help="Threads d'inférence par worker (défaut : CONFIG)")
+    parser.add_argument('--config', default=None,
+                        help="JSON de clés CONFIG à surcharger (ex. fixture du banc de charge)")
+    parser.add_argument('--log-level', default='warning')
+    args = parser.parse_args()
+
+    config = dict(CONFIG)
+    if args.config:
+        with open(args.config) as f:
+            config.update(json.load(f))
+    # Éviter la sursouscription : les workers se partagent les cœurs
+    config['torch_threads'] = args.torch_threads or max(1, (os.cpu_count() or 1) // args.workers)
+    if args.inference_workers:
+        config['inference_workers'] = args.inference_workers
+    server.CONFIG.update(config)
+
+    print("="*70)
+    print(f"🚀 Serveur UM5 : {args.workers} workers sur {args.host}:{args.port}")
+    print("="*70)
+
+    start = time.perf_counter()
+    chatbot = HybridChatbot(config)
+    chatbot.prepare_fork()
+    # Sortir les objets chargés du suivi du GC : ses passages ne
+    # réécrivent plus leurs en-têtes dans les pages partagées
+    gc.collect()
+    gc.freeze()
+    print(f"   Modèles chargés en {time.perf_counter() - start:.1f}s (pid {os.getpid()})")
+
+    sock = bind_socket(args.host, args.port)
+    workers = {}
+    stopping = False
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            run_worker(chatbot, sock, index, args.log_level)
+        workers[pid] = index
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for index in range(args.workers):
+        spawn(index)
+    print(f"   Workers : {sorted(workers)}")
+
+    # Superviser : relancer les workers morts jusqu'à l'arrêt
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = workers.pop(pid, None)
+        if index is not None and not stopping:
+            logger.warning(f"⚠️  Worker {index} (pid {pid}) terminé (statut {status}), relance")
+            spawn(index)
+    sock.close()
+
+if __name__ == "__main__":
+    main()
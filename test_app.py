@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Tests unitaires hors-ligne de app.py (sans serveur)
+
+Les tests de bout en bout utilisent la fixture de benchmark.py (petits
+modèles aléatoires construits dans un dossier temporaire).
+
+Usage :
+    python -m pytest -q test_app.py
+"""
+
+import asyncio
+import json
+import os
+import threading
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import app as server
+from app import (LATENCY_BUCKETS_MS, ClientLimiter, ExecutorSaturated, Histogram, HybridChatbot,
+                 InferenceExecutor, IVFIndex, normalize_rows, saturated)
+
+@pytest.fixture(scope='module')
+def fixture_config(tmp_path_factory):
+    from benchmark import build_fixture
+    return build_fixture(str(tmp_path_factory.mktemp('fixture')), entries_per_intent=5)
+
+def test_histogram_overflow_is_json_serializable():
+    histogram = Histogram(LATENCY_BUCKETS_MS)
+    histogram.observe(10_000)  # Au-delà de la dernière borne (5000 ms)
+    snapshot = histogram.snapshot()
+    json.dumps(snapshot, allow_nan=False)
+    assert snapshot['p50'] == snapshot['p99'] == LATENCY_BUCKETS_MS[-1]
+    assert snapshot['buckets']['+Inf'] == 1
+
+def test_query_after_deleting_every_entry(fixture_config, tmp_path):
+    # Seuil d'intention inatteignable : la requête passe par la recherche
+    config = {**fixture_config, 'kb_journal_path': str(tmp_path / 'kb_journal.jsonl'),
+              'intent_threshold': 1.1, 'query_cache_size': 0}
+    with open(config['knowledge_base_path'], encoding='utf-8') as f:
+        questions = [entry['question'] for entry in json.load(f)]
+    chatbot = HybridChatbot(config)
+    try:
+        chatbot.update_knowledge_base(deletes=questions)
+        response = chatbot.process_query("Quels sont les horaires de la bibliothèque ?")
+    finally:
+        chatbot.close()
+    assert response['method'] == 'fallback'
+    assert response['sources'] == []
+
+# ----------------------------------------------------------------------------
+# Base de connaissances vivante : journal, compaction
+# ----------------------------------------------------------------------------
+
+@pytest.fixture
+def kb_config(fixture_config, tmp_path):
+    """Fixture dont les fichiers écrits (journal, base mmap, index) vont dans tmp_path"""
+    return {**fixture_config, 'kb_journal_path': str(tmp_path / 'kb_journal.jsonl'),
+            'kb_store_path': str(tmp_path / 'kb_store'),
+            'vector_index_path': str(tmp_path / 'vector_index.npz'), 'query_cache_size': 0}
+
+def fixture_questions(config):
+    with open(config['knowledge_base_path'], encoding='utf-8') as f:
+        return [entry['question'] for entry in json.load(f)]
+
+def top_questions(chatbot, queries):
+    return [[doc['question'] for doc in docs] for docs in chatbot.search_similar_many(queries, top_k=3)]
+
+def test_upserts_are_replayed_from_journal_after_restart(kb_config):
+    entry = {'question': "Où se trouve le restaurant universitaire ?",
+             'answer': "Au campus Agdal.", 'intent': 'bibliotheque'}
+    chatbot = HybridChatbot(kb_config)
+    try:
+        n_entries = len(chatbot.snapshot)
+        chatbot.update_knowledge_base(upserts=[entry])
+    finally:
+        chatbot.close()
+    
+    chatbot = HybridChatbot(kb_config)
+    try:
+        assert len(chatbot.snapshot) == n_entries + 1
+        assert chatbot.snapshot.stats()['delta_rows'] == 1
+        best = chatbot.search_similar(entry['question'], top_k=1)[0]
+    finally:
+        chatbot.close()
+    assert (best['question'], best['answer']) == (entry['question'], entry['answer'])
+
+def test_compaction_writes_store_and_reassigns_ivf(kb_config):
+    config = {**kb_config, 'vector_index': 'ivf', 'ivf_nprobe': 4}
+    embeddings = normalize_rows(np.load(config['vector_db_path'])['embeddings'])
+    IVFIndex.build(embeddings, 4).save(config['vector_index_path'])
+    questions = fixture_questions(config)
+    deleted, queries = questions[:10], questions[20:30]
+    
+    chatbot = HybridChatbot(config)
+    try:
+        assert chatbot.snapshot.index.kind == 'ivf'
+        chatbot.update_knowledge_base(deletes=deleted)
+        compacted = chatbot.compact_knowledge_base()
+        expected = top_questions(chatbot, queries)
+        n_entries = len(chatbot.snapshot)
+    finally:
+        chatbot.close()
+    assert compacted['delta_rows'] == compacted['deleted_rows'] == 0
+    assert not os.path.exists(config['kb_journal_path'])
+    
+    chatbot = HybridChatbot(config)  # Rechargée depuis la base mmap écrite
+    try:
+        assert chatbot.snapshot.index.kind == 'ivf'
+        assert len(chatbot.snapshot) == n_entries
+        assert top_questions(chatbot, queries) == expected
+        remaining = {entry['question'] for entry in chatbot.snapshot}
+    finally:
+        chatbot.close()
+    assert not remaining & set(deleted)
+
+# ----------------------------------------------------------------------------
+# Exécuteur d'inférence et limitation de débit
+# ----------------------------------------------------------------------------
+
+def blocked_executor(**kwargs):
+    """Exécuteur à un worker occupé jusqu'à `gate.set()`"""
+    executor = InferenceExecutor(1, **kwargs)
+    gate, started = threading.Event(), threading.Event()
+    blocker = executor.submit(lambda: (started.set(), gate.wait(5)))
+    started.wait(5)
+    return executor, gate, blocker
+
+def test_executor_serves_cheapest_deadline_first():
+    async def scenario():
+        executor, gate, blocker = blocked_executor(max_queue_depth=8, priority_cost_ms=50)
+        order = []
+        tasks = [executor.submit(order.append, cost, cost=cost) for cost in (8, 1, 4)]
+        gate.set()
+        await asyncio.gather(blocker, *tasks)
+        executor.shutdown()
+        return order
+    assert asyncio.run(scenario()) == [1, 4, 8]
+
+def test_executor_rejects_when_queue_is_full():
+    async def scenario():
+        executor, gate, blocker = blocked_executor(max_queue_depth=1)
+        queued = executor.submit(lambda: None)
+        with pytest.raises(ExecutorSaturated) as rejected:
+            executor.submit(lambda: None)
+        gate.set()
+        await asyncio.gather(blocker, queued)
+        executor.shutdown()
+        return rejected.value, executor.rejections
+    error, rejections = asyncio.run(scenario())
+    assert error.reason == 'queue_full' and rejections['queue_full'] == 1
+    http_error = saturated(error)
+    assert http_error.status_code == 503 and int(http_error.headers['Retry-After']) >= 1
+
+def test_executor_sheds_above_slo_and_expires_stale_tasks():
+    async def scenario():
+        executor, gate, blocker = blocked_executor(max_queue_depth=8, queue_slo_ms=100)
+        executor.ms_per_cost = 60.0  # Durée observée par unité de coût
+        stale = executor.submit(lambda: 'computed', cost=2)  # Attente estimée 0 ms : admise
+        with pytest.raises(ExecutorSaturated) as rejected:
+            executor.submit(lambda: None)  # Derrière 2 × 60 ms > SLO
+        await asyncio.sleep(0.2)  # La tâche en file dépasse le SLO avant d'être servie
+        gate.set()
+        await blocker
+        with pytest.raises(ExecutorSaturated) as expired:
+            await stale
+        executor.shutdown()
+        return rejected.value, expired.value
+    rejected, expired = asyncio.run(scenario())
+    assert rejected.reason == 'slo' and rejected.retry_after_s >= 1
+    assert saturated(rejected).headers['Retry-After'] == '1'
+    assert expired.reason == 'expired'
+
+def test_limiter_refuses_after_burst_and_refunds():
+    limiter = ClientLimiter(rate=1.0, burst=3)
+    assert [limiter.admit('a', 1.0) for _ in range(3)] == [None, None, None]
+    retry_after = limiter.admit('a', 1.0)
+    assert retry_after is not None and 0 < retry_after <= 1.0
+    assert limiter.admit('b', 1.0) is None  # Seaux indépendants par client
+    limiter.refund('a', 1.0)
+    assert limiter.admit('a', 1.0) is None
+
+def test_limiter_settles_actual_cost_below_zero():
+    limiter = ClientLimiter(rate=1.0, burst=4)
+    assert limiter.admit('a', 1.0) is None
+    limiter.settle('a', 1.0, 8.0)  # Réponse RAG bien plus chère que prévu
+    assert limiter.admit('a', 0.2) > 4.0  # Solde négatif : attendre le remboursement
+    assert limiter.expected_cost('a') > 1.0
+
+@pytest.fixture
+def api_client(fixture_config, tmp_path, monkeypatch):
+    """Client HTTP sur l'app, chatbot de la fixture, coût de 1 par requête"""
+    config = {**fixture_config, 'kb_journal_path': str(tmp_path / 'kb_journal.jsonl')}
+    for key, value in {'rate_limit_rps': 0.001, 'rate_limit_burst': 2, 'cached_cost': 1.0,
+                       'route_costs': {'intent_classification': 1.0, 'rag_retrieval': 1.0,
+                                       'fallback': 1.0}}.items():
+        monkeypatch.setitem(server.CONFIG, key, value)
+    monkeypatch.setattr(server, 'chatbot', HybridChatbot(config))
+    with TestClient(server.app) as client:
+        yield client
+
+def test_chat_returns_429_once_burst_is_spent(api_client):
+    statuses = [api_client.post('/api/chat', json={'message': "Horaires de la bibliothèque ?"})
+                for _ in range(3)]
+    assert [r.status_code for r in statuses] == [200, 200, 429]
+    assert int(statuses[-1].headers['Retry-After']) >= 1
+
+def test_failed_chat_is_not_billed(api_client, monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError("modèle indisponible")
+    monkeypatch.setattr(server.chatbot, 'process_query', fail)
+    # Sans remboursement, la troisième requête serait refusée (429)
+    statuses = [api_client.post('/api/chat', json={'message': "Bonjour"}).status_code
+                for _ in range(3)]
+    assert statuses == [500, 500, 500]
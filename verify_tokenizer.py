@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Conversion et vérification du tokenizer rapide (Rust) du classifieur
+
+Convertit `sentencepiece.bpe.model` en tokenizer Rust, compare les token
+ids des deux tokenizers sur la base de connaissances (et un JSONL de
+questions en option), mesure leur débit et la distribution des
+longueurs. `tokenizer.json` n'est écrit dans le dossier du modèle que si
+tous les ids sont identiques : app.py l'utilise alors automatiquement.
+
+Usage :
+    python verify_tokenizer.py
+    python verify_tokenizer.py --texts questions.jsonl --check-embedding
+    python verify_tokenizer.py --dry-run --report tokenizer_report.json
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+from transformers import XLMRobertaTokenizer, XLMRobertaTokenizerFast
+
+from app import CONFIG, MAX_SEQ_LENGTH
+
+PROBES = [
+    "Comment m'inscrire à l'UM5 ?",
+    "متى تبدأ التسجيلات؟",
+    "Library opening hours",
+    "ⵜⴰⵎⴰⵣⵉⵖⵜ FSJES / ENSIAS — M1-INF 2024 !!",
+    "  espaces   multiples\tet\nretours  ",
+    "",
+]
+
+def load_texts(config, extra_path=None):
+    """Questions et réponses de la base, sondes et questions supplémentaires"""
+    with open(config['knowledge_base_path'], 'r', encoding='utf-8') as f:
+        knowledge_base = json.load(f)
+    questions = [entry['question'] for entry in knowledge_base]
+    texts = questions + [entry['answer'] for entry in knowledge_base] + PROBES
+    if extra_path:
+        with open(extra_path, 'r', encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        extra = [row.get('message', row.get('question', '')) for row in rows]
+        questions += extra
+        texts += extra
+    return questions, texts
+
+def encode(tokenizer, texts, batch_size=256):
+    """Token ids tronqués comme en production, et durée totale"""
+    ids = []
+    start = time.perf_counter()
+    for i in range(0, len(texts), batch_size):
+        ids.extend(tokenizer(texts[i:i + batch_size], max_length=MAX_SEQ_LENGTH,
+                             truncation=True)['input_ids'])
+    return ids, time.perf_counter() - start
+
+def mismatches(reference, candidate, texts):
+    return [(text, a, b) for text, a, b in zip(texts, reference, candidate) if a != b]
+
+def main():
+    parser = argparse.ArgumentParser(description="Tokenizer rapide du chatbot UM5")
+    parser.add_argument('--model-path', default=CONFIG['model_path'])
+    parser.add_argument('--texts', default=None, help="JSONL de questions supplémentaires")
+    parser.add_argument('--check-embedding', action='store_true',
+                        help="Vérifier aussi le tokenizer du modèle d'embedding (tokenisation partagée)")
+    parser.add_argument('--dry-run', action='store_true', help="Ne pas écrire tokenizer.json")
+    parser.add_argument('--report', default=None, help="Fichier JSON des résultats")
+    args = parser.parse_args()
+
+    print("="*70)
+    print("🔤 TOKENIZER RAPIDE")
+    print("="*70)
+
+    slow = XLMRobertaTokenizer.from_pretrained(args.model_path)
+    start = time.perf_counter()
+    fast = XLMRobertaTokenizerFast.from_pretrained(args.model_path, from_slow=True)
+    print(f"\n🔨 Conversion SentencePiece → Rust en {time.perf_counter() - start:.1f}s")
+
+    questions, texts = load_texts(dict(CONFIG, model_path=args.model_path), args.texts)
+    print(f"\n📥 {len(texts)} textes ({len(questions)} questions)")
+
+    slow_ids, slow_s = encode(slow, texts)
+    fast_ids, fast_s = encode(fast, texts)
+    fast_diff = mismatches(slow_ids, fast_ids, texts)
+
+    n_tokens = sum(len(ids) for ids in slow_ids)
+    print(f"\n   {'tokenizer':<14}{'textes/s':>12}{'tokens/s':>12}{'écarts':>10}")
+    for name, seconds, diff in (('sentencepiece', slow_s, 0), ('rust', fast_s, len(fast_diff))):
+        print(f"   {name:<14}{len(texts) / seconds:>12.0f}{n_tokens / seconds:>12.0f}{diff:>10}")
+
+    report = {
+        'n_texts': len(texts),
+        'slow_texts_per_s': len(texts) / slow_s,
+        'fast_texts_per_s': len(texts) / fast_s,
+        'fast_mismatches': len(fast_diff),
+    }
+
+    # Longueurs des questions : ce que paie réellement l'attention
+    lengths = np.array([len(ids) for ids in slow_ids[:len(questions)]])
+    report['question_tokens'] = {
+        'p50': float(np.percentile(lengths, 50)),
+        'p90': float(np.percentile(lengths, 90)),
+        'p99': float(np.percentile(lengths, 99)),
+        'max': int(lengths.max()),
+        'share_le_32': float((lengths <= 32).mean()),
+        'share_truncated': float((lengths >= MAX_SEQ_LENGTH).mean()),
+    }
+    q = report['question_tokens']
+    print(f"\n📏 Questions : p50 {q['p50']:.0f}, p90 {q['p90']:.0f}, p99 {q['p99']:.0f}, max {q['max']} tokens"
+          f" ; {q['share_le_32']:.1%} ≤ 32, {q['share_truncated']:.1%} tronquées à {MAX_SEQ_LENGTH}")
+
+    if args.check_embedding:
+        from sentence_transformers import SentenceTransformer
+        embedding_model = SentenceTransformer(CONFIG['embedding_model'])
+        embedding_ids, _ = encode(embedding_model.tokenizer, texts)
+        embedding_diff = mismatches(slow_ids, embedding_ids, texts)
+        shared = not embedding_diff and embedding_model.max_seq_length == MAX_SEQ_LENGTH
+        report['embedding_mismatches'] = len(embedding_diff)
+        report['shared_tokenization'] = shared
+        print(f"\n🔗 Modèle d'embedding : {len(embedding_diff)} écarts, "
+              f"max_seq_length {embedding_model.max_seq_length} → tokenisation partagée : {shared}")
+
+    for text, expected, found in fast_diff[:5]:
+        print(f"\n   ❌ {text[:60]!r}\n      sentencepiece {expected[:16]}\n      rust          {found[:16]}")
+
+    path = os.path.join(args.model_path, 'tokenizer.json')
+    if fast_diff:
+        print(f"\n❌ Token ids différents : {path} non écrit, le tokenizer SentencePiece reste utilisé")
+    elif args.dry_run:
+        print("\n✅ Token ids identiques (--dry-run : rien d'écrit)")
+    else:
+        fast.backend_tokenizer.save(path)
+        print(f"\n✅ Token ids identiques : {path} écrit, utilisé au prochain démarrage")
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n   ✅ Rapport : {args.report}")
+
+if __name__ == "__main__":
+    main()